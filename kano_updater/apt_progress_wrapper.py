@@ -46,6 +46,9 @@ class AptDownloadProgress(apt.progress.base.AcquireProgress):
         if len(item_desc.description) < 40:
             msg = "{} {}".format(msg, item_desc.description)
 
+        self._updater_progress.set_bytes(
+            self._phase_name, self.current_bytes, self.total_bytes
+        )
         self._updater_progress.next_step(self._phase_name, msg)
 
     def fail(self, item_desc):
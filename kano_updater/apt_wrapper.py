@@ -6,6 +6,11 @@
 # Interfacing with apt via python-apt
 
 
+import os
+import stat
+import pipes
+import hashlib
+
 import apt
 import aptsources.sourceslist
 
@@ -14,60 +19,26 @@ from kano.utils import run_cmd_log
 
 from kano_updater.apt_progress_wrapper import AptDownloadProgress, \
     AptOpProgress, AptInstallProgress, AptDownloadFailException
+from kano_updater.archive_fetcher import ArchiveFetcher, archive_filename
+from kano_updater.bandwidth import RateLimiter, is_interactive_session
+from kano_updater.deb_cache import DebCache
+import kano_updater.deltas as deltas
+from kano_updater.lan_share import add_peer_uris
 from kano_updater.os_version import get_system_version
+from kano_updater.paths import APT_LISTS_DIR, APT_ARCHIVES_DIR, \
+    UPGRADE_PLAN_PATH
 from kano_updater.progress import Phase
 import kano_updater.priority as Priority
 from kano_updater.special_packages import independent_install_list
 from kano_updater.retry import retry
-
-
-class AptPkgState(object):
-    MARKED_DELETE = 1
-    MARKED_DOWNGRADE = 2
-    MARKED_INSTALL = 3
-    MARKED_KEEP = 4
-    MARKED_REINSTALL = 5
-    MARKED_UPGRADE = 6
-    UNKNOWN = -1
-
-    @staticmethod
-    def get_package_state(pkg):
-        if pkg.marked_delete:
-            return AptPkgState.MARKED_DELETE
-        elif pkg.marked_downgrade:
-            return AptPkgState.MARKED_DOWNGRADE
-        elif pkg.marked_install:
-            return AptPkgState.MARKED_INSTALL
-        elif pkg.marked_keep:
-            return AptPkgState.MARKED_KEEP
-        elif pkg.marked_reinstall:
-            return AptPkgState.MARKED_REINSTALL
-        elif pkg.marked_upgrade:
-            return AptPkgState.MARKED_UPGRADE
-        else:
-            return AptPkgState.UNKNOWN
-
-    @staticmethod
-    def restore_pkg_state(pkg, state):
-        if state == AptPkgState.MARKED_DELETE:
-            return pkg.mark_delete()
-        elif state == AptPkgState.MARKED_DOWNGRADE:
-            return pkg.mark_downgrade()
-        elif state == AptPkgState.MARKED_INSTALL:
-            return pkg.mark_install()
-        elif state == AptPkgState.MARKED_KEEP:
-            return pkg.mark_keep()
-        elif state == AptPkgState.MARKED_REINSTALL:
-            return pkg.mark_reinstall()
-        elif state == AptPkgState.MARKED_UPGRADE:
-            return pkg.mark_upgrade()
-        else:  # AptPkgState.UNKNOWN
-            return
+from kano_updater.upgrade_plan import UpgradePlan, PlannedChange, \
+    PlannedArchive, split_batches, save_plan, load_plan, remove_plan
 
 
 class AptWrapper(object):
 
     _singleton_instance = None
+    _plan_file = UPGRADE_PLAN_PATH
 
     @staticmethod
     def get_instance():
@@ -85,6 +56,17 @@ class AptWrapper(object):
             AptWrapper._singleton_instance = self
 
         self._cache = None
+        self._cache_generation = 0
+        self._upgradable = None
+        self._upgrade_index = {}
+        self._space_estimates = {}
+        self._plans = {}
+        self._marked_plan = None
+        self._lists_fingerprint = None
+        self._rate_limiter = None
+        self._deb_cache = DebCache()
+        self._update_fetched_bytes = 0
+        self._update_succeeded = False
         self.refresh_instance()
 
     def refresh_instance(self):
@@ -96,13 +78,112 @@ class AptWrapper(object):
         apt.apt_pkg.config['DPkg::Options::'] = '--force-confdef'
         apt.apt_pkg.config['DPkg::Options::'] = '--force-confold'
 
+        # dpkg syncing every file it unpacks is what makes installing slow on
+        # SD cards, the filesystem is synced once after each commit instead.
+        apt.apt_pkg.config['DPkg::Options::'] = '--force-unsafe-io'
+
+        # Fetch only the changes to the package indexes, with all the patches
+        # merged into one on the client side.
+        apt.apt_pkg.config['Acquire::PDiffs'] = 'true'
+        apt.apt_pkg.config['Acquire::PDiffs::Merge'] = 'true'
+
         apt.apt_pkg.init_system()
 
         self._cache = apt.cache.Cache()
+        self._cache_opened()
+
+    def set_download_rate(self, max_rate=None):
+        '''
+        Limits the bandwidth used to download the archives, pausing the
+        downloads while someone is using the computer.
+
+        :param max_rate: Ceiling in bytes per second, None for no limit
+        '''
+
+        if max_rate:
+            logger.info("Limiting downloads to {} B/s".format(max_rate))
+            self._rate_limiter = RateLimiter(
+                max_rate, is_paused=is_interactive_session
+            )
+            dl_limit = str(max(1, max_rate / 1024))  # apt takes it in KB/s
+        else:
+            self._rate_limiter = None
+            dl_limit = '0'
+
+        # For anything that is left for apt to fetch
+        apt.apt_pkg.config['Acquire::http::Dl-Limit'] = dl_limit
+        apt.apt_pkg.config['Acquire::https::Dl-Limit'] = dl_limit
+
+    def _open_cache(self, op_progress=None, lists_fingerprint=None):
+        self._cache.open(op_progress)
+        self._cache_opened(lists_fingerprint=lists_fingerprint)
+
+    def _cache_opened(self, lists_fingerprint=None):
+        '''
+        Drops everything derived from the previous contents of the cache.
+        Must be called each time the apt cache is (re)opened.
+        '''
+
+        self._cache_generation += 1
+        self._upgradable = None
+        self._upgrade_index = {}
+        self._space_estimates = {}
+        self._plans = {}
+        self._marked_plan = None
+
+        if lists_fingerprint is None:
+            lists_fingerprint = self._get_lists_fingerprint()
+        self._lists_fingerprint = lists_fingerprint
+
+    @staticmethod
+    def _get_lists_fingerprint():
+        '''
+        Computes a digest of the apt package lists the cache is built from.
+
+        The name, size and mtime of every list is taken into account, together
+        with the contents of the Release and InRelease files as these carry
+        the hashes of all the indexes of a repository.
+
+        Returns:
+            str: The hex digest or None when the lists can't be read
+        '''
+
+        try:
+            list_names = sorted(os.listdir(APT_LISTS_DIR))
+        except OSError:
+            return None
+
+        digest = hashlib.sha256()
+
+        for list_name in list_names:
+            if list_name == 'lock':
+                continue
+
+            list_path = os.path.join(APT_LISTS_DIR, list_name)
+
+            try:
+                list_stat = os.stat(list_path)
+
+                if not stat.S_ISREG(list_stat.st_mode):
+                    continue
+
+                digest.update('{} {} {}\n'.format(
+                    list_name, list_stat.st_size, list_stat.st_mtime
+                ))
+
+                if list_name.endswith(('_Release', '_InRelease')):
+                    with open(list_path, 'rb') as release_file:
+                        digest.update(release_file.read())
+            except (IOError, OSError):
+                return None
+
+        return digest.hexdigest()
 
     def _update_cache(self, progress, src_count, sources_list):
+        self._update_succeeded = False
         try:
             self._do_update_cache(progress, src_count, sources_list)
+            self._update_succeeded = True
         except (
                 apt.cache.FetchFailedException, AptDownloadFailException
         ) as err:
@@ -119,8 +200,12 @@ class AptWrapper(object):
         '''
 
         apt_progress = AptDownloadProgress(progress, src_count)
-        self._cache.update(fetch_progress=apt_progress,
-                           sources_list=sources_list)
+        try:
+            self._cache.update(fetch_progress=apt_progress,
+                               sources_list=sources_list)
+        finally:
+            # python-apt keeps the counter as a float
+            self._update_fetched_bytes += int(apt_progress.fetched_bytes)
 
     def _fetch_archives(self, progress):
         try:
@@ -161,15 +246,49 @@ class AptWrapper(object):
         )
 
         progress.start(updating_sources)
+        self._update_fetched_bytes = 0
         self._update_cache(progress, src_count, sources_list)
+        logger.info("Fetched {} bytes of package indexes".format(
+            self._update_fetched_bytes
+        ))
 
         progress.start(cache_init)
+
+        # Reading the lists and building the dependency tree is the slowest
+        # part of the update, don't do it when the fetch didn't change them.
+        lists_fingerprint = self._get_lists_fingerprint()
+        if (
+                lists_fingerprint is not None and
+                lists_fingerprint == self._lists_fingerprint
+            ):
+            msg = N_("Package lists unchanged, reusing the apt cache")
+            logger.info(msg)
+            self._clear_marks()
+            progress.set_step(cache_init, 1, _(msg), skipped=True)
+            return
+
         ops = [("reading-package-lists", _("Reading package lists")),
                ("building-dependency-tree", _("Building dependency tree")),
                ("reading-state-information", _("Reading state information")),
                ("building-data-structures", _("Building data structures"))]
         op_progress = AptOpProgress(progress, ops)
-        self._cache.open(op_progress)
+        self._open_cache(op_progress, lists_fingerprint=lists_fingerprint)
+
+    @property
+    def update_fetched_bytes(self):
+        '''
+        Bytes transferred by the last update of the package indexes
+        '''
+
+        return self._update_fetched_bytes
+
+    @property
+    def update_succeeded(self):
+        '''
+        Whether the last update of the package indexes went through
+        '''
+
+        return self._update_succeeded
 
     def upgrade(self, packages, progress=None, priority=Priority.NONE):
         if not isinstance(packages, list):
@@ -196,16 +315,30 @@ class AptWrapper(object):
         progress.start(install)
         inst_progress = AptInstallProgress(progress)
         self._cache.commit(install_progress=inst_progress)
-        self._cache.open()
-        self._cache.clear()
+        self._sync()
+        self._open_cache()
+        self._clear_marks()
 
     def get_package(self, package_name):
         if package_name in self._cache:
             return self._cache[package_name]
 
-    def upgrade_all(self, progress=None, priority=Priority.NONE):
-        if priority != Priority.URGENT:
-            self._cache.upgrade(dist_upgrade=True)
+    def upgrade_all(self, progress=None, priority=Priority.NONE, plan=None,
+                    skip_batches=0, on_batch=None):
+        """Download and install the upgrade, one batch at a time.
+
+        Args:
+            progress (Progress): Where to report the progress to
+            priority (Priority): The priority of the upgrade
+            plan (UpgradePlan): The plan to install, solved if not given
+            skip_batches (int): Number of batches committed by an earlier,
+                interrupted run
+            on_batch (function): Called as `on_batch(index, names, committed)`
+                before and after committing each batch
+        """
+
+        if plan is None:
+            plan = self.get_upgrade_plan(priority=priority)
 
         phase_name = progress.get_current_phase().name
         download = "{}-downloading".format(phase_name)
@@ -216,22 +349,427 @@ class AptWrapper(object):
         )
 
         progress.start(download)
-        self.cache_updates(progress, priority=priority)
+        self.cache_updates(progress, priority=priority, plan=plan)
 
         progress.start(install)
-        inst_progress = AptInstallProgress(progress)
-        self._cache.commit(install_progress=inst_progress)
-        self._cache.open()
-        self._cache.clear()
+        self._commit_batches(progress, plan, skip_batches, on_batch)
 
-    def cache_updates(self, progress, priority=Priority.NONE):
-        self._mark_all_for_update(priority=priority)
+    def _commit_batches(self, progress, plan, skip_batches=0, on_batch=None):
+        batches = plan.get_batch_changes()
+        if not batches:
+            return
+
+        phase_name = progress.get_current_phase().name
+        phases = [
+            Phase(
+                "{}-batch-{}".format(phase_name, index),
+                _("Installing packages ({}/{})").format(
+                    index + 1, len(batches)
+                ),
+                len(batch),
+                # The batches differ from one upgrade to the next
+                in_history=False
+            )
+            for index, batch in enumerate(batches)
+        ]
+        progress.split(*phases)
+
+        index = 0
+        while index < len(batches):
+            batch = batches[index]
+            progress.start(phases[index].name)
+
+            if all(self._is_change_applied(change) for change in batch):
+                logger.info("Batch {} is installed already".format(index + 1))
+                index += 1
+                continue
+
+            if index < skip_batches:
+                logger.info("Batch {} was not completed, committing it again"
+                            .format(index + 1))
+
+            names = [change.name for change in batch]
+            last = index
+
+            if not self._mark_changes(batch):
+                # Shouldn't happen as the batches are closed over the
+                # relations of the packages, but the rest of the upgrade can
+                # still go through in one go.
+                logger.warn("Batch {} doesn't install on its own, "
+                            "committing the rest of the upgrade at once"
+                            .format(index + 1))
+
+                rest = [change for later in batches[index:] for change in later]
+                names = [change.name for change in rest]
+                last = len(batches) - 1
+
+                if not self._mark_changes(rest):
+                    self._clear_marks()
+                    self._mark_all_for_update(priority=plan.priority)
+
+            if on_batch:
+                on_batch(last, names, False)
+
+            inst_progress = AptInstallProgress(progress)
+            self._cache.commit(install_progress=inst_progress)
+            self._sync()
+            self._open_cache()
+            self._clear_marks()
+
+            if on_batch:
+                on_batch(last, names, True)
+
+            index = last + 1
+
+    def _mark_changes(self, changes):
+        '''
+        Mark the changes without resolving anything.
+
+        Returns:
+            bool: Whether the marks are consistent
+        '''
+
+        self._clear_marks()
+        with self._cache.actiongroup():
+            for change in changes:
+                if self._is_change_applied(change):
+                    continue
+
+                pkg = self._cache[change.name]
+                if change.is_delete:
+                    pkg.mark_delete(auto_fix=False)
+                else:
+                    pkg.mark_install(
+                        auto_fix=False, auto_inst=False,
+                        from_user=not change.is_auto
+                    )
+
+        return not self._cache.broken_count
+
+    def _is_change_applied(self, change):
+        if change.name not in self._cache:
+            return change.is_delete
+
+        installed = self._cache[change.name].installed
+        if change.is_delete:
+            return installed is None
+
+        return installed is not None and installed.version == change.version
+
+    @staticmethod
+    def _sync():
+        '''
+        Flush everything dpkg wrote before moving on, see `--force-unsafe-io`
+        '''
+
+        run_cmd_log('sync')
+
+    def cache_updates(self, progress, priority=Priority.NONE, plan=None):
+        if plan is None:
+            plan = self.get_upgrade_plan(priority=priority)
+        self._apply_plan(plan)
+
+        phase_name = progress.get_current_phase().name
+        fetching = "{}-fetching-archives".format(phase_name)
+        verifying = "{}-verifying-archives".format(phase_name)
+        progress.split(
+            Phase(fetching, _("Downloading packages"), 90),
+            Phase(verifying, _("Verifying packages"), 10)
+        )
+
+        progress.start(fetching)
+        items = plan.get_archive_items()
+        self._prefetch_archives(progress, items)
+
+        # apt verifies what has been fetched already and gets the rest
+        progress.start(verifying)
         self._fetch_archives(progress)
+        self._store_archives(items)
+
+    def get_upgrade_plan(self, priority=Priority.NONE):
+        """Solve the upgrade for the priority.
+
+        The resolver only runs once per priority until the cache is reopened,
+        the packages stay marked according to the most recent plan.
+
+        Returns:
+            UpgradePlan: The changes of the upgrade
+        """
+
+        key = (priority.priority, priority.os_match_required)
+        if key in self._plans:
+            return self._plans[key]
+
+        self._clear_marks()
+        self._mark_all_for_update(priority=priority)
+
+        changes = []
+        use_deltas = deltas.is_supported()
+        for pkg in self._cache.get_changes():
+            installed = pkg.installed
+
+            if pkg.marked_delete:
+                changes.append(PlannedChange(
+                    pkg.shortname, None, installed.version, True, False, None
+                ))
+                continue
+
+            version = pkg.candidate
+            changes.append(PlannedChange(
+                pkg.shortname, version.version,
+                installed.version if installed else None, False,
+                pkg.is_auto_installed,
+                self._get_planned_archive(pkg, use_deltas)
+            ))
+
+        names = [change.name for change in changes]
+        relations = {
+            name: self._get_related_packages(self._cache[name])
+            for name in names
+        }
+
+        plan = UpgradePlan(
+            self._cache_generation, priority, changes,
+            self._cache.required_download, self._cache.required_space,
+            split_batches(names, relations)
+        )
+        logger.info("Solved {}".format(plan))
+
+        self._plans[key] = plan
+        self._marked_plan = plan
+
+        return plan
+
+    def save_upgrade_plan(self, plan):
+        '''
+        Keep the plan around for the installation, it stays valid until the
+        package lists change.
+        '''
+
+        if not self._lists_fingerprint:
+            return
+
+        save_plan(plan, self._lists_fingerprint, self._plan_file)
+
+    def load_upgrade_plan(self, priority=Priority.NONE):
+        """Pick up the plan saved by a previous download.
+
+        The plan is only taken when it was solved from the current package
+        lists for the same installed versions, in which case the resolver
+        doesn't have to run again for the priority.
+
+        Returns:
+            UpgradePlan: The saved plan or None if it's not valid anymore
+        """
+
+        plan = load_plan(
+            priority, self._lists_fingerprint, self._cache_generation,
+            self._plan_file
+        )
+        if not plan:
+            return None
+
+        for change in plan.changes:
+            if change.name not in self._cache:
+                return None
+
+            pkg = self._cache[change.name]
+            installed = pkg.installed.version if pkg.installed else None
+            candidate = pkg.candidate.version if pkg.candidate else None
+
+            # Changes installed by an interrupted run still belong to it
+            if (
+                    installed not in (change.old_version, change.version) or
+                    (not change.is_delete and candidate != change.version)
+                ):
+                logger.info("{} changed since the plan was saved".format(
+                    change.name
+                ))
+                return None
+
+        logger.info("Loaded the saved {}".format(plan))
+
+        key = (priority.priority, priority.os_match_required)
+        self._plans[key] = plan
+
+        return plan
+
+    def remove_upgrade_plan(self):
+        remove_plan(self._plan_file)
+
+    def _apply_plan(self, plan):
+        '''
+        Mark the packages according to the plan, without running the resolver
+        again unless the marks don't hold together.
+        '''
+
+        if plan is self._marked_plan:
+            return
+
+        if plan.generation != self._cache_generation:
+            logger.warn("The plan is out of date, solving it again")
+            self._apply_plan(self.get_upgrade_plan(priority=plan.priority))
+            return
+
+        if not self._mark_changes(plan.changes):
+            logger.warn("Marking the plan broke packages, resolving again")
+            self._clear_marks()
+            self._mark_all_for_update(priority=plan.priority)
+
+        self._marked_plan = plan
+
+    def _clear_marks(self):
+        self._cache.clear()
+        self._marked_plan = None
+
+    def has_cached_updates(self, priority=Priority.NONE):
+        """Check whether all the updates can be installed without a network.
+
+        Returns:
+            bool: Whether the archives of all the upgradable packages are
+            available locally
+        """
+
+        plan = self.get_upgrade_plan(priority=priority)
+
+        # Archives without a checksum can't be looked up
+        if not plan.is_fetchable:
+            return False
+
+        items = plan.get_archive_items()
+        fetcher = ArchiveFetcher(items)
+        return all(
+            fetcher.is_fetched(item) or self._deb_cache.lookup(item.sha256)
+            for item in items
+        )
+
+    @staticmethod
+    def _get_related_packages(pkg):
+        '''
+        Names of the packages the installed and the candidate version of a
+        package depend on, break or conflict with.
+        '''
+
+        related = set()
+
+        for version in (pkg.installed, pkg.candidate):
+            if not version:
+                continue
+
+            for dependency in version.get_dependencies(
+                    'PreDepends', 'Depends', 'Breaks', 'Conflicts'
+                ):
+                for base in dependency.or_dependencies:
+                    related.add(base.name)
+
+        related.discard(pkg.name)
+
+        return related
+
+    @staticmethod
+    def _get_planned_archive(pkg, use_deltas):
+        version = pkg.candidate
+        if not version.uris or not version.sha256:
+            return None
+
+        filename = archive_filename(
+            pkg.shortname, version.version, version.architecture,
+            version.filename
+        )
+
+        delta_uris = ()
+        old_sha256 = None
+
+        installed = pkg.installed
+        if (
+                use_deltas and installed and
+                installed.version != version.version and
+                version.size >= deltas.MIN_DELTA_SIZE
+            ):
+            delta_uris = tuple(deltas.delta_uris(
+                version.uris, deltas.delta_filename(
+                    pkg.shortname, installed.version, version.version,
+                    version.architecture
+                )
+            ))
+            old_sha256 = installed.sha256
+
+        return PlannedArchive(
+            pkg.shortname, tuple(version.uris), filename, version.size,
+            version.sha256, delta_uris, old_sha256
+        )
+
+    def _prefetch_archives(self, progress, items):
+        '''
+        Download the marked archives in parallel ahead of apt. Whatever fails
+        here is left for apt to fetch.
+        '''
+
+        try:
+            pending = [
+                item for item in items
+                if not self._deb_cache.lookup(item.sha256)
+            ]
+            add_peer_uris(pending)
+
+            fetcher = ArchiveFetcher(
+                items, rate_limiter=self._rate_limiter,
+                deb_cache=self._deb_cache
+            )
+            failed = fetcher.fetch(progress, progress.get_current_phase().name)
+        except Exception as err:
+            logger.error("Prefetching the archives failed", exception=err)
+            return
+
+        if failed:
+            logger.warn("Leaving {} archives for apt to fetch".format(
+                len(failed)
+            ))
+
+    def _store_archives(self, items):
+        '''
+        Add the archives apt fetched to the package cache. They have been
+        verified by apt already.
+        '''
+
+        fetcher = ArchiveFetcher(items)
+        for item in items:
+            if fetcher.is_fetched(item):
+                self._deb_cache.store(fetcher.get_path(item), item.sha256)
 
     def upgradable_packages(self, priority=Priority.NONE):
-        for pkg in self._cache:
-            if self._is_package_upgradable(pkg, priority=priority):
-                yield pkg
+        index = self._get_upgrade_index(priority=priority)
+        for pkg in index[False] + index[True]:
+            yield pkg
+
+    def _get_upgrade_index(self, priority=Priority.NONE):
+        '''
+        Returns the packages upgradable with the given priority, bucketed by
+        whether they are in the independent install list, e.g.
+
+            {False: [<regular packages>], True: [<independent packages>]}
+
+        The whole cache is only walked once per cache generation to collect
+        the upgradable packages, each priority bucket is then filtered from
+        that much smaller set and kept until the cache is reopened.
+        '''
+
+        if self._upgradable is None:
+            self._upgradable = [
+                pkg for pkg in self._cache if pkg.is_upgradable
+            ]
+
+        key = (priority.priority, priority.os_match_required)
+        if key not in self._upgrade_index:
+            index = {False: [], True: []}
+            for pkg in self._upgradable:
+                if self._is_package_upgradable(pkg, priority=priority):
+                    is_independent = pkg.name in independent_install_list
+                    index[is_independent].append(pkg)
+
+            self._upgrade_index[key] = index
+
+        return self._upgrade_index[key]
 
     def _mark_all_for_update(self, priority=Priority.NONE):
         if priority < Priority.URGENT:
@@ -252,48 +790,118 @@ class AptWrapper(object):
 
     def get_required_upgrade_space(self, priority=Priority.NONE):
         '''
-        Retreives the required disk space to perform the upgrade in MB.
+        Estimates the required disk space to perform the upgrade in MB.
+
+        The estimate is summed from the candidate versions of the upgradable
+        packages rather than by running the resolver, so the state of the
+        cache is left untouched. Each upgrade counts for the growth over the
+        installed version, new dependencies of the candidates for their full
+        size and installed packages they conflict with are taken off, which
+        is what the depcache would report for the same changes. Archives
+        which have been downloaded already don't count towards it.
+
+        It's only calculated once per priority until the cache is reopened.
+        Once the upgrade has been solved, the sizes of the plan are used.
 
-        Note: the `required_download` and `required_space` reported from `apt`
-              is in bytes
+        Note: the `size` and `installed_size` reported from `apt` are in bytes
         '''
 
+        key = (priority.priority, priority.os_match_required)
+        if key in self._plans:
+            return self._plans[key].required_space / 1048576.
+
+        if key in self._space_estimates:
+            return self._space_estimates[key]
+
         logger.info("Calculating required free space for upgrade..")
 
+        required_download = 0
         required_space = 0
 
-        if priority < Priority.URGENT:
-            self._cache.upgrade(dist_upgrade=True)
-            required_space = (self._cache.required_download +
-                              self._cache.required_space) / 1048576.  # 1024^2
-            self._cache.clear()
+        changes = self._get_estimated_changes(priority)
+        for pkg in changes['install']:
+            version = pkg.candidate
+            required_space += version.installed_size
+            if pkg.installed:
+                required_space -= pkg.installed.installed_size
 
-        else:
-            orig_state = []
+            archive = os.path.join(APT_ARCHIVES_DIR, archive_filename(
+                pkg.shortname, version.version, version.architecture,
+                version.filename
+            ))
+            if (
+                    os.path.isfile(archive) and
+                    os.path.getsize(archive) == version.size
+                ):
+                continue
 
-            for pkg in self.upgradable_packages(priority=priority):
-                state = AptPkgState.get_package_state(pkg)
+            required_download += version.size
 
-                if state != AptPkgState.MARKED_UPGRADE:
-                    orig_state.append((pkg, state))
-                    logger.info("Marking {} ({}) for upgrade from state {}".format(
-                        pkg.shortname, pkg.candidate.version, state
-                    ))
-                    pkg.mark_upgrade()
+        for pkg in changes['remove']:
+            required_space -= pkg.installed.installed_size
 
-            required_space = (self._cache.required_download +
-                              self._cache.required_space) / 1048576.  # 1024^2
-
-            # Restore package states in reverse order
-            for pkg, state in reversed(orig_state):
-                logger.info("Restoring the pkg state {} for {} ({})".format(
-                    state, pkg.shortname, pkg.candidate.version
-                ))
-                AptPkgState.restore_pkg_state(pkg, state)
+        required_space = (required_download + required_space) / 1048576.
 
         logger.info("Required upgrade size is {} MB".format(required_space))
+        self._space_estimates[key] = required_space
+
         return required_space
 
+    def _get_estimated_changes(self, priority=Priority.NONE):
+        '''
+        Guesses the changes the resolver would make to upgrade the packages
+        of a priority without marking anything.
+
+        The upgradable packages are followed by the ones their candidates
+        depend on which aren't installed yet, down the dependency tree. The
+        installed packages the candidates conflict with and which aren't
+        upgraded themselves are expected to go.
+
+        Returns:
+            dict: The packages to install or upgrade under 'install' and the
+                  ones to remove under 'remove'
+        '''
+
+        install = list(self.upgradable_packages(priority=priority))
+        names = set(pkg.name for pkg in install)
+        conflicts = set()
+
+        queue = list(install)
+        while queue:
+            version = queue.pop(0).candidate
+
+            for dependency in version.get_dependencies(
+                    'PreDepends', 'Depends'
+                ):
+                alternatives = [
+                    base.name for base in dependency.or_dependencies
+                    if base.name in self._cache
+                ]
+                if any(
+                        name in names or self._cache[name].installed
+                        for name in alternatives
+                    ):
+                    continue
+
+                for name in alternatives:
+                    pkg = self._cache[name]
+                    if pkg.candidate:
+                        install.append(pkg)
+                        names.add(name)
+                        queue.append(pkg)
+                        break
+
+            for dependency in version.get_dependencies('Conflicts'):
+                for base in dependency.or_dependencies:
+                    conflicts.add(base.name)
+
+        remove = [
+            self._cache[name] for name in sorted(conflicts - names)
+            if name in self._cache and self._cache[name].installed
+        ]
+
+        return {'install': install, 'remove': remove}
+
     @staticmethod
     def _is_package_upgradable(pkg, priority=Priority.NONE):
         if not pkg.is_upgradable:
@@ -313,28 +921,28 @@ class AptWrapper(object):
         return True
 
     def independent_packages_available(self, priority=Priority.STANDARD):
-        pkgs = []
-        for pkg in self._cache:
-            if pkg.name in independent_install_list:
-                if self._is_package_upgradable(pkg, priority=priority):
-                    pkgs.append(pkg.name)
-
-        return pkgs
+        index = self._get_upgrade_index(priority=priority)
+        return [pkg.name for pkg in index[True]]
 
     def is_update_available(self, priority=Priority.STANDARD):
-        for pkg in self._cache:
-            # exclude independent packages, UNLESS this is an urgent update
-            if priority == Priority.URGENT or pkg.name not in independent_install_list:
-                if self._is_package_upgradable(pkg, priority=priority):
-                    return True
+        index = self._get_upgrade_index(priority=priority)
 
-        return False
+        # exclude independent packages, UNLESS this is an urgent update
+        if priority == Priority.URGENT and index[True]:
+            return True
+
+        return bool(index[False])
 
     def clear_cache(self):
-        self._cache.clear()
-        self._cache.open()
+        self._clear_marks()
+        self._open_cache()
+
+    def fix_broken(self, progress, pending_batch=None):
+        '''
+        Recovers from an interrupted installation. When the batch being
+        committed is known, only its packages are configured.
+        '''
 
-    def fix_broken(self, progress):
         progress.split(
             Phase('dpkg-clean',
                   _("Cleaning dpkg journal")),
@@ -343,11 +951,22 @@ class AptWrapper(object):
         )
         if self._cache.dpkg_journal_dirty:
             progress.start('dpkg-clean')
-            logger.info("Cleaning dpkg journal")
-            run_cmd_log("dpkg --configure -a")
 
-            self._cache.clear()
-            self._cache.open()
+            if pending_batch:
+                logger.info("Configuring the interrupted batch")
+                run_cmd_log("dpkg --configure {}".format(
+                    ' '.join(pipes.quote(name) for name in pending_batch)
+                ))
+
+                self._clear_marks()
+                self._open_cache()
+
+            if self._cache.dpkg_journal_dirty:
+                logger.info("Cleaning dpkg journal")
+                run_cmd_log("dpkg --configure -a")
+
+                self._clear_marks()
+                self._open_cache()
 
         progress.start('fix-broken')
 
@@ -358,5 +977,5 @@ class AptWrapper(object):
             except SystemError as e:
                 logger.error('Error attempting to fix broken pkgs', exception=e)
 
-            self._cache.clear()
-            self._cache.open()
+            self._clear_marks()
+            self._open_cache()
@@ -0,0 +1,477 @@
+# archive_fetcher.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Parallel and resumable fetching of the apt archives marked for the upgrade.
+#
+# The archives are downloaded straight into the apt archives directory under
+# the names apt expects, so that the following `fetch_archives()` from apt
+# finds them already in place, verifies them and only downloads what's left.
+
+
+import os
+import time
+import socket
+import hashlib
+import httplib
+import threading
+import Queue
+
+from kano.logging import logger
+
+from kano_updater.deb_cache import file_sha256
+from kano_updater.deltas import DeltaError, DELTA_EXTENSION, apply_delta
+from kano_updater.monitor_heartbeat import heartbeat
+from kano_updater.paths import APT_ARCHIVES_DIR
+from kano_updater.retry import RETRIES
+import kano_updater.http_pool as http_pool
+
+
+CONNECTIONS = 3
+CHUNK_SIZE = 64 * 1024  # bytes
+RETRY_DELAY = 3  # seconds
+RETRY_BACKOFF = 2
+
+
+class FetchError(Exception):
+    pass
+
+
+class HashMismatchError(FetchError):
+    pass
+
+
+def _quote(string, bad_chars):
+    # Equivalent of apt's QuoteString()
+    return ''.join(
+        '%{:02x}'.format(ord(char))
+        if char in bad_chars or char == '%' or ord(char) <= 0x20 or ord(char) >= 0x7f
+        else char
+        for char in string
+    )
+
+
+def archive_filename(name, version, architecture, filename):
+    """Name under which apt stores the archive of a package version.
+
+    Args:
+        name (str): Name of the package
+        version (str): The version string
+        architecture (str): Architecture of the version
+        filename (str): Path of the archive in the repository
+
+    Returns:
+        str: File name inside the apt archives directory
+    """
+
+    extension = os.path.splitext(filename)[1].lstrip('.') or 'deb'
+
+    return '{}_{}_{}.{}'.format(
+        _quote(name, '_:'),
+        _quote(version, '_:'),
+        _quote(architecture, '_:.'),
+        extension
+    )
+
+
+class ArchiveItem(object):
+    '''
+    A single archive to be fetched
+
+    :param name: Name of the package, used for reporting
+    :param uris: The URIs the archive can be downloaded from, in order
+    :param filename: File name inside the apt archives directory
+    :param size: Expected size in bytes
+    :param sha256: Expected SHA256 hex digest
+    :param delta_uris: The URIs of a delta from the installed version
+    :param old_sha256: SHA256 of the archive of the installed version
+    '''
+
+    def __init__(self, name, uris, filename, size, sha256, delta_uris=None,
+                 old_sha256=None):
+        self.name = name
+        self.uris = list(uris)
+        self.filename = filename
+        self.size = size
+        self.sha256 = sha256
+        self.delta_uris = list(delta_uris or [])
+        self.old_sha256 = old_sha256
+
+        self.error = None
+
+
+class ArchiveFetcher(object):
+    '''
+    Fetches archives with a bounded number of concurrent connections.
+
+    Partially downloaded archives are resumed with range requests, the
+    content is hashed while it streams in and when some archives fail, only
+    those are retried. Items with deltas are first reconstructed from them,
+    falling back to the full archive when that fails.
+
+    When given a :class:`kano_updater.bandwidth.RateLimiter`, all the
+    connections draw from it. When given a
+    :class:`kano_updater.deb_cache.DebCache`, archives are taken from it
+    before going to the network and the fetched ones are added to it.
+    '''
+
+    def __init__(self, items, archives_dir=APT_ARCHIVES_DIR,
+                 connections=CONNECTIONS, retries=RETRIES, rate_limiter=None,
+                 deb_cache=None):
+        self._items = items
+        self._rate_limiter = rate_limiter
+        self._deb_cache = deb_cache
+        self._archives_dir = archives_dir
+        self._partial_dir = os.path.join(archives_dir, 'partial')
+        self._connections = max(1, connections)
+        self._retries = retries
+
+        self._bytes_done = 0
+        self._bytes_total = sum(item.size for item in items)
+
+    def get_path(self, item):
+        return os.path.join(self._archives_dir, item.filename)
+
+    def get_partial_path(self, item):
+        return os.path.join(self._partial_dir, item.filename)
+
+    def is_fetched(self, item):
+        path = self.get_path(item)
+        return os.path.isfile(path) and os.path.getsize(path) == item.size
+
+    def fetch(self, progress, phase_name):
+        """Fetch all the archives which aren't in the archives directory yet.
+
+        Args:
+            progress (Progress): Progress to report each fetched archive to
+            phase_name (str): The phase of the progress to report to
+
+        Returns:
+            list: The items that couldn't be fetched
+        """
+
+        if not os.path.isdir(self._partial_dir):
+            os.makedirs(self._partial_dir)
+
+        progress.init_steps(phase_name, max(1, len(self._items)))
+
+        pending = []
+        for item in self._items:
+            if self.is_fetched(item):
+                self._report_fetched(
+                    progress, phase_name, item, _("Found {}").format(item.name)
+                )
+            elif self._restore_cached(item):
+                self._report_fetched(
+                    progress, phase_name, item,
+                    _("Found {} in the cache").format(item.name)
+                )
+            else:
+                pending.append(item)
+
+        delay = RETRY_DELAY
+        for attempt in xrange(self._retries):
+            pending = self._fetch_round(pending, progress, phase_name)
+            if not pending:
+                break
+
+            logger.warn(
+                "Failed to fetch {} archives (attempt {}/{}): {}".format(
+                    len(pending), attempt + 1, self._retries,
+                    ', '.join(
+                        '{} ({})'.format(item.name, item.error)
+                        for item in pending
+                    )
+                )
+            )
+
+            if attempt + 1 < self._retries:
+                time.sleep(delay)
+                delay *= RETRY_BACKOFF
+
+        http_pool.close_all()
+        return pending
+
+    def _restore_cached(self, item):
+        if not self._deb_cache:
+            return False
+
+        path = self.get_path(item)
+        if not self._deb_cache.restore(item.sha256, path):
+            return False
+
+        if not self.is_fetched(item):
+            logger.warn("Cached archive {} is damaged".format(item.filename))
+            os.remove(path)
+            return False
+
+        return True
+
+    def _report_fetched(self, progress, phase_name, item, msg):
+        self._bytes_done += item.size
+        progress.set_bytes(phase_name, self._bytes_done, self._bytes_total)
+        progress.next_step(phase_name, msg)
+
+    def _fetch_round(self, items, progress, phase_name):
+        '''
+        Fetch the given items through a pool of worker threads. Progress is
+        only reported from the calling thread.
+
+        Returns the items which failed.
+        '''
+
+        if not items:
+            return []
+
+        queue = Queue.Queue()
+        results = Queue.Queue()
+
+        for item in items:
+            queue.put(item)
+
+        workers = []
+        for dummy_idx in xrange(min(self._connections, len(items))):
+            worker = threading.Thread(
+                target=self._worker, args=(queue, results)
+            )
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+
+        failed = []
+        for dummy_idx in xrange(len(items)):
+            while True:
+                try:
+                    item, success = results.get(timeout=1)
+                    break
+                except Queue.Empty:
+                    heartbeat()
+
+            if success:
+                self._report_fetched(
+                    progress, phase_name, item,
+                    _("Downloading {}").format(item.name)
+                )
+            else:
+                failed.append(item)
+
+        for worker in workers:
+            worker.join()
+
+        return failed
+
+    def _worker(self, queue, results):
+        while True:
+            try:
+                item = queue.get_nowait()
+            except Queue.Empty:
+                return
+
+            try:
+                self._fetch_item(item)
+                item.error = None
+                results.put((item, True))
+            except Exception as err:
+                item.error = err
+                results.put((item, False))
+
+    def _fetch_item(self, item):
+        '''
+        Try each of the URIs of the item in turn.
+
+        Raises: FetchError
+        '''
+
+        if item.delta_uris and not os.path.exists(self.get_partial_path(item)):
+            try:
+                self._fetch_delta(item)
+                return
+            except (DeltaError, FetchError, ValueError, IOError, OSError,
+                    socket.error, httplib.HTTPException) as err:
+                logger.warn("Falling back to the full archive of {}: {}"
+                            .format(item.name, err))
+
+        error = FetchError("No usable URI for {}".format(item.name))
+
+        for uri in item.uris:
+            try:
+                self._fetch_uri(item, uri)
+                return
+            except (FetchError, ValueError, IOError, socket.error,
+                    httplib.HTTPException) as err:
+                logger.warn("Fetching {} failed: {}".format(uri, err))
+                error = err
+
+        raise error
+
+    def _fetch_uri(self, item, uri):
+        partial_path = self.get_partial_path(item)
+        digest = hashlib.sha256()
+        offset = 0
+
+        # Resume a previous attempt, its content needs to be hashed first
+        if os.path.isfile(partial_path):
+            offset = os.path.getsize(partial_path)
+
+            if offset > item.size:
+                os.remove(partial_path)
+                offset = 0
+            else:
+                with open(partial_path, 'rb') as partial_file:
+                    for chunk in iter(lambda: partial_file.read(CHUNK_SIZE), ''):
+                        digest.update(chunk)
+
+        if offset < item.size:
+            digest = self._download(item, uri, partial_path, offset, digest)
+
+        if digest.hexdigest() != item.sha256:
+            os.remove(partial_path)
+            raise HashMismatchError(
+                "Hash sum mismatch for {}".format(item.filename)
+            )
+
+        self._complete(item)
+
+    def _fetch_delta(self, item):
+        '''
+        Reconstruct the archive from a delta and the old version, preferring
+        the cached archive of the old version over the installed files.
+
+        Raises: DeltaError, FetchError
+        '''
+
+        partial_path = self.get_partial_path(item)
+        delta_path = '{}.{}'.format(partial_path, DELTA_EXTENSION)
+
+        old_archive = None
+        if self._deb_cache and item.old_sha256:
+            old_archive = self._deb_cache.lookup(item.old_sha256)
+
+        try:
+            error = FetchError("No usable delta for {}".format(item.name))
+            for uri in item.delta_uris:
+                try:
+                    self._download_file(uri, delta_path, item.size)
+                    break
+                except (FetchError, IOError, socket.error,
+                        httplib.HTTPException) as err:
+                    error = err
+            else:
+                raise error
+
+            apply_delta(delta_path, partial_path, old_archive)
+        finally:
+            if os.path.exists(delta_path):
+                os.remove(delta_path)
+
+        if file_sha256(partial_path) != item.sha256:
+            os.remove(partial_path)
+            raise HashMismatchError(
+                "Hash sum mismatch for {} rebuilt from delta".format(
+                    item.filename
+                )
+            )
+
+        self._complete(item)
+
+    def _complete(self, item):
+        path = self.get_path(item)
+        os.rename(self.get_partial_path(item), path)
+
+        if self._deb_cache:
+            self._deb_cache.store(path, item.sha256)
+
+    def _download_file(self, uri, path, max_size):
+        '''
+        Download a whole file, giving up when it grows beyond `max_size`.
+        '''
+
+        conn, response = http_pool.request(uri)
+
+        try:
+            if response.status != httplib.OK:
+                raise FetchError("{} returned {} {}".format(
+                    uri, response.status, response.reason
+                ))
+
+            size = 0
+            with open(path, 'wb') as dest_file:
+                while True:
+                    chunk = response.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+
+                    size += len(chunk)
+                    if size > max_size:
+                        raise FetchError(
+                            "{} is larger than expected".format(uri)
+                        )
+
+                    dest_file.write(chunk)
+
+                    if self._rate_limiter:
+                        self._rate_limiter.consume(len(chunk))
+        except Exception:
+            http_pool.discard(conn)
+            raise
+
+        http_pool.release(conn)
+
+    def _download(self, item, uri, partial_path, offset, digest):
+        '''
+        Download the rest of the archive from the offset onwards, feeding the
+        content to the digest as it arrives.
+
+        Returns the digest covering the whole partial file.
+        '''
+
+        headers = {}
+        if offset:
+            headers['Range'] = 'bytes={}-'.format(offset)
+
+        conn, response = http_pool.request(uri, headers=headers)
+
+        try:
+            if response.status == httplib.PARTIAL_CONTENT and offset:
+                mode = 'ab'
+            elif response.status == httplib.OK:
+                # The server ignored the range, start over
+                mode = 'wb'
+                offset = 0
+                digest = hashlib.sha256()
+            else:
+                if response.status == httplib.REQUESTED_RANGE_NOT_SATISFIABLE:
+                    os.remove(partial_path)
+
+                raise FetchError("{} returned {} {}".format(
+                    uri, response.status, response.reason
+                ))
+
+            with open(partial_path, mode) as partial_file:
+                while True:
+                    chunk = response.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+
+                    offset += len(chunk)
+                    if offset > item.size:
+                        raise FetchError(
+                            "{} is larger than expected".format(uri)
+                        )
+
+                    partial_file.write(chunk)
+                    digest.update(chunk)
+
+                    if self._rate_limiter:
+                        self._rate_limiter.consume(len(chunk))
+        except Exception:
+            http_pool.discard(conn)
+            raise
+
+        http_pool.release(conn)
+
+        if offset < item.size:
+            raise FetchError("{} was cut short".format(uri))
+
+        return digest
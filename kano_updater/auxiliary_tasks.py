@@ -15,24 +15,47 @@ from kano.logging import logger
 from kano_updater.progress import Phase
 
 
-def run_aux_tasks(progress):
-    progress.split(
-        Phase('updating-home-folders',
-              _("Updating home folders from template")),
-        Phase('checking-for-app-updates',
-              _("Refreshing Kano Apps")),
-        Phase('refreshing-kdesk',
-              _("Refreshing the desktop")),
-        Phase('expanding-rootfs',
-              _("Expanding filesystem partitions")),
-        Phase('prune-kano-content',
-              _("Removing unnecessary kano-content entries")),
-        Phase('syncing',
-              _("Syncing"))
-    )
-
-    progress.start('updating-home-folders')
-
+def run_aux_tasks(progress, completed=(), on_task=None):
+    """Run the tasks done with every update.
+
+    Args:
+        progress (Progress): Where to report the progress to
+        completed (list): Names of the tasks done by an earlier, interrupted
+            run, which are skipped
+        on_task (function): Called with the name of each task once it is done
+    """
+
+    tasks = [
+        ('updating-home-folders', _("Updating home folders from template"),
+         _update_home_folders),
+        ('checking-for-app-updates', _("Refreshing Kano Apps"),
+         _check_for_app_updates),
+        ('refreshing-kdesk', _("Refreshing the desktop"),
+         _refresh_kdesk),
+        ('expanding-rootfs', _("Expanding filesystem partitions"),
+         _expand_rootfs),
+        ('prune-kano-content', _("Removing unnecessary kano-content entries"),
+         _kano_content_prune),
+        ('syncing', _("Syncing"),
+         _sync)
+    ]
+
+    progress.split(*[Phase(name, label) for name, label, dummy in tasks])
+
+    for name, dummy_label, task in tasks:
+        progress.start(name)
+
+        if name in completed:
+            logger.info("Skipping {}, done already".format(name))
+            continue
+
+        task()
+
+        if on_task:
+            on_task(name)
+
+
+def _update_home_folders():
     try:
         update_home_folders_from_skel()
     except Exception:
@@ -41,17 +64,6 @@ def run_aux_tasks(progress):
         for tb_line in traceback.format_tb(tb):
             logger.error(tb_line)
 
-    progress.start('checking-for-app-updates')
-    _check_for_app_updates()
-    progress.start('refreshing-kdesk')
-    _refresh_kdesk()
-    progress.start('expanding-rootfs')
-    _expand_rootfs()
-    progress.start('prune-kano-content')
-    _kano_content_prune()
-    progress.start('syncing')
-    _sync()
-
 
 def _check_for_app_updates():
     run_cmd_log('/usr/bin/kano-apps check-for-updates')
@@ -0,0 +1,276 @@
+# bandwidth.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Limiting the network usage of background downloads
+
+
+import os
+import time
+import pipes
+import threading
+from distutils.spawn import find_executable
+
+from kano.logging import logger
+from kano.utils.shell import run_cmd
+
+from kano_updater.monitor_heartbeat import heartbeat
+
+
+DEFAULT_LOW_PRIO_RATE = 256 * 1024  # bytes per second
+MIN_RATE = 16 * 1024  # bytes per second
+
+ADAPT_INTERVAL = 5  # seconds
+RATE_INCREASE = 0.1  # fraction of the ceiling added when the link has room
+RATE_BACKOFF = 0.75  # fraction of the measured throughput kept on contention
+
+PAUSE_CHECK_INTERVAL = 10  # seconds
+
+LOGIND_SESSIONS_DIR = '/run/systemd/sessions'
+INTERACTIVE_IDLE_TIME = 5 * 60  # seconds
+XPRINTIDLE = 'xprintidle'
+DEFAULT_DISPLAY = ':0'
+
+
+def _read_session(session_path):
+    session = {}
+
+    with open(session_path, 'r') as session_file:
+        for line in session_file:
+            key, sep, value = line.strip().partition('=')
+            if sep:
+                session[key] = value
+
+    return session
+
+
+def _get_x_idle_time(session):
+    """Time since the last input on the X display of a session.
+
+    Args:
+        session (dict): The session as systemd-logind describes it
+
+    Returns:
+        float: Seconds without input, None when it can't be told
+    """
+
+    display = session.get('DISPLAY')
+    if not display and session.get('TYPE') == 'x11':
+        display = DEFAULT_DISPLAY
+
+    if not display or find_executable(XPRINTIDLE) is None:
+        return None
+
+    env = 'DISPLAY={}'.format(pipes.quote(display))
+
+    # The updater runs as root, the display belongs to the session's user
+    if session.get('NAME'):
+        xauthority = os.path.join(
+            os.path.expanduser('~{}'.format(session['NAME'])), '.Xauthority'
+        )
+        env += ' XAUTHORITY={}'.format(pipes.quote(xauthority))
+
+    out, err, rc = run_cmd('{} {}'.format(env, XPRINTIDLE))
+    if rc != 0:
+        logger.debug("Failed to get the idle time of {}: {}".format(
+            display, err.strip()
+        ))
+        return None
+
+    try:
+        return int(out.strip()) / 1000.
+    except ValueError:
+        return None
+
+
+def is_interactive_session(idle_time=INTERACTIVE_IDLE_TIME):
+    """Check whether someone is using the computer right now.
+
+    Goes through the sessions systemd-logind keeps track of, looking for an
+    active local user session which has seen input recently. Graphical
+    sessions are judged by the idle time of their X display, the others by
+    the activity on their terminal (the same way ``w`` calculates the idle
+    time).
+
+    Args:
+        idle_time (int): Seconds without activity after which a session is
+            considered idle
+
+    Returns:
+        bool: Whether an interactive session was found
+    """
+
+    try:
+        session_ids = os.listdir(LOGIND_SESSIONS_DIR)
+    except OSError:
+        return False
+
+    now = time.time()
+
+    for session_id in session_ids:
+        try:
+            session = _read_session(
+                os.path.join(LOGIND_SESSIONS_DIR, session_id)
+            )
+        except IOError:
+            continue
+
+        if (
+                session.get('ACTIVE') != '1' or
+                session.get('REMOTE') == '1' or
+                session.get('CLASS', 'user') != 'user'
+            ):
+            continue
+
+        x_idle_time = _get_x_idle_time(session)
+        if x_idle_time is not None and x_idle_time < idle_time:
+            return True
+
+        tty = session.get('TTY')
+        if not tty:
+            continue
+
+        if not tty.startswith(os.path.sep):
+            tty = os.path.join('/dev', tty)
+
+        try:
+            tty_stat = os.stat(tty)
+        except OSError:
+            continue
+
+        if now - max(tty_stat.st_atime, tty_stat.st_mtime) < idle_time:
+            return True
+
+    return False
+
+
+class RateLimiter(object):
+    '''
+    A token bucket shared by all the download threads.
+
+    The rate never goes above the ceiling. Within it, the rate adapts to the
+    measured throughput: when the bucket is what holds the downloads back,
+    the rate is increased a step at a time, when the link is (i.e. the
+    downloads can't even keep up with the rate) the rate drops below the
+    measured throughput to leave room for everyone else on the network.
+
+    :param ceiling: Maximum rate in bytes per second
+    :param is_paused: Optional callable, the downloads are paused for as
+        long as it returns True
+    '''
+
+    def __init__(self, ceiling, is_paused=None):
+        self._ceiling = max(MIN_RATE, ceiling)
+        self._rate = self._ceiling
+        self._is_paused = is_paused
+
+        self._lock = threading.Lock()
+
+        now = time.time()
+        self._tokens = self._rate
+        self._last_refill = now
+
+        self._window_start = now
+        self._window_bytes = 0
+        self._window_wait = 0
+
+        self._paused = False
+        self._last_pause_check = 0
+
+    @property
+    def rate(self):
+        return self._rate
+
+    def consume(self, size):
+        """Account for `size` bytes, blocking until the rate allows them.
+
+        Args:
+            size (int): Bytes about to be transferred
+        """
+
+        self._wait_while_paused()
+
+        with self._lock:
+            now = time.time()
+            self._refill(now)
+
+            self._tokens -= size
+            wait = 0
+            if self._tokens < 0:
+                wait = -self._tokens / float(self._rate)
+
+            self._window_bytes += size
+            self._window_wait += wait
+            self._adapt(now)
+
+        if wait:
+            time.sleep(wait)
+
+    def _refill(self, now):
+        elapsed = now - self._last_refill
+        self._last_refill = now
+
+        # Allow bursts of up to a second worth of data
+        self._tokens = min(self._rate, self._tokens + elapsed * self._rate)
+
+    def _adapt(self, now):
+        elapsed = now - self._window_start
+        if elapsed < ADAPT_INTERVAL:
+            return
+
+        throughput = self._window_bytes / elapsed
+
+        if self._window_wait > elapsed / 2:
+            # Mostly waiting for tokens, the link has room for more
+            rate = min(
+                self._ceiling, self._rate + RATE_INCREASE * self._ceiling
+            )
+        elif throughput < self._rate * RATE_BACKOFF:
+            # Not even getting the allowed rate, the link is contended
+            rate = max(MIN_RATE, throughput * RATE_BACKOFF)
+        else:
+            rate = self._rate
+
+        if rate != self._rate:
+            logger.debug(
+                "Download rate {} -> {} B/s (measured {} B/s)".format(
+                    int(self._rate), int(rate), int(throughput)
+                )
+            )
+            self._rate = rate
+
+        self._window_start = now
+        self._window_bytes = 0
+        self._window_wait = 0
+
+    def _check_paused(self):
+        with self._lock:
+            now = time.time()
+            if now - self._last_pause_check < PAUSE_CHECK_INTERVAL:
+                return self._paused
+
+            self._last_pause_check = now
+            paused = bool(self._is_paused())
+
+            if paused != self._paused:
+                logger.info("{} the downloads".format(
+                    "Pausing" if paused else "Resuming"
+                ))
+                self._paused = paused
+
+                # Don't count the pause towards the throughput measurement
+                self._window_start = now
+                self._window_bytes = 0
+                self._window_wait = 0
+                self._last_refill = now
+
+            return paused
+
+    def _wait_while_paused(self):
+        if not self._is_paused:
+            return
+
+        while self._check_paused():
+            heartbeat()
+            time.sleep(PAUSE_CHECK_INTERVAL)
@@ -8,16 +8,16 @@
 
 import time
 
-from kano.network import is_internet
 from kano.logging import logger
 from kano.utils.shell import run_cmd_log
 
 from kano_updater.apt_wrapper import AptWrapper
 from kano_updater.status import UpdaterStatus
 from kano_updater.progress import DummyProgress
-from kano_updater.utils import is_server_available
+from kano_updater.utils import check_connectivity
 import kano_updater.priority as Priority
 from kano_updater.paths import KANO_SOURCES_LIST
+from kano_updater.release_check import check_releases, get_dpkg_status_mtime
 from kano_updater.return_codes import RC, RCState
 
 
@@ -49,7 +49,32 @@ def check_for_updates(progress=None, priority=Priority.NONE, is_gui=False):
         # again.
         return status.state != UpdaterStatus.UPDATES_INSTALLED
 
-    if not is_internet():
+    # Skip the whole check when neither the repositories nor the installed
+    # packages changed since the last one which found nothing.
+    release_validators = None
+    if status.state == UpdaterStatus.NO_UPDATES:
+        releases_changed, release_validators = check_releases(
+            KANO_SOURCES_LIST, status.release_validators
+        )
+
+        if (
+                releases_changed is False and
+                status.dpkg_status_mtime == get_dpkg_status_mtime()
+            ):
+            logger.info("Repositories unchanged since the last check")
+            RCState.get_instance().rc = RC.NO_UPDATES_AVAILABLE
+
+            if priority <= Priority.STANDARD:
+                status.last_check = int(time.time())
+            status.last_check_urgent = int(time.time())
+            status.last_check_bytes = 0
+            status.save()
+
+            return False
+
+    internet, server_available = check_connectivity()
+
+    if not internet:
         err_msg = N_("Must have internet to check for updates")
         logger.error(err_msg)
         progress.fail(_(err_msg))
@@ -58,7 +83,7 @@ def check_for_updates(progress=None, priority=Priority.NONE, is_gui=False):
         # Not updating the timestamp. The check failed.
         return False
 
-    if not is_server_available():
+    if not server_available:
         err_msg = N_("Could not connect to the download server")
         logger.error(err_msg)
         progress.fail(_(err_msg))
@@ -68,6 +93,10 @@ def check_for_updates(progress=None, priority=Priority.NONE, is_gui=False):
         return False
 
     update_type = _do_check(progress, priority=priority)
+
+    apt_handle = AptWrapper.get_instance()
+    status.last_check_bytes = apt_handle.update_fetched_bytes
+
     if update_type == Priority.NONE:
         # If the Updater is running in recovery mode, do not update the state
         # out of the installing ones, otherwise the recovery flow will quit.
@@ -96,6 +125,10 @@ def check_for_updates(progress=None, priority=Priority.NONE, is_gui=False):
 
     status.last_check_urgent = int(time.time())
 
+    if release_validators is not None and apt_handle.update_succeeded:
+        status.release_validators = release_validators
+        status.dpkg_status_mtime = get_dpkg_status_mtime()
+
     status.save()
 
     return rv
@@ -6,14 +6,16 @@
 # Managing downloads of apt packages for the upgrade
 
 
+import socket
+
 from kano.utils.shell import run_cmd
-from kano.network import is_internet
 from kano.logging import logger
 
 from kano_updater.status import UpdaterStatus
 from kano_updater.apt_wrapper import AptWrapper
+from kano_updater.lan_share import PeerServer
 from kano_updater.progress import DummyProgress, Phase
-from kano_updater.utils import is_server_available, show_kano_dialog, \
+from kano_updater.utils import check_connectivity, show_kano_dialog, \
     make_normal_prio
 from kano_updater.disk_requirements import check_disk_space
 from kano_updater.commands.check import check_for_updates
@@ -25,7 +27,17 @@ class DownloadError(Exception):
     pass
 
 
-def download(progress=None, gui=True):
+def download(progress=None, gui=True, max_rate=None, finish=True,
+             share=False):
+    '''
+    :param finish: Whether to finish the progress once the packages are
+                   downloaded, which is left to install() when it downloads
+                   on the way
+    :param share: Whether to serve the package cache to the other kits on
+                  the local network while downloading. Fetching from them
+                  doesn't depend on it.
+    '''
+
     status = UpdaterStatus.get_instance()
     dialog_proc = None
 
@@ -71,19 +83,31 @@ def download(progress=None, gui=True):
         progress.abort(_(err_msg))
         return False
 
-    if not is_internet():
-        err_msg = N_("Must have internet to download the updates")
-        logger.error(err_msg)
-        progress.fail(_(err_msg))
-        RCState.get_instance().rc = RC.NO_NETWORK
-        return False
-
     priority = Priority.NONE
 
     if status.is_urgent:
         priority = Priority.URGENT
 
-    if not is_server_available():
+    internet, server_available = check_connectivity()
+
+    offline = False
+    if not internet:
+        # When recovering from an interrupted install, the packages might all
+        # be in the package cache already.
+        if (
+                status.is_recovery_needed() and
+                AptWrapper.get_instance().has_cached_updates(priority)
+            ):
+            logger.info("No internet, using the cached packages to recover")
+            offline = True
+        else:
+            err_msg = N_("Must have internet to download the updates")
+            logger.error(err_msg)
+            progress.fail(_(err_msg))
+            RCState.get_instance().rc = RC.NO_NETWORK
+            return False
+
+    if not offline and not server_available:
         err_msg = N_("Could not connect to the download server")
         logger.error(err_msg)
         progress.fail(_(err_msg))
@@ -122,12 +146,19 @@ def download(progress=None, gui=True):
         priority = Priority.URGENT
         logger.info("Urgent update detected, bumping to normal priority")
         make_normal_prio()
+        max_rate = None
+
+    AptWrapper.get_instance().set_download_rate(max_rate)
 
     logger.debug("Downloading with priority {}".format(priority.priority))
 
+    # Let the other kits on the network have what has been downloaded so far
+    peer_server = _start_sharing() if share else None
+
     try:
         success = do_download(
-            progress, status, priority=priority, dialog_proc=dialog_proc
+            progress, status, priority=priority, dialog_proc=dialog_proc,
+            offline=offline, finish=finish
         )
     except Exception as err:
         progress.fail(err.message)
@@ -138,6 +169,9 @@ def download(progress=None, gui=True):
         status.save()
 
         return False
+    finally:
+        if peer_server:
+            peer_server.stop()
 
     if not status.is_recovery_needed():
         status.state = UpdaterStatus.UPDATES_DOWNLOADED
@@ -146,7 +180,21 @@ def download(progress=None, gui=True):
     return success
 
 
-def do_download(progress, status, priority=Priority.NONE, dialog_proc=None):
+def _start_sharing():
+    peer_server = PeerServer()
+
+    try:
+        peer_server.start()
+    except socket.error as err:
+        # Most likely `kano-updater share` is serving the cache already
+        logger.warn("Not sharing the package cache: {}".format(err))
+        return None
+
+    return peer_server
+
+
+def do_download(progress, status, priority=Priority.NONE, dialog_proc=None,
+                offline=False, finish=True):
     progress.split(
         Phase(
             'updating-sources',
@@ -162,9 +210,10 @@ def do_download(progress, status, priority=Priority.NONE, dialog_proc=None):
         )
     )
 
-    _cache_deb_packages(progress, priority=priority)
+    _cache_deb_packages(progress, priority=priority, offline=offline)
 
-    progress.finish(_("Done downloading"))
+    if finish:
+        progress.finish(_("Done downloading"))
 
     # kill the dialog if it is still on
     if dialog_proc:
@@ -174,11 +223,20 @@ def do_download(progress, status, priority=Priority.NONE, dialog_proc=None):
     return True
 
 
-def _cache_deb_packages(progress, priority=Priority.NONE):
+def _cache_deb_packages(progress, priority=Priority.NONE, offline=False):
     apt_handle = AptWrapper.get_instance()
 
     progress.start('updating-sources')
-    apt_handle.update(progress=progress)
+    if offline:
+        # Stick to the package lists the cached packages were picked from
+        progress.set_step(
+            'updating-sources', 1, _("Using the cached package lists"),
+            skipped=True
+        )
+    else:
+        apt_handle.update(progress=progress)
 
     progress.start('downloading-apt-packages')
-    apt_handle.cache_updates(progress, priority=priority)
+    plan = apt_handle.get_upgrade_plan(priority=priority)
+    apt_handle.cache_updates(progress, priority=priority, plan=plan)
+    apt_handle.save_upgrade_plan(plan)
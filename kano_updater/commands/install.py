@@ -16,6 +16,7 @@ from kano_updater.os_version import bump_system_version, get_target_version, \
     get_system_version
 from kano_updater.scenarios import PreUpdate, PostUpdate
 from kano_updater.apt_wrapper import AptWrapper
+from kano_updater.deb_cache import DebCache
 from kano_updater.auxiliary_tasks import run_aux_tasks
 from kano_updater.disk_requirements import check_disk_space
 from kano_updater.progress import DummyProgress, Phase, Relaunch
@@ -26,6 +27,11 @@ from kano_updater.utils import track_data_and_sync
 from kano_updater.return_codes import RC, RCState
 
 
+CHECKPOINT_UPDATER = 'updating-itself'
+CHECKPOINT_DEB_PACKAGES = 'deb-packages'
+CHECKPOINT_AUX_PREFIX = 'aux-task '
+
+
 class InstallError(Exception):
     pass
 
@@ -72,11 +78,16 @@ def install(progress=None, gui=True):
         RCState.get_instance().rc = RC.NOT_ENOUGH_SPACE
         return False
 
-    logger.info("Downloading any new updates that might be available.")
     progress.start('download')
-    if not download(progress):
-        logger.error("Downloading updates failed, cannot update.")
-        return False
+    if _is_download_complete(status, priority):
+        msg = N_("Using the downloaded updates")
+        logger.info(msg)
+        progress.set_step('download', 1, _(msg), skipped=True)
+    else:
+        logger.info("Downloading any new updates that might be available.")
+        if not download(progress, finish=False):
+            logger.error("Downloading updates failed, cannot update.")
+            return False
 
     progress.start('install')
 
@@ -98,7 +109,33 @@ def install(progress=None, gui=True):
         return False
 
 
+def _is_download_complete(status, priority):
+    '''
+    Whether the plan of the last download is still valid with all its archives
+    at hand, so the installation can go ahead without solving it again.
+    '''
+
+    if status.state == UpdaterStatus.INSTALLING_UPDATES:
+        # Resuming after the packages have been installed already
+        if status.is_checkpoint_reached(CHECKPOINT_DEB_PACKAGES):
+            return True
+    elif status.state != UpdaterStatus.UPDATES_DOWNLOADED:
+        return False
+
+    apt_handle = AptWrapper.get_instance()
+    if not apt_handle.load_upgrade_plan(priority=priority):
+        return False
+
+    return apt_handle.has_cached_updates(priority)
+
+
 def do_install(progress, status, priority=Priority.NONE):
+    if status.state != UpdaterStatus.INSTALLING_UPDATES:
+        # Not resuming an interrupted installation
+        status.completed_batches = 0
+        status.pending_batch = []
+        status.checkpoints = []
+
     status.state = UpdaterStatus.INSTALLING_UPDATES
     status.save()
 
@@ -112,18 +149,26 @@ def do_install(progress, status, priority=Priority.NONE):
     if not res:
         return False
 
+    AptWrapper.get_instance().remove_upgrade_plan()
+
     run_cmd_log('apt-get --yes autoremove')
     run_cmd_log('apt-get --yes clean')
+    # The package cache keeps its own links to the archives, trim it now that
+    # apt's copies are gone.
+    DebCache().prune()
 
-    status.state = UpdaterStatus.UPDATES_INSTALLED
+    with status.transaction():
+        status.state = UpdaterStatus.UPDATES_INSTALLED
+        status.completed_batches = 0
+        status.checkpoints = []
 
-    # Clear the list of independent packages.
-    # They should all have been updated by the full update.
-    status.updatable_independent_packages = []
+        # Clear the list of independent packages.
+        # They should all have been updated by the full update.
+        status.updatable_independent_packages = []
 
-    status.last_update = int(time.time())
-    status.is_scheduled = False
-    status.save()
+        status.last_update = int(time.time())
+        status.is_scheduled = False
+        status.save()
 
     progress.finish(_("Update completed"))
     track_data_and_sync('update-install-finished', dict())
@@ -202,9 +247,10 @@ def install_urgent(progress, status):
     )
     logger.info("Installing urgent hotfix")
     apt_handle = AptWrapper.get_instance()
-    packages_to_update = apt_handle.packages_to_be_upgraded()
+    plan = apt_handle.get_upgrade_plan(priority=Priority.URGENT)
+    packages_to_update = plan.get_packages()
     progress.start('installing-urgent')
-    install_deb_packages(progress, priority=Priority.URGENT)
+    install_deb_packages(progress, priority=Priority.URGENT, plan=plan)
     status.is_urgent = False
     try:
         from kano_profile.tracker import track_data
@@ -264,7 +310,7 @@ def install_standard(progress, status):
     progress.start('init')
     apt_handle = AptWrapper.get_instance()
     apt_handle.clear_cache()
-    apt_handle.fix_broken(progress)
+    apt_handle.fix_broken(progress, pending_batch=status.pending_batch)
 
     # determine the versions (from and to)
     system_version = get_system_version()
@@ -289,26 +335,33 @@ def install_standard(progress, status):
         progress.fail(msg)
         raise InstallError(msg)
 
-    old_updater = apt_handle.get_package('kano-updater').installed.version
+    # The steps completed before an interruption are skipped when resuming
+    completed = list(status.checkpoints)
 
     progress.start('updating-itself')
-    apt_handle.upgrade('kano-updater', progress)
+    if CHECKPOINT_UPDATER not in completed:
+        old_updater = apt_handle.get_package('kano-updater').installed.version
+        apt_handle.upgrade('kano-updater', progress)
 
-    # relaunch if the updater has changed
-    new_updater = apt_handle.get_package('kano-updater')
-    if old_updater != new_updater.installed.version:
-        # Remove the installation in progress status so it doesn't
-        # block the start of the new instance.
-        status.state = UpdaterStatus.UPDATES_DOWNLOADED
-        status.save()
+        # relaunch if the updater has changed
+        new_updater = apt_handle.get_package('kano-updater')
+        if old_updater != new_updater.installed.version:
+            # Remove the installation in progress status so it doesn't
+            # block the start of the new instance.
+            status.state = UpdaterStatus.UPDATES_DOWNLOADED
+            status.save()
 
-        logger.info("The updater has been updated, relaunching.")
-        progress.relaunch()
-        return False
+            logger.info("The updater has been updated, relaunching.")
+            progress.relaunch()
+            return False
+
+        status.reach_checkpoint(CHECKPOINT_UPDATER)
 
     progress.start('preupdate')
     try:
-        preup.run(progress)
+        preup.run(
+            progress, completed=completed, on_step=status.reach_checkpoint
+        )
     except Relaunch:
         progress.relaunch()
         return False
@@ -319,11 +372,15 @@ def install_standard(progress, status):
 
     logger.info("Updating deb packages")
     progress.start('updating-deb-packages')
-    install_deb_packages(progress)
+    if CHECKPOINT_DEB_PACKAGES not in completed:
+        install_deb_packages(progress)
+        status.reach_checkpoint(CHECKPOINT_DEB_PACKAGES)
 
     progress.start('postupdate')
     try:
-        postup.run(progress)
+        postup.run(
+            progress, completed=completed, on_step=status.reach_checkpoint
+        )
     except Relaunch:
         bump_system_version()
         progress.relaunch()
@@ -337,11 +394,40 @@ def install_standard(progress, status):
 
     # We don't care too much when these fail
     progress.start('aux-tasks')
-    run_aux_tasks(progress)
+    run_aux_tasks(
+        progress,
+        completed=[
+            step[len(CHECKPOINT_AUX_PREFIX):] for step in completed
+            if step.startswith(CHECKPOINT_AUX_PREFIX)
+        ],
+        on_task=lambda task: status.reach_checkpoint(
+            CHECKPOINT_AUX_PREFIX + task
+        )
+    )
 
     return True
 
 
-def install_deb_packages(progress, priority=Priority.NONE):
+def install_deb_packages(progress, priority=Priority.NONE, plan=None):
     apt_handle = AptWrapper.get_instance()
-    apt_handle.upgrade_all(progress, priority=priority)
+    status = UpdaterStatus.get_instance()
+
+    if plan is None:
+        # Reuses the plan of the download, unless the updater or the
+        # pre-update scenarios changed what needs to be installed
+        plan = apt_handle.load_upgrade_plan(priority=priority) or \
+            apt_handle.get_upgrade_plan(priority=priority)
+
+    def record_batch(index, names, committed):
+        # Lets the recovery pick up from the last batch committed
+        if committed:
+            status.completed_batches = index + 1
+            status.pending_batch = []
+        else:
+            status.pending_batch = names
+        status.save()
+
+    apt_handle.upgrade_all(
+        progress, priority=priority, plan=plan,
+        skip_batches=status.completed_batches, on_batch=record_batch
+    )
@@ -0,0 +1,221 @@
+# deb_cache.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Content-addressed cache of the package archives the updater has verified.
+#
+# Archives are stored by their SHA256 and survive `apt-get clean`, so that
+# packages needed again, e.g. when recovering from an interrupted update, don't
+# have to be downloaded another time. The entries are hardlinked with the apt
+# archives whenever possible so keeping them costs no space while apt still
+# has its own copy.
+
+
+import os
+import errno
+import shutil
+import hashlib
+
+from kano.logging import logger
+
+from kano_updater.paths import DEB_CACHE_DIR
+
+
+MAX_CACHE_SIZE = 1024  # MB
+FREE_SPACE_SHARE = 0.25  # of the space not reserved for updating
+RESERVED_SPACE = 850  # MB, kept free for the update itself
+CHUNK_SIZE = 64 * 1024  # bytes
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+
+    with open(path, 'rb') as archive:
+        for chunk in iter(lambda: archive.read(CHUNK_SIZE), ''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def _link_or_copy(src, dest):
+    '''
+    Hardlink `src` to `dest`, falling back to a copy across filesystems. The
+    destination only appears once it is complete.
+    '''
+
+    tmp_dest = '{}.tmp-{}'.format(dest, os.getpid())
+
+    try:
+        os.link(src, tmp_dest)
+    except OSError as err:
+        if err.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        shutil.copyfile(src, tmp_dest)
+
+    os.rename(tmp_dest, dest)
+
+
+class DebCache(object):
+    '''
+    Package archives keyed by their SHA256, evicted least recently used
+    first.
+    '''
+
+    def __init__(self, cache_dir=DEB_CACHE_DIR):
+        self._cache_dir = cache_dir
+
+    def get_path(self, sha256):
+        return os.path.join(self._cache_dir, sha256[:2], sha256 + '.deb')
+
+    def lookup(self, sha256):
+        """Find an archive in the cache.
+
+        Args:
+            sha256 (str): The SHA256 of the archive
+
+        Returns:
+            str: Path of the cached archive or None if it isn't cached
+        """
+
+        if not sha256:
+            return None
+
+        path = self.get_path(sha256)
+        if not os.path.isfile(path):
+            return None
+
+        # Mark as recently used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+        return path
+
+    def restore(self, sha256, dest):
+        """Put a cached archive in place at `dest`.
+
+        Returns:
+            bool: Whether the archive was in the cache
+        """
+
+        path = self.lookup(sha256)
+        if not path:
+            return False
+
+        try:
+            _link_or_copy(path, dest)
+        except (IOError, OSError) as err:
+            logger.warn("Failed to restore {} from the cache: {}".format(
+                dest, err
+            ))
+            return False
+
+        return True
+
+    def store(self, path, sha256=None):
+        """Add an archive to the cache.
+
+        Args:
+            path (str): Path to the archive
+            sha256 (str): The SHA256 of the archive when it has already been
+                verified, it's computed otherwise
+
+        Returns:
+            str: The SHA256 of the archive or None if it couldn't be stored
+        """
+
+        try:
+            if not sha256:
+                sha256 = file_sha256(path)
+
+            cached_path = self.get_path(sha256)
+            if os.path.isfile(cached_path):
+                return sha256
+
+            cached_dir = os.path.dirname(cached_path)
+            if not os.path.isdir(cached_dir):
+                os.makedirs(cached_dir)
+
+            _link_or_copy(path, cached_path)
+        except (IOError, OSError) as err:
+            logger.warn("Failed to cache {}: {}".format(path, err))
+            return None
+
+        return sha256
+
+    def _get_entries(self):
+        entries = []
+
+        for root, dummy_dirs, files in os.walk(self._cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    entry_stat = os.stat(path)
+                except OSError:
+                    continue
+
+                entries.append((entry_stat.st_mtime, entry_stat.st_size, path))
+
+        return entries
+
+    def get_hashes(self):
+        """List the SHA256 of all the archives in the cache."""
+
+        return [
+            os.path.basename(path)[:-len('.deb')]
+            for dummy, dummy, path in self._get_entries()
+            if path.endswith('.deb')
+        ]
+
+    def get_size(self):
+        """Total size of the cache in MB."""
+
+        return sum(size for dummy, size, dummy in self._get_entries()) / 1048576.
+
+    def get_budget(self, reserved=RESERVED_SPACE):
+        """Calculate how much space the cache may take in MB.
+
+        The budget is a share of the free space, counting the space taken by
+        the cache itself and leaving enough room for an update.
+
+        Args:
+            reserved (int): Space in MB which must be left for other uses
+        """
+
+        from kano.utils.disk import get_free_space
+
+        available = get_free_space() + self.get_size() - reserved
+
+        return max(0, min(MAX_CACHE_SIZE, available * FREE_SPACE_SHARE))
+
+    def prune(self, budget=None, reserved=RESERVED_SPACE):
+        """Evict the least recently used archives until the cache fits.
+
+        Args:
+            budget (float): Size to fit in, in MB. Derived from the free disk
+                space if not given.
+            reserved (int): Space in MB to leave for other uses when deriving
+                the budget
+        """
+
+        if budget is None:
+            budget = self.get_budget(reserved=reserved)
+
+        entries = sorted(self._get_entries())
+        size = sum(entry_size for dummy, entry_size, dummy in entries)
+        budget_bytes = budget * 1048576
+
+        for dummy_mtime, entry_size, path in entries:
+            if size <= budget_bytes:
+                break
+
+            try:
+                os.remove(path)
+                size -= entry_size
+            except OSError as err:
+                logger.warn("Failed to evict {}: {}".format(path, err))
+
+        logger.info("Package cache pruned to {:.1f} MB (budget {:.1f} MB)"
+                    .format(size / 1048576., budget))
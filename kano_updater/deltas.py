@@ -0,0 +1,94 @@
+# deltas.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Binary deltas between package versions, in the debdelta format.
+#
+# A delta takes the new archive from either the installed files of the old
+# version or the archive of the old version. The deltas are expected next to
+# the archives in the repository, under the names the debdelta tools use.
+
+
+import os
+import pipes
+from distutils.spawn import find_executable
+
+from kano.logging import logger
+from kano.utils.shell import run_cmd
+
+
+DEBPATCH = 'debpatch'
+MIN_DELTA_SIZE = 256 * 1024  # bytes, smaller archives aren't worth it
+DELTA_EXTENSION = 'debdelta'
+
+
+class DeltaError(Exception):
+    pass
+
+
+def is_supported():
+    """Whether the tools to apply the deltas are installed."""
+
+    return find_executable(DEBPATCH) is not None
+
+
+def delta_filename(name, old_version, new_version, architecture):
+    """Name of the delta between two versions of a package.
+
+    Args:
+        name (str): Name of the package
+        old_version (str): The version the delta applies to
+        new_version (str): The version the delta produces
+        architecture (str): Architecture of the package
+
+    Returns:
+        str: The file name of the delta
+    """
+
+    return '{}_{}_{}_{}.{}'.format(
+        name,
+        old_version.replace(':', '%3a'),
+        new_version.replace(':', '%3a'),
+        architecture,
+        DELTA_EXTENSION
+    )
+
+
+def delta_uris(archive_uris, filename):
+    """The URIs of a delta, which lives next to the archive it produces."""
+
+    return [
+        '{}/{}'.format(uri.rsplit('/', 1)[0], filename)
+        for uri in archive_uris
+    ]
+
+
+def apply_delta(delta_path, dest, old_archive=None):
+    """Reconstruct the new archive from a delta.
+
+    Args:
+        delta_path (str): Path to the delta
+        dest (str): Where to write the new archive
+        old_archive (str): The archive of the old version, the installed files
+            of the old version are used without it
+
+    Raises: DeltaError
+    """
+
+    cmd = '{} {} {} {}'.format(
+        DEBPATCH,
+        pipes.quote(delta_path),
+        pipes.quote(old_archive) if old_archive else '/',
+        pipes.quote(dest)
+    )
+
+    dummy_out, err, rc = run_cmd(cmd)
+    if rc != 0:
+        if os.path.exists(dest):
+            os.remove(dest)
+
+        logger.debug("'{}' failed: {}".format(cmd, err))
+        raise DeltaError("Failed to apply {}: {}".format(
+            os.path.basename(delta_path), err.strip()
+        ))
@@ -23,7 +23,8 @@ def check_disk_space(priority):
 
     apt_handle = AptWrapper.get_instance()
     mb_free = get_free_space()
-    required_space = apt_handle.get_required_upgrade_space() + SPACE_BUFFER
+    required_space = apt_handle.get_required_upgrade_space(priority=priority) \
+        + SPACE_BUFFER
 
     logger.info('Final upgrade required size is {} MB'.format(required_space))
 
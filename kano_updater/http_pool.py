@@ -0,0 +1,156 @@
+# http_pool.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# A pool of keep-alive HTTP(S) connections shared by the updater's own
+# network code
+
+
+import httplib
+import threading
+import urlparse
+
+
+TIMEOUT = 30  # seconds
+
+_lock = threading.Lock()
+_idle = {}
+
+
+def _key(scheme, netloc):
+    return (scheme.lower(), netloc.lower())
+
+
+def acquire(url, timeout=TIMEOUT):
+    """Get a connection to the server of the given URL.
+
+    An idle connection is reused when there is one, with its timeout set to
+    the one given, a new one is created otherwise. Give it back with :func:`release` once the response has been
+    read fully, or drop it with :func:`discard` after an error.
+
+    Args:
+        url (str): Any URL on the server
+        timeout (int): Socket timeout, in seconds
+
+    Returns:
+        httplib.HTTPConnection: The connection
+
+    Raises:
+        ValueError: When the URL isn't HTTP(S)
+    """
+
+    parsed = urlparse.urlsplit(url)
+    key = _key(parsed.scheme, parsed.netloc)
+
+    with _lock:
+        connections = _idle.get(key)
+        conn = connections.pop() if connections else None
+
+    if conn is None:
+        return _connect(url, timeout=timeout)
+
+    # It may have been opened for a quick probe with a shorter timeout
+    conn.timeout = timeout
+    if conn.sock is not None:
+        conn.sock.settimeout(timeout)
+
+    return conn
+
+
+def _connect(url, timeout=TIMEOUT):
+    parsed = urlparse.urlsplit(url)
+    key = _key(parsed.scheme, parsed.netloc)
+
+    if key[0] == 'http':
+        conn = httplib.HTTPConnection(parsed.netloc, timeout=timeout)
+    elif key[0] == 'https':
+        conn = httplib.HTTPSConnection(parsed.netloc, timeout=timeout)
+    else:
+        raise ValueError("Unsupported URL scheme '{}'".format(parsed.scheme))
+
+    conn.pool_key = key
+    return conn
+
+
+def release(conn):
+    """Return a connection to the pool for reuse."""
+
+    with _lock:
+        _idle.setdefault(conn.pool_key, []).append(conn)
+
+
+def discard(conn):
+    """Close a connection which is in an unknown state."""
+
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+def close_all():
+    """Close all the idle connections."""
+
+    with _lock:
+        connections = [conn for conns in _idle.itervalues() for conn in conns]
+        _idle.clear()
+
+    for conn in connections:
+        discard(conn)
+
+
+def request(url, method='GET', headers=None, redirects=5, timeout=TIMEOUT):
+    """Issue a request on a pooled connection, following redirects.
+
+    Args:
+        url (str): The URL to request
+        method (str): The HTTP method
+        headers (dict): Extra request headers
+        redirects (int): How many redirects to follow at most
+        timeout (int): Socket timeout, in seconds
+
+    Returns:
+        tuple: ``(conn, response)``, the caller must read the response and
+        then either :func:`release` or :func:`discard` the connection.
+
+    Raises:
+        httplib.HTTPException, socket.error: On connection failures
+    """
+
+    for dummy_redirect in xrange(redirects + 1):
+        parsed = urlparse.urlsplit(url)
+        path = parsed.path or '/'
+        if parsed.query:
+            path = '{}?{}'.format(path, parsed.query)
+
+        conn = acquire(url, timeout=timeout)
+        is_reused = conn.sock is not None
+        try:
+            conn.request(method, path, headers=headers or {})
+            response = conn.getresponse()
+        except Exception:
+            discard(conn)
+            if not is_reused:
+                raise
+
+            # The server may have closed the idle connection in the meantime,
+            # retry once on a fresh one before giving up.
+            conn = _connect(url, timeout=timeout)
+            try:
+                conn.request(method, path, headers=headers or {})
+                response = conn.getresponse()
+            except Exception:
+                discard(conn)
+                raise
+
+        location = response.getheader('location')
+        if response.status in (301, 302, 303, 307, 308) and location:
+            response.read()
+            release(conn)
+            url = urlparse.urljoin(url, location)
+            continue
+
+        return conn, response
+
+    raise httplib.HTTPException("Too many redirects for {}".format(url))
@@ -0,0 +1,352 @@
+# lan_share.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Sharing the package archives between updaters on the local network.
+#
+# Serving is opt-in, with `kano-updater share` or `kano-updater download
+# --share`, as it opens the cache to anyone on the network. Fetching from the
+# peers found is always on.
+#
+# Every updater serving its package cache answers discovery queries broadcast
+# over UDP with the port of its HTTP server, which lists the archives it holds
+# and serves them by their SHA256. Fetching updaters try the peers having an
+# archive before the repository. Whatever comes from a peer is checked against
+# the hash from the signed apt index like any other download.
+
+
+import re
+import json
+import time
+import socket
+import threading
+import BaseHTTPServer
+import SocketServer
+
+from kano.logging import logger
+
+from kano_updater.deb_cache import DebCache
+import kano_updater.http_pool as http_pool
+
+
+DISCOVERY_PORT = 55155
+HTTP_PORT = 55156
+DISCOVERY_TIMEOUT = 1  # seconds
+MAX_CLIENTS = 4
+
+QUERY = 'KANO-UPDATER-PEERS 1'
+BROADCAST = '<broadcast>'
+
+ARCHIVE_PATH_RE = re.compile(r'^/debs/([0-9a-f]{64})$')
+DEB_CONTENT_TYPE = 'application/vnd.debian.binary-package'
+CHUNK_SIZE = 64 * 1024  # bytes
+
+
+class PeerRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''
+    Serves the index of the package cache at /index and the archives at
+    /debs/<sha256>, with support for resuming from an offset.
+    '''
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+
+        if not server.clients.acquire(False):
+            self._send_empty(503)
+            return
+
+        try:
+            if self.path == '/index':
+                self._send_index()
+            else:
+                match = ARCHIVE_PATH_RE.match(self.path)
+                path = server.deb_cache.lookup(match.group(1)) if match \
+                    else None
+
+                if path:
+                    self._send_archive(path)
+                else:
+                    self._send_empty(404)
+        except socket.error as err:
+            logger.debug("Peer {} went away: {}".format(
+                self.client_address[0], err
+            ))
+        finally:
+            server.clients.release()
+
+    def _send_empty(self, code):
+        self.send_response(code)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _send_index(self):
+        body = json.dumps(self.server.deb_cache.get_hashes())
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_archive(self, path):
+        with open(path, 'rb') as archive:
+            archive.seek(0, 2)
+            size = archive.tell()
+
+            start = 0
+            byte_range = self.headers.get('Range', '')
+            if byte_range.startswith('bytes=') and byte_range.endswith('-'):
+                try:
+                    start = int(byte_range[len('bytes='):-1])
+                except ValueError:
+                    start = 0
+
+            if start >= size and start:
+                self._send_empty(416)
+                return
+
+            if start:
+                self.send_response(206)
+                self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                    start, size - 1, size
+                ))
+            else:
+                self.send_response(200)
+
+            self.send_header('Content-Type', DEB_CONTENT_TYPE)
+            self.send_header('Content-Length', str(size - start))
+            self.end_headers()
+
+            archive.seek(start)
+            for chunk in iter(lambda: archive.read(CHUNK_SIZE), ''):
+                self.wfile.write(chunk)
+
+    def log_message(self, msg_format, *args):
+        logger.debug("Peer {}: {}".format(
+            self.client_address[0], msg_format % args
+        ))
+
+
+class _HTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class PeerServer(object):
+    '''
+    Serves the package cache to the other updaters on the network.
+
+    :param deb_cache: The :class:`kano_updater.deb_cache.DebCache` to serve
+    :param address: Address to listen on
+    :param http_port: Port of the HTTP server, 0 for any
+    :param discovery_port: UDP port to answer discovery queries on, 0 for any
+    '''
+
+    def __init__(self, deb_cache=None, address='', http_port=HTTP_PORT,
+                 discovery_port=DISCOVERY_PORT):
+        self._deb_cache = deb_cache or DebCache()
+        self._address = address
+        self._http_port = http_port
+        self._discovery_port = discovery_port
+
+        self._http_server = None
+        self._discovery_sock = None
+        self._threads = []
+        self._running = False
+
+    @property
+    def http_port(self):
+        return self._http_server.server_address[1]
+
+    @property
+    def discovery_port(self):
+        return self._discovery_sock.getsockname()[1]
+
+    def start(self):
+        '''
+        Raises: socket.error when the ports are taken
+        '''
+
+        self._http_server = _HTTPServer(
+            (self._address, self._http_port), PeerRequestHandler
+        )
+        self._http_server.deb_cache = self._deb_cache
+        self._http_server.clients = threading.Semaphore(MAX_CLIENTS)
+
+        try:
+            self._discovery_sock = socket.socket(
+                socket.AF_INET, socket.SOCK_DGRAM
+            )
+            self._discovery_sock.setsockopt(
+                socket.SOL_SOCKET, socket.SO_REUSEADDR, 1
+            )
+            self._discovery_sock.bind((self._address, self._discovery_port))
+            self._discovery_sock.settimeout(1)
+        except socket.error:
+            self._http_server.server_close()
+            raise
+
+        self._running = True
+        for target in (self._http_server.serve_forever, self._answer_queries):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+        logger.info("Sharing the package cache on port {}".format(
+            self.http_port
+        ))
+
+    def stop(self):
+        if not self._running:
+            return
+
+        self._running = False
+        self._http_server.shutdown()
+        self._http_server.server_close()
+
+        for thread in self._threads:
+            thread.join()
+
+        self._discovery_sock.close()
+        self._threads = []
+
+    def serve_forever(self):
+        self.start()
+
+        try:
+            while self._running:
+                time.sleep(1)
+        finally:
+            self.stop()
+
+    def _answer_queries(self):
+        reply = json.dumps({'port': self.http_port})
+
+        while self._running:
+            try:
+                data, sender = self._discovery_sock.recvfrom(512)
+            except socket.timeout:
+                continue
+            except socket.error:
+                break
+
+            if data.strip() != QUERY:
+                continue
+
+            try:
+                self._discovery_sock.sendto(reply, sender)
+            except socket.error as err:
+                logger.debug("Failed to answer {}: {}".format(sender, err))
+
+
+def discover_peers(addresses=(BROADCAST,), port=DISCOVERY_PORT,
+                   timeout=DISCOVERY_TIMEOUT):
+    """Find the updaters sharing their package cache on the network.
+
+    Args:
+        addresses (list): Where to send the query to
+        port (int): The UDP port the peers listen on
+        timeout (float): How long to wait for the answers in seconds
+
+    Returns:
+        list: The base URLs of the peers found
+    """
+
+    peers = []
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+
+        for address in addresses:
+            try:
+                sock.sendto(QUERY, (address, port))
+            except socket.error as err:
+                logger.debug("Failed to query {}: {}".format(address, err))
+
+        deadline = time.time() + timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+
+            sock.settimeout(remaining)
+            try:
+                data, sender = sock.recvfrom(512)
+            except socket.timeout:
+                break
+
+            try:
+                peer_port = int(json.loads(data)['port'])
+            except (ValueError, KeyError, TypeError):
+                continue
+
+            peer = 'http://{}:{}'.format(sender[0], peer_port)
+            if peer not in peers:
+                peers.append(peer)
+    finally:
+        sock.close()
+
+    return peers
+
+
+def get_peer_archives(peer):
+    """Fetch the list of archives a peer has.
+
+    Returns:
+        set: The SHA256 of the archives, empty when the peer is unreachable
+    """
+
+    try:
+        conn, response = http_pool.request(
+            peer + '/index', timeout=DISCOVERY_TIMEOUT * 5
+        )
+        try:
+            body = response.read()
+        finally:
+            http_pool.release(conn)
+
+        if response.status != 200:
+            return set()
+
+        return set(json.loads(body))
+    except Exception as err:
+        logger.debug("Failed to get the archives of {}: {}".format(peer, err))
+        return set()
+
+
+def add_peer_uris(items, **discovery_args):
+    """Put the URIs of the peers having the archives ahead of the repository.
+
+    Args:
+        items (list): The :class:`kano_updater.archive_fetcher.ArchiveItem`
+            objects to update
+        discovery_args: Passed on to :func:`discover_peers`
+
+    Returns:
+        int: Number of archives available from a peer
+    """
+
+    if not items:
+        return 0
+
+    shared = set()
+    peers = discover_peers(**discovery_args)
+
+    for peer in peers:
+        archives = get_peer_archives(peer)
+
+        for item in items:
+            if item.sha256 in archives:
+                item.uris.insert(0, '{}/debs/{}'.format(peer, item.sha256))
+                shared.add(item.sha256)
+
+    logger.info("Found {} peers sharing {} of {} archives".format(
+        len(peers), len(shared), len(items)
+    ))
+
+    return len(shared)
@@ -11,17 +11,77 @@ import sys
 import time
 import signal
 import os
-from collections import defaultdict
+from collections import defaultdict, deque
 
 from kano.logging import logger
 
-from kano_updater.signal_handling import SignalPoll
+from kano_updater.signal_handling import SignalPoll, SignalWakeup
+from kano_updater.monitor_heartbeat import HeartbeatChannel, HEARTBEAT_ENV
 from kano_updater.reporting import send_crash_report
 from kano_updater.utils import track_data_and_sync, clear_tracking_uuid
 from kano_updater.return_codes import RC
 
 
 MONITOR_TIMEOUT = 30 * 60
+TREE_SAMPLE_INTERVAL = 10  # seconds
+PROC_DIR = '/proc'
+
+
+def _read_children(pid, proc_dir=PROC_DIR):
+    """
+    Lists the direct children of a process from the `children` files of its
+    threads.
+
+    Returns:
+       a list of the child pids
+    """
+    task_dir = os.path.join(proc_dir, str(pid), 'task')
+
+    try:
+        tids = os.listdir(task_dir)
+    except OSError:
+        return []  # The process is gone
+
+    children = []
+    for tid in tids:
+        try:
+            with open(os.path.join(task_dir, tid, 'children')) as children_file:
+                children.extend(int(child) for child in children_file.read().split())
+        except IOError:
+            pass  # The thread is gone
+
+    return children
+
+
+def _scan_children(proc_dir=PROC_DIR):
+    """
+    Maps every process to its children by reading the parent pid off the
+    `stat` file of each of them.
+
+    Returns:
+       a dict of the lists of child pids, keyed by the parent pid
+    """
+    children = defaultdict(list)
+
+    for entry in os.listdir(proc_dir):
+        if not entry.isdigit():
+            continue
+
+        try:
+            with open(os.path.join(proc_dir, entry, 'stat')) as stat_file:
+                stat = stat_file.read()
+        except IOError:
+            continue  # The process is gone
+
+        # The name in brackets can contain anything, the parent pid is the
+        # second field after it
+        fields = stat[stat.rfind(')') + 1:].split()
+        try:
+            children[int(fields[1])].append(int(entry))
+        except (IndexError, ValueError):
+            pass
+
+    return children
 
 
 class MonitorPids(object):
@@ -29,48 +89,47 @@ class MonitorPids(object):
     Class for monitoring a subprocess tree. If the (recursive) set of child
     processes changes, we assume it is still making progress.
     """
-    def __init__(self, top_pid):
+    def __init__(self, top_pid, proc_dir=PROC_DIR):
         self.top_pid = top_pid
         self.curr_children = set()
+        self.proc_dir = proc_dir
+
+        # Only there with CONFIG_PROC_CHILDREN, otherwise all the processes
+        # need to be scanned for their parent
+        self.has_children_files = os.path.exists(os.path.join(
+            proc_dir, str(top_pid), 'task', str(top_pid), 'children'
+        ))
 
     def _get_children(self):
         """
         Returns:
            a set() of all children (recursively) of self.top_pid (inclusive)
         """
-        try:
-            stdout = subprocess.check_output(["/bin/ps", "-eo", "ppid,pid"])
-            # ps configured to output lines of the form "parent_pid child_pid"
-            coll = defaultdict(set)
-
-            for line in stdout.split('\n'):
-                items = line.split()
-                if len(items) >= 2:
-                    ppid, pid = items[:2]
-                    # Ignore the heading line
-                    if ppid == 'PPID':
-                        continue
-                try:
-                    coll[int(ppid)].add(int(pid))
-                except:
-                    pass  # ignore int conversion failure
-
-            def transitive_closure(pids):
-                """
-                Perform a transitive closure to collect all children
-                Args:
-                   pids (set of int): partically closed set
-                Returns:
-                   transitive closure
-                """
-                curr = pids.copy()
-                for p in pids:
-                    curr = curr.union(transitive_closure(coll[p]))
-                return curr
-            return transitive_closure(set([self.top_pid]))
-
-        except subprocess.CalledProcessError:
-            return set()
+        if self.has_children_files:
+            return self._walk(
+                lambda pid: _read_children(pid, self.proc_dir)
+            )
+
+        parents = _scan_children(self.proc_dir)
+        return self._walk(lambda pid: parents.get(pid, ()))
+
+    def _walk(self, get_children):
+        """
+        Collects the tree breadth first, visiting every process once.
+
+        Args:
+           get_children (function): returns the direct children of a pid
+        """
+        pids = set([self.top_pid])
+        queue = deque(pids)
+
+        while queue:
+            for child in get_children(queue.popleft()):
+                if child not in pids:
+                    pids.add(child)
+                    queue.append(child)
+
+        return pids
 
     def is_changed(self):
         """
@@ -86,17 +145,21 @@ class MonitorPids(object):
         return changed
 
 
-def monitor(watchproc, timeout):
+def monitor(watchproc, timeout, channel=None):
     """
-    Monitor a process tree. If the (recursive) set of child processes changes
-    or we are sent a SIGUSR1, we note that it is making progress.
+    Monitor a process tree. If the (recursive) set of child processes changes,
+    the heartbeat counter moves or we are sent a SIGUSR1, we note that it is
+    making progress.
     if it has not made progress for `timeout` seconds, or the process
     finished, exit.
+    Between samples of the process tree, it sleeps until a signal comes in
+    (including the SIGCHLD of the process exiting) or the next deadline.
 
     Args:
          watchproc (subprocess.Popen): process to watch
          timeout (int): time in seconds to wait without seeing activity
                         before decalring the process stuck
+         channel (HeartbeatChannel): heartbeats shared with the process
 
     Returns:
          true if we timed out and false if the process finished
@@ -105,33 +168,56 @@ def monitor(watchproc, timeout):
     """
     watchpid = watchproc.pid
 
+    # Every signal wakes the loop up, which otherwise only needs to sample the
+    # process tree and check whether the deadline passed
+    wakeup = SignalWakeup()
     spoll = SignalPoll(signal.SIGUSR1)
     tpoll = SignalPoll(signal.SIGTERM)
+    cpoll = SignalPoll(signal.SIGCHLD)
 
+    sample_interval = min(TREE_SAMPLE_INTERVAL, timeout / 10.0)
     lastEvent = time.time()
+    nextSample = lastEvent
 
     pids = MonitorPids(watchpid)
-
-    while True:
-        now = time.time()
-        # check for child events
-        changed = pids.is_changed()
-        if watchproc.poll() is not None:
-            return False
-
-        signalled = spoll.poll()
-        if changed or signalled:
-            lastEvent = now
-
-        # if we were sent a terminate signal
-        # forward it to the child process
-        if tpoll.poll():
-            watchproc.terminate()
-
-        if lastEvent + timeout < now:
-            return True
-
-        time.sleep(1)
+    beat = channel.read() if channel else None
+
+    try:
+        while True:
+            cpoll.poll()
+            if watchproc.poll() is not None:
+                return False
+
+            now = time.time()
+            if spoll.poll():
+                lastEvent = now
+
+            # check for child events, always before giving up on it
+            if now >= nextSample or lastEvent + timeout < now:
+                if pids.is_changed():
+                    lastEvent = now
+
+                if channel:
+                    sample = channel.read()
+                    if sample[0] != beat[0]:
+                        lastEvent = now
+                    beat = sample
+                nextSample = now + sample_interval
+
+            # if we were sent a terminate signal
+            # forward it to the child process
+            if tpoll.poll():
+                watchproc.terminate()
+
+            if lastEvent + timeout < now:
+                if beat and beat[1]:
+                    logger.error("Last heartbeat in phase '{}'".format(beat[1]))
+                return True
+
+            wakeup.wait(min(nextSample, lastEvent + timeout) - now)
+    finally:
+        cpoll.restore()
+        wakeup.close()
 
 
 def run(cmdargs):
@@ -146,9 +232,23 @@ def run(cmdargs):
         os.execvp(cmdargs[0], cmdargs)
 
     os.environ["MONITOR_PID"] = str(os.getpid())
-    subproc = subprocess.Popen(cmdargs, shell=False)
 
-    if not monitor(subproc, MONITOR_TIMEOUT):
+    try:
+        channel = HeartbeatChannel.create()
+        os.environ[HEARTBEAT_ENV] = channel.path
+    except (OSError, IOError) as err:
+        logger.warn("Heartbeats fall back to signals: {}".format(err))
+        channel = None
+
+    try:
+        subproc = subprocess.Popen(cmdargs, shell=False)
+        stuck = monitor(subproc, MONITOR_TIMEOUT, channel)
+    finally:
+        if channel:
+            os.environ.pop(HEARTBEAT_ENV, None)
+            channel.close()
+
+    if not stuck:
         return subproc.returncode
 
     logger.error(
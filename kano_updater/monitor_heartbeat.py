@@ -1,24 +1,163 @@
 # monitor_heartbeat.py
 #
-# Copyright (C) 2018 Kano Computing Ltd.
+# Copyright (C) 2018-2019 Kano Computing Ltd.
 # License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
 #
 # logically part of the heartbeat module, but
 # causes dependency problems
+#
+# The monitor shares a small file with the processes it watches, named by the
+# MONITOR_HEARTBEAT environment variable. It holds a counter, which every
+# heartbeat increments, and the name of the current phase. Being memory mapped,
+# a heartbeat costs no system call and the monitor samples it at its own pace.
+# Without the file, the monitor is signalled instead, at most every
+# SIGNAL_INTERVAL seconds.
 
 
 import os
-from kano.logging import logger
+import mmap
+import time
+import struct
 import signal
+import tempfile
+
+from kano.logging import logger
+
+
+HEARTBEAT_ENV = 'MONITOR_HEARTBEAT'
+HEARTBEAT_DIR = '/dev/shm'
+SIGNAL_INTERVAL = 1  # seconds
+
+_COUNTER = struct.Struct('<Q')
+_PHASE_SIZE = 56  # bytes
+HEARTBEAT_SIZE = _COUNTER.size + _PHASE_SIZE
+
+
+class HeartbeatChannel(object):
+    '''
+    The counter and phase name in the file shared with the monitor.
+
+    :param path: The file, as created by :meth:`create`
+    :param is_owner: Whether to remove the file when closed
+    '''
+
+    def __init__(self, path, is_owner=False):
+        self._path = path
+        self._is_owner = is_owner
+        self._phase = None
+
+        fd = os.open(path, os.O_RDWR)
+        try:
+            self._map = mmap.mmap(fd, HEARTBEAT_SIZE)
+        finally:
+            os.close(fd)
+
+    @classmethod
+    def create(cls):
+        """Make a new channel for a monitor.
+
+        Returns:
+            HeartbeatChannel: The channel, which owns its file
+        """
+
+        directory = HEARTBEAT_DIR
+        if not os.path.isdir(directory):
+            directory = tempfile.gettempdir()
+
+        fd, path = tempfile.mkstemp(prefix='kano-updater-heartbeat-',
+                                    dir=directory)
+        try:
+            os.write(fd, '\0' * HEARTBEAT_SIZE)
+        finally:
+            os.close(fd)
+
+        return cls(path, is_owner=True)
+
+    @property
+    def path(self):
+        return self._path
 
+    def beat(self, phase=None):
+        # Processes sharing the channel can race to increment the counter, so
+        # only a change of the value is meaningful, not the count itself
+        count = _COUNTER.unpack_from(self._map, 0)[0]
+        _COUNTER.pack_into(self._map, 0, count + 1)
 
-def heartbeat():
+        if phase and phase != self._phase:
+            self._phase = phase
+            if isinstance(phase, unicode):
+                phase = phase.encode('utf-8')
+            self._map[_COUNTER.size:] = \
+                phase[:_PHASE_SIZE].ljust(_PHASE_SIZE, '\0')
+
+    def read(self):
+        """Sample the channel.
+
+        Returns:
+            tuple: The counter and the name of the last phase reported
+        """
+
+        count = _COUNTER.unpack_from(self._map, 0)[0]
+        phase = self._map[_COUNTER.size:].rstrip('\0')
+
+        return count, phase
+
+    def close(self):
+        self._map.close()
+
+        if self._is_owner:
+            try:
+                os.remove(self._path)
+            except OSError:
+                pass
+
+
+_channel = None
+_channel_path = None
+_last_signal = 0
+
+
+def _get_channel():
+    global _channel, _channel_path
+
+    path = os.environ.get(HEARTBEAT_ENV)
+    if path != _channel_path:
+        _channel_path = path
+        _channel = None
+
+        if path:
+            try:
+                _channel = HeartbeatChannel(path)
+            except (OSError, IOError, mmap.error) as err:
+                logger.warn("Can't open the heartbeat file {}: {}".format(
+                    path, err
+                ))
+
+    return _channel
+
+
+def heartbeat(phase=None):
     """
     Inform monitor process, if it exists, that we are still alive
+
+    Args:
+        phase (str): Name of the phase the process is in
     """
 
+    global _last_signal
+
+    channel = _get_channel()
+    if channel:
+        channel.beat(phase)
+        return
+
     monitor_pid = os.environ.get("MONITOR_PID")
     if monitor_pid:
+        now = time.time()
+        if 0 <= now - _last_signal < SIGNAL_INTERVAL:
+            return
+        _last_signal = now
+
         try:
             pid = int(monitor_pid)
             os.kill(pid, signal.SIGUSR1)
@@ -11,6 +11,14 @@ SYSTEM_ISSUE_FILE = '/etc/issue'
 SYSTEM_VERSION_FILE = '/etc/kanux_version'
 
 STATUS_FILE_PATH = '/var/cache/kano-updater/status.json'
+STATUS_RECORD_PATH = '/var/cache/kano-updater/status.record'
+DEB_CACHE_DIR = '/var/cache/kano-updater/debs'
+UPGRADE_PLAN_PATH = '/var/cache/kano-updater/upgrade-plan.json'
+PHASE_HISTORY_PATH = '/var/cache/kano-updater/phase-history.json'
+
+APT_LISTS_DIR = '/var/lib/apt/lists'
+APT_ARCHIVES_DIR = '/var/cache/apt/archives'
+DPKG_STATUS_FILE = '/var/lib/dpkg/status'
 
 SOURCES_DIR = '/etc/apt/sources.list.d'
 KANO_SOURCES_LIST = os.path.join(SOURCES_DIR, 'kano-repos.list')
@@ -0,0 +1,167 @@
+# phase_history.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# How long the phases of the progress took on the previous runs.
+#
+# The weights the phases are split with are only a rough guess at their
+# duration. Once a phase has been seen on this device, its weight relative to
+# its siblings is taken from how long it actually took, so the percentage
+# moves with the time.
+
+
+import os
+import json
+
+from kano.logging import logger
+
+from kano_updater.paths import PHASE_HISTORY_PATH
+
+
+HISTORY_FORMAT = 1
+HISTORY_RUNS = 5  # runs kept per phase
+MIN_DURATION = 0.1  # seconds
+
+
+class PhaseHistory(object):
+    '''
+    The durations and byte counts of the phases on the last HISTORY_RUNS runs
+    which completed.
+
+    A run interrupted by a relaunch of the updater is kept pending until the
+    relaunched updater completes it.
+
+    :param path: The file the history is kept in
+    '''
+
+    def __init__(self, path=PHASE_HISTORY_PATH):
+        self._path = path
+        self._phases = {}
+        self._pending = {}
+
+        self._load()
+
+    def get_duration(self, name):
+        """The typical duration of a phase.
+
+        Returns:
+            float: The median of the recorded durations in seconds, None
+            when the phase was never recorded
+        """
+
+        runs = self._phases.get(name)
+        if not runs:
+            return None
+
+        durations = sorted(run[0] for run in runs)
+        middle = len(durations) / 2
+        if len(durations) % 2:
+            return durations[middle]
+
+        return (durations[middle - 1] + durations[middle]) / 2.0
+
+    def rebalance(self, phases):
+        """Weigh sibling phases by their recorded durations.
+
+        The phases with a history share the weight they were given between
+        them in proportion to how long they took. The others keep theirs.
+
+        Args:
+            phases (list): Phase objects about to be split into
+        """
+
+        known = []
+        for phase in phases:
+            duration = self.get_duration(phase.name)
+            if duration is not None:
+                known.append((phase, max(duration, MIN_DURATION)))
+
+        if len(known) < 2:
+            return
+
+        weight = sum(phase.weight for phase, dummy_duration in known)
+        total = sum(duration for dummy_phase, duration in known)
+
+        for phase, duration in known:
+            phase.weight = weight * duration / total
+
+    def add_pending(self, durations, byte_counts):
+        """Keep the phases of a run which is going to carry on in another
+        process.
+
+        Args:
+            durations (dict): Seconds spent in each phase, by name
+            byte_counts (dict): Bytes transferred by each phase, by name
+        """
+
+        for name, seconds in durations.iteritems():
+            pending = self._pending.setdefault(name, [0, None])
+            pending[0] += seconds
+
+            if byte_counts.get(name) is not None:
+                pending[1] = (pending[1] or 0) + byte_counts[name]
+
+        self._save()
+
+    def add_run(self, durations, byte_counts):
+        """Record a run which completed, along with the pending phases.
+
+        Args:
+            durations (dict): Seconds spent in each phase, by name
+            byte_counts (dict): Bytes transferred by each phase, by name
+        """
+
+        pending = self._pending
+        self._pending = {}
+
+        for name, seconds in durations.iteritems():
+            run = pending.setdefault(name, [0, None])
+            run[0] += seconds
+
+            if byte_counts.get(name) is not None:
+                run[1] = (run[1] or 0) + byte_counts[name]
+
+        for name, run in pending.iteritems():
+            runs = self._phases.setdefault(name, [])
+            runs.append([round(run[0], 2), run[1]])
+            del runs[:-HISTORY_RUNS]
+
+        self._save()
+
+    def discard_pending(self):
+        if self._pending:
+            self._pending = {}
+            self._save()
+
+    def _load(self):
+        try:
+            with open(self._path, 'r') as history_file:
+                data = json.load(history_file)
+        except (IOError, OSError, ValueError):
+            return
+
+        try:
+            if data['format'] != HISTORY_FORMAT:
+                return
+
+            self._phases = data['phases']
+            self._pending = data['pending']
+        except (KeyError, TypeError) as err:
+            logger.warn("The phase history is corrupted: {}".format(err))
+
+    def _save(self):
+        data = {
+            'format': HISTORY_FORMAT,
+            'phases': self._phases,
+            'pending': self._pending,
+        }
+
+        tmp_path = '{}.tmp-{}'.format(self._path, os.getpid())
+
+        try:
+            with open(tmp_path, 'w') as history_file:
+                json.dump(data, history_file, separators=(',', ':'))
+            os.rename(tmp_path, self._path)
+        except (IOError, OSError) as err:
+            logger.warn("Failed to save the phase history: {}".format(err))
@@ -8,12 +8,34 @@
 
 import os
 import sys
+import time
+import Queue
+import threading
+from collections import namedtuple
 
 from kano.logging import logger
 import monitor_heartbeat
 from kano_updater.reporting import send_crash_report
 
 
+# Steps within the same phase are passed on at most this often, unless they
+# complete the phase. The last one held back goes out once the interval is
+# over.
+THROTTLE_INTERVAL = 0.5  # seconds
+
+# Events published to the subscribers of a progress
+EVENT_START = 'start'
+EVENT_STEP = 'step'
+EVENT_FAIL = 'fail'
+EVENT_ABORT = 'abort'
+EVENT_DONE = 'done'
+EVENT_RELAUNCH = 'relaunch'
+
+SUBSCRIBER_QUEUE_SIZE = 100  # events
+ETA_MIN_PERCENT = 1  # The ETA is too rough to show before that
+FLUSH_TIMEOUT = 5  # seconds
+
+
 def encode(x):
     """Placeholder function to translate encoding only when necessary"""
     return x.encode('utf-8') if isinstance(x, unicode) else x
@@ -35,24 +57,34 @@ class Phase(object):
     :param label: The human readable label for the phase
     :param weight: Metric for task size. Often used as percentage of the whole
     :param is_main: Should subtasks be labelled as belonging to this task
+    :param in_history: Whether the phase is the same from one run to the
+                       next, so its duration can weigh it on the next runs
     :type name: str
     :type label: str
     :type weight: int or float
     :type is_main: bool
+    :type in_history: bool
     '''
 
-    def __init__(self, name, label, weight=1, is_main=False):
+    def __init__(self, name, label, weight=1, is_main=False,
+                 in_history=True):
         self.name = name
         self.label = label
         self.weight = weight
+        self.in_history = in_history
 
         self.start = 0
         self.length = 100
-        self.parents = []
+        self._parents = []
+        self._main_phase = None
 
         self.step_count = 1
         self._step = 0
 
+        # Bytes transferred so far and in total, when they are known
+        self.bytes_done = None
+        self.bytes_total = None
+
         self.is_main = is_main
 
     @property
@@ -62,8 +94,12 @@ class Phase(object):
 
     @property
     def global_percent(self):
+        return int(self.exact_global_percent)
+
+    @property
+    def exact_global_percent(self):
         factor = float(self.step) / self.step_count
-        return int(self.start + factor * self.length)
+        return self.start + factor * self.length
 
     @property
     def step(self):
@@ -76,7 +112,30 @@ class Phase(object):
         else:
             self._step = self.step_count
 
+    @property
+    def parents(self):
+        return self._parents
+
+    @parents.setter
+    def parents(self, parents):
+        self._parents = parents
+        self._main_phase = None
+
+    def get_path(self):
+        """
+            The names of the phases the phase was split from, outermost
+            first and leaving the root out, followed by its own.
+        """
+        return [phase.name for phase in reversed(self.parents[:-1])] + \
+            [self.name]
+
     def get_main_phase(self):
+        if self._main_phase is None:
+            self._main_phase = self._find_main_phase()
+
+        return self._main_phase
+
+    def _find_main_phase(self):
         if self.is_main:
             return self
 
@@ -87,6 +146,153 @@ class Phase(object):
         return self
 
 
+# What happened to the progress, as seen at the time:
+#   kind: One of the EVENT_* constants
+#   phase: Name of the current phase
+#   label: Label of the current phase
+#   main_phase: Name of the main phase the current one belongs to
+#   main_label: Label of the main phase
+#   global_percent: Overall progress
+#   percent: Progress within the current phase
+#   msg: The message which came with the event
+#   path: Names of the phases down to the current one, see Phase.get_path()
+#   step: Step of the current phase
+#   step_count: Number of steps of the current phase
+#   bytes_done: Bytes transferred in the current phase, None if unknown
+#   bytes_total: Bytes to transfer in the current phase, None if unknown
+#   time: When the event happened
+#   eta: Estimate of the seconds left, None if unknown
+ProgressEvent = namedtuple(
+    'ProgressEvent',
+    ['kind', 'phase', 'label', 'main_phase', 'main_label', 'global_percent',
+     'percent', 'msg', 'path', 'step', 'step_count', 'bytes_done',
+     'bytes_total', 'time', 'eta']
+)
+
+
+class ProgressSubscriber(object):
+    '''
+    Delivers the events of a progress to a callback on its own thread, so the
+    install never waits for it. When the callback falls behind and its queue
+    fills up, new steps are dropped, and the oldest events make room for any
+    other kind of event.
+
+    :param callback: Called with every ProgressEvent
+    :param queue_size: Number of events waiting to be delivered at most
+    '''
+
+    def __init__(self, callback, queue_size=SUBSCRIBER_QUEUE_SIZE):
+        self.dropped = 0
+        self.callback = callback
+
+        self._queue = Queue.Queue(queue_size)
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, event):
+        try:
+            self._queue.put_nowait(event)
+            return
+        except Queue.Full:
+            pass
+
+        if event.kind != EVENT_STEP:
+            try:
+                self._queue.get_nowait()
+                self._queue.task_done()
+                self._queue.put_nowait(event)
+            except (Queue.Empty, Queue.Full):
+                pass
+
+        self.dropped += 1
+
+    def flush(self, timeout=FLUSH_TIMEOUT):
+        """
+            Waits for the events already queued to be delivered.
+
+            :returns: Whether all of them were
+            :rtype: bool
+        """
+        deadline = time.time() + timeout
+
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+
+        return True
+
+    def close(self):
+        self._queue.put(None)
+
+    def _run(self):
+        while True:
+            event = self._queue.get()
+
+            try:
+                if event is None:
+                    return
+
+                self.callback(event)
+            except Exception as err:
+                logger.error(
+                    "Progress subscriber {} failed: {}".format(
+                        self.callback, err
+                    )
+                )
+            finally:
+                self._queue.task_done()
+
+
+class ProgressBus(object):
+    '''
+    Fans the events of a progress out to any number of subscribers.
+    '''
+
+    def __init__(self):
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def subscribe(self, callback, queue_size=SUBSCRIBER_QUEUE_SIZE):
+        subscriber = ProgressSubscriber(callback, queue_size)
+
+        with self._lock:
+            self._subscribers = self._subscribers + [subscriber]
+
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers = [
+                sub for sub in self._subscribers if sub is not subscriber
+            ]
+
+        subscriber.close()
+
+    def publish(self, event):
+        for subscriber in self._subscribers:
+            subscriber.put(event)
+
+    def flush(self, timeout=FLUSH_TIMEOUT):
+        deadline = time.time() + timeout
+
+        for subscriber in self._subscribers:
+            if not subscriber.flush(max(deadline - time.time(), 0)):
+                logger.warn(
+                    "Progress subscriber {} didn't catch up in {}s, its "
+                    "last events may be lost".format(
+                        subscriber.callback, timeout
+                    )
+                )
+
+
 class Progress(object):
     """
         The base class for progress reporting of both downloads and
@@ -95,11 +301,49 @@ class Progress(object):
         what's going on.
     """
 
-    def __init__(self):
+    # Whether the failures and aborts are sent as crash reports
+    _sends_crash_reports = True
+
+    def __init__(self, throttle_interval=THROTTLE_INTERVAL):
         root_phase = Phase('root', _("The root phase"), 1)
 
-        self._phases = [root_phase]
-        self._current_phase_idx = 0
+        self._throttle_interval = throttle_interval
+        self._last_update = None
+        self._last_update_time = 0
+
+        # The latest step held back by the throttling, and the timer which
+        # passes it on
+        self._pending_step = None
+        self._flush_timer = None
+        self._step_lock = threading.RLock()
+
+        # The phases which haven't been split, by name
+        self._phases = {root_phase.name: root_phase}
+        self._current_phase = root_phase
+
+        # The crash reports go out from a subscriber too, a slow network
+        # mustn't hold the updater back
+        self._bus = ProgressBus()
+        if self._sends_crash_reports:
+            self._bus.subscribe(self._report_crash)
+
+        # Time spent in each phase and bytes transferred, for the history
+        self._history = None
+        self._started_at = None
+        self._phase_started_at = None
+        self._durations = {}
+        self._byte_counts = {}
+        self._skipped = set()
+
+    def use_history(self, history):
+        """
+            Weigh the phases by the time they took on the previous runs and
+            record how long they take on this one.
+
+            :param history: Where the durations of the phases are kept
+            :type history: kano_updater.phase_history.PhaseHistory
+        """
+        self._history = history
 
     def start(self, phase_name):
         """
@@ -112,7 +356,11 @@ class Progress(object):
         """
         phase = self._get_phase_by_name(phase_name)
 
-        self._current_phase_idx = self._phases.index(phase)
+        self._flush_step()
+        self._account_time()
+        self._current_phase = phase
+        if self._started_at is None:
+            self._started_at = self._phase_started_at
 
         log = "global({}%) local({}%): " \
               "Starting '{}' ({}) [main phase '{}' ({})]".format(
@@ -126,11 +374,13 @@ class Progress(object):
         logger.info(log)
 
         # Calculate current progress and emit an event
-        monitor_heartbeat.heartbeat()
+        monitor_heartbeat.heartbeat(phase.name)
+        self._record_update(phase, phase.label)
         self._change(phase, phase.label)
+        self._publish(EVENT_START, phase, phase.label)
 
     def get_current_phase(self):
-        return self._phases[self._current_phase_idx]
+        return self._current_phase
 
     def split(self, *subphases, **kwargs):
         if 'phase_name' not in kwargs:
@@ -138,6 +388,11 @@ class Progress(object):
         else:
             phase = self._get_phase_by_name(kwargs['phase_name'])
 
+        if self._history:
+            self._history.rebalance(
+                [subphase for subphase in subphases if subphase.in_history]
+            )
+
         start = phase.start
         weight_sum = sum([p.weight for p in subphases])
         for subphase in subphases:
@@ -157,20 +412,47 @@ class Progress(object):
 
             subphase.parents = [phase] + phase.parents
 
-        # Implant the subphases into the phase list in place of the parent
-        idx = self._phases.index(phase)
-        self._phases = self._phases[0:idx] + list(subphases) + \
-            self._phases[idx + 1:]
+        # Implant the subphases into the phase index in place of the parent
+        del self._phases[phase.name]
+        for subphase in subphases:
+            self._phases[subphase.name] = subphase
+
+        if self._current_phase is phase:
+            self._current_phase = subphases[0]
 
     def init_steps(self, phase_name, step_count):
         phase = self._get_phase_by_name(phase_name)
         phase.step_count = step_count
         phase.step = 0
 
-    def set_step(self, phase_name, step, msg):
+    def set_bytes(self, phase_name, bytes_done, bytes_total):
+        """
+            Records how much a phase transferred, which comes with its
+            next step.
+        """
+        phase = self._get_phase_by_name(phase_name)
+        phase.bytes_done = bytes_done
+        phase.bytes_total = bytes_total
+
+        self._byte_counts[phase.name] = bytes_done
+
+    def set_step(self, phase_name, step, msg, skipped=False):
+        """
+            :param skipped: Whether the phase was cut short as there was
+                            nothing for it to do, its duration then says
+                            nothing about the next runs and isn't recorded
+        """
         phase = self._get_phase_by_name(phase_name)
         phase.step = step
+        if skipped:
+            self._skipped.add(phase.name)
 
+        monitor_heartbeat.heartbeat(phase.name)
+        with self._step_lock:
+            if self._is_update_due(phase, msg):
+                self._report_step(phase, msg)
+
+    def _report_step(self, phase, msg):
         log = "global({}%) local({}%): " \
               "Next step in '{}' ({})  [main phase '{}' ({})]: {}".format(
                   phase.global_percent,
@@ -182,28 +464,92 @@ class Progress(object):
                   encode(msg)
               )
         logger.info(log)
-        monitor_heartbeat.heartbeat()
         self._change(phase, msg)
+        self._publish(EVENT_STEP, phase, msg)
 
     def next_step(self, phase_name, msg):
         phase = self._get_phase_by_name(phase_name)
         self.set_step(phase_name, phase.step + 1, msg)
 
+    def _is_update_due(self, phase, msg):
+        """
+            Coalesces the steps before they reach the log and the UI.
+
+            A step in the same phase as the last update is dropped when it
+            changes neither the global percentage nor the message. When it
+            comes within the throttle interval and doesn't complete the
+            phase, it is held back until the interval is over, unless a
+            newer step replaces it. Phase transitions always go through, as
+            do the failures and the end of the progress, which don't come by
+            here, and pass any step held back on first.
+
+            :returns: Whether to pass the step on
+            :rtype: bool
+        """
+        update = (phase, phase.global_percent, msg)
+
+        if self._last_update and phase is self._last_update[0]:
+            if update == self._last_update:
+                self._pending_step = None
+                return False
+
+            elapsed = time.time() - self._last_update_time
+            if phase.step < phase.step_count and \
+                    0 <= elapsed < self._throttle_interval:
+                self._pending_step = (phase, msg)
+                self._schedule_flush(self._throttle_interval - elapsed)
+                return False
+
+        self._pending_step = None
+        self._record_update(phase, msg)
+        return True
+
+    def _schedule_flush(self, delay):
+        if self._flush_timer is not None:
+            return
+
+        self._flush_timer = threading.Timer(delay, self._flush_step)
+        self._flush_timer.daemon = True
+        self._flush_timer.start()
+
+    def _flush_step(self):
+        """
+            Passes on the step held back by the throttling, if any. Called
+            by the timer, and ahead of any other update so they stay in
+            order.
+        """
+        with self._step_lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+
+            if self._pending_step is None:
+                return
+
+            phase, msg = self._pending_step
+            self._pending_step = None
+
+            self._record_update(phase, msg)
+            self._report_step(phase, msg)
+
+    def _record_update(self, phase, msg):
+        self._last_update = (phase, phase.global_percent, msg)
+        self._last_update_time = time.time()
+
     def _get_phase_by_name(self, name, do_raise=True):
-        for phase in self._phases:
-            if phase.name == name:
-                return phase
+        phase = self._phases.get(name)
 
-        if do_raise:
+        if phase is None and do_raise:
             raise ValueError("Phase '{}' doesn't exist".format(name))
 
+        return phase
+
     def fail(self, msg):
-        phase = self._phases[self._current_phase_idx]
+        self._flush_step()
+        phase = self._current_phase
         logger.error("Error {}: {}".format(phase.label.encode('utf-8'), encode(msg)))
-        send_crash_report(
-            'Updater failure',
-            'Failed with error: {}'.format(msg)
-        )
+        self._publish(EVENT_FAIL, phase, msg)
+        self._bus.flush()
         self._error(phase, msg)
 
     def prompt(self, msg, question, answers=None):
@@ -216,26 +562,150 @@ class Progress(object):
         return self._prompt(msg, question, answers)
 
     def finish(self, msg):
+        self._flush_step()
         logger.info("Complete: {}".format(msg))
+
+        self._account_time()
+        if self._history:
+            self._history.add_run(*self._get_history_run())
+            self._reset_durations()
+
+        self._publish(EVENT_DONE, self._current_phase, msg, global_percent=100)
+        self._bus.flush()
         self._done(msg)
 
     def relaunch(self):
+        self._flush_step()
         logger.info("Scheduling relaunch")
         monitor_heartbeat.heartbeat()
+
+        self._account_time()
+        if self._history:
+            self._history.add_pending(*self._get_history_run())
+            self._reset_durations()
+
+        self._publish(EVENT_RELAUNCH, self._current_phase, '')
+        self._bus.flush()
         self._relaunch()
 
+    def get_eta(self):
+        """
+            Estimates the time left from the time taken so far, which works
+            out as long as the weights of the phases follow their durations.
+
+            :returns: The seconds left, None until there is enough progress
+                      to tell
+            :rtype: int
+        """
+        if self._started_at is None:
+            return None
+
+        done = self._current_phase.exact_global_percent
+        if done < ETA_MIN_PERCENT:
+            return None
+
+        elapsed = time.time() - self._started_at
+        return int(elapsed * max(100 - done, 0) / done)
+
+    def _account_time(self):
+        """
+            Adds the time since the last call to the current phase and the
+            ones it was split from.
+        """
+        now = time.time()
+
+        if self._phase_started_at is not None:
+            elapsed = now - self._phase_started_at
+            phase = self._current_phase
+
+            for p in [phase] + phase.parents[:-1]:
+                if p.in_history:
+                    self._durations[p.name] = \
+                        self._durations.get(p.name, 0) + elapsed
+
+        self._phase_started_at = now
+
+    def _get_history_run(self):
+        """
+            The durations and byte counts to record, leaving the skipped
+            phases out.
+        """
+        durations = {
+            name: seconds for name, seconds in self._durations.iteritems()
+            if name not in self._skipped
+        }
+        byte_counts = {
+            name: count for name, count in self._byte_counts.iteritems()
+            if name not in self._skipped
+        }
+
+        return durations, byte_counts
+
+    def _reset_durations(self):
+        """
+            Starts over once the history has what was measured, so nothing
+            is recorded twice.
+        """
+        self._durations = {}
+        self._byte_counts = {}
+        self._skipped = set()
+
+    def subscribe(self, callback, queue_size=SUBSCRIBER_QUEUE_SIZE):
+        """
+            Have the events of the progress delivered to a callback as well.
+
+            :param callback: Called with each ProgressEvent, from a thread
+                             of its own
+            :type callback: function
+
+            :returns: The subscriber, to pass to unsubscribe()
+            :rtype: ProgressSubscriber
+        """
+        return self._bus.subscribe(callback, queue_size)
+
+    def unsubscribe(self, subscriber):
+        self._bus.unsubscribe(subscriber)
+
+    def _publish(self, kind, phase, msg, global_percent=None):
+        main_phase = phase.get_main_phase()
+        eta = 0 if kind == EVENT_DONE else self.get_eta()
+        if global_percent is None:
+            global_percent = phase.global_percent
+
+        self._bus.publish(ProgressEvent(
+            kind, phase.name, phase.label, main_phase.name, main_phase.label,
+            global_percent, phase.percent, msg, phase.get_path(), phase.step,
+            phase.step_count, phase.bytes_done, phase.bytes_total, time.time(),
+            eta
+        ))
+
     def abort(self, msg):
         """
             Akin a an exception
         """
-        phase = self._phases[self._current_phase_idx]
+        self._flush_step()
+        phase = self._current_phase
         logger.error("Aborting {}, {}".format(phase.label, msg))
-        send_crash_report(
-            'Updater aborted',
-            'Aborted with error: {}'.format(msg)
-        )
+        if self._history:
+            self._history.discard_pending()
+
+        self._publish(EVENT_ABORT, phase, msg)
+        self._bus.flush()
         self._abort(phase, msg)
 
+    @staticmethod
+    def _report_crash(event):
+        if event.kind == EVENT_FAIL:
+            send_crash_report(
+                'Updater failure',
+                'Failed with error: {}'.format(event.msg)
+            )
+        elif event.kind == EVENT_ABORT:
+            send_crash_report(
+                'Updater aborted',
+                'Aborted with error: {}'.format(event.msg)
+            )
+
     def _change(self, phase, msg):
         """
             The callback that is triggered for each progress change.
@@ -288,6 +758,8 @@ class Progress(object):
 
 
 class DummyProgress(Progress):
+    _sends_crash_reports = False
+
     def start(self, phase_name):
         pass
 
@@ -297,7 +769,10 @@ class DummyProgress(Progress):
     def init_steps(self, phase_name, step_count):
         pass
 
-    def set_step(self, phase_name, step, msg):
+    def set_bytes(self, phase_name, bytes_done, bytes_total):
+        pass
+
+    def set_step(self, phase_name, step, msg, skipped=False):
         pass
 
     def next_step(self, phase_name, msg):
@@ -0,0 +1,90 @@
+# progress_stream.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Machine readable progress, written to a file descriptor as JSON lines.
+#
+# Each line holds one event of the progress, e.g.:
+#
+#   {"event":"step","percent":42,"path":["install","install-deb-packages"],
+#    "step":37,"step_count":100,"msg":"Unpacking ...","bytes_done":null,
+#    "bytes_total":null,"time":1555000000.12,"elapsed":310.4,...}
+
+
+import os
+import json
+import errno
+import time
+
+from kano.logging import logger
+
+
+class ProgressStream(object):
+    '''
+    Subscriber of a progress which writes its events to a file descriptor.
+    It stops writing once the reader is gone.
+
+    :param fd: The file descriptor to write to, left open
+    '''
+
+    def __init__(self, fd):
+        self._fd = fd
+        self._started = time.time()
+        self._is_closed = False
+
+    def __call__(self, event):
+        if self._is_closed:
+            return
+
+        line = json.dumps(self.format_event(event), separators=(',', ':'))
+        data = line + '\n'
+
+        try:
+            while data:
+                data = data[os.write(self._fd, data):]
+        except OSError as err:
+            self._is_closed = True
+            if err.errno != errno.EPIPE:
+                logger.warn("Stopped streaming the progress: {}".format(err))
+
+    def format_event(self, event):
+        return {
+            'event': event.kind,
+            'percent': event.global_percent,
+            'phase': event.phase,
+            'label': event.label,
+            'main_phase': event.main_phase,
+            'main_label': event.main_label,
+            'path': event.path,
+            'phase_percent': event.percent,
+            'step': event.step,
+            'step_count': event.step_count,
+            'msg': event.msg,
+            'bytes_done': event.bytes_done,
+            'bytes_total': event.bytes_total,
+            'time': round(event.time, 3),
+            'elapsed': round(event.time - self._started, 3),
+            'eta': event.eta,
+        }
+
+
+def stream_progress(progress, fd):
+    """Write the events of a progress to a file descriptor.
+
+    Args:
+        progress (Progress): The progress to follow
+        fd (int): An open file descriptor, typically a pipe
+
+    Returns:
+        ProgressSubscriber: The subscriber, None if the file descriptor
+        isn't usable
+    """
+
+    try:
+        os.fstat(fd)
+    except OSError as err:
+        logger.error("Can't stream the progress to fd {}: {}".format(fd, err))
+        return None
+
+    return progress.subscribe(ProgressStream(fd))
@@ -0,0 +1,157 @@
+# release_check.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Cheap check of whether the repositories changed since the last update check.
+#
+# Every repository publishes an InRelease file which changes with any of its
+# indexes. Asking for it with the validators of the previous response (ETag
+# and Last-Modified) tells whether anything changed without transferring it.
+
+
+import os
+import socket
+import httplib
+
+from kano.logging import logger
+
+from kano_updater.paths import DPKG_STATUS_FILE
+import kano_updater.http_pool as http_pool
+
+
+TIMEOUT = 3  # seconds
+
+
+def get_release_urls(sources_list):
+    """List the InRelease files of the repositories in a sources list.
+
+    Args:
+        sources_list (str): Path to a sources list in the one-line format
+
+    Returns:
+        list: URLs of the InRelease files, None when the list can't be read
+    """
+
+    urls = []
+
+    try:
+        with open(sources_list, 'r') as sources_file:
+            lines = sources_file.readlines()
+    except IOError:
+        return None
+
+    for line in lines:
+        tokens = line.split('#', 1)[0].split()
+        if not tokens or tokens[0] != 'deb':
+            continue
+
+        tokens = tokens[1:]
+        if tokens and tokens[0].startswith('['):
+            while tokens and not tokens[0].endswith(']'):
+                tokens.pop(0)
+            tokens = tokens[1:]
+
+        if len(tokens) < 2 or not tokens[0].startswith('http'):
+            continue
+
+        uri, dist = tokens[0].rstrip('/'), tokens[1]
+        url = '{}/dists/{}/InRelease'.format(uri, dist)
+        if url not in urls:
+            urls.append(url)
+
+    return urls
+
+
+def get_dpkg_status_mtime():
+    try:
+        return int(os.path.getmtime(DPKG_STATUS_FILE))
+    except OSError:
+        return 0
+
+
+def _get_validators(response):
+    validators = {}
+
+    etag = response.getheader('ETag')
+    if etag:
+        validators['etag'] = etag
+
+    last_modified = response.getheader('Last-Modified')
+    if last_modified:
+        validators['last_modified'] = last_modified
+
+    return validators
+
+
+def _check_release(url, validators):
+    '''
+    Returns whether the release changed and its current validators.
+    '''
+
+    headers = {}
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
+
+    conn, response = http_pool.request(
+        url, method='HEAD', headers=headers, timeout=TIMEOUT
+    )
+    response.read()
+    http_pool.release(conn)
+
+    if response.status == httplib.NOT_MODIFIED:
+        return False, validators
+
+    if response.status != httplib.OK:
+        raise httplib.HTTPException("{} returned {} {}".format(
+            url, response.status, response.reason
+        ))
+
+    current = _get_validators(response)
+    if not current:
+        # Nothing to compare against, assume it changed
+        return True, current
+
+    # Some servers ignore the conditions of a HEAD request
+    changed = any(
+        validators.get(key) != value for key, value in current.iteritems()
+    )
+
+    return changed, current
+
+
+def check_releases(sources_list, last_validators):
+    """Check whether any of the repositories changed.
+
+    Args:
+        sources_list (str): Path to the sources list with the repositories
+        last_validators (dict): The validators returned by the previous
+            check, keyed by the URL of the InRelease
+
+    Returns:
+        tuple: Whether anything changed (None when it couldn't be determined)
+        and the validators to pass to the next check
+    """
+
+    urls = get_release_urls(sources_list)
+    if not urls:
+        return None, {}
+
+    changed = False
+    validators = {}
+
+    try:
+        for url in urls:
+            url_changed, validators[url] = _check_release(
+                url, last_validators.get(url, {})
+            )
+            changed = changed or url_changed
+    except (IOError, socket.error, httplib.HTTPException) as err:
+        logger.warn("Failed to check the releases: {}".format(err))
+        return None, {}
+    finally:
+        http_pool.close_all()
+
+    return changed, validators
@@ -20,6 +20,7 @@ from kano.utils.hardware import has_min_performance, RPI_3_SCORE
 from kano_init.utils import reconfigure_autostart_policy
 
 from kano_updater.progress import Phase
+from kano_updater.deb_cache import DebCache
 from kano_updater.os_version import OSVersion, get_target_version
 from kano_updater.utils import install, remove_user_files, update_failed, \
     purge, rclocal_executable, migrate_repository, get_users, run_for_every_user
@@ -81,7 +82,17 @@ class Scenarios(object):
         to_version = OSVersion.from_version_string(to_version)
         self._scenarios[(from_version, to_version)] = func
 
-    def run(self, progress):
+    def run(self, progress, completed=(), on_step=None):
+        """Run the scenarios from the old version up to the target one.
+
+        Args:
+            progress (Progress): Where to report the progress to
+            completed (list): Names of the steps done by an earlier,
+                interrupted run, which are skipped
+            on_step (function): Called with the name of each step once it is
+                done
+        """
+
         log = "Running the {}-update scripts...".format(self._type)
         logger.info(log)
 
@@ -92,13 +103,24 @@ class Scenarios(object):
             step_found = False
             for (from_version, to_version), func in self._scenarios.iteritems():
                 if current_version == from_version:
-                    msg = "Running {}-update from {} to {}.".format(
-                        self._type,
-                        from_version,
-                        to_version
+                    step = "{}-update {} to {}".format(
+                        self._type, from_version, to_version
                     )
-                    logger.info(msg)
-                    func(progress)
+
+                    if step in completed:
+                        logger.info("Skipping {}, done already".format(step))
+                    else:
+                        msg = "Running {}-update from {} to {}.".format(
+                            self._type,
+                            from_version,
+                            to_version
+                        )
+                        logger.info(msg)
+                        func(progress)
+
+                        if on_step:
+                            on_step(step)
+
                     current_version = to_version
                     step_found = True
                     break
@@ -994,10 +1016,12 @@ class PostUpdate(Scenarios):
             run_cmd_log('apt-get autoremove -y')
 
             for app in new_apps:
+                mb_required = app['disk_req'] + 250  # MB buffer
+
                 run_cmd_log('apt-get clean')
+                DebCache().prune(reserved=mb_required)
 
                 mb_free = get_free_space()
-                mb_required = app['disk_req'] + 250  # MB buffer
 
                 if mb_free > mb_required:
                     progress.start(app['kw_app'])
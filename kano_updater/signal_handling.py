@@ -6,6 +6,10 @@
 # Module to handle signals
 #
 
+import os
+import errno
+import fcntl
+import select
 import signal
 
 class SignalPoll(object):
@@ -14,7 +18,7 @@ class SignalPoll(object):
     def __init__(self, sig_num):
         self.sig_num = sig_num
         self.signalled = False
-        signal.signal(self.sig_num, self._handle)
+        self._prev_handler = signal.signal(self.sig_num, self._handle)
 
     def _handle(self, sig_num, stack):
         if sig_num == self.sig_num:
@@ -24,3 +28,53 @@ class SignalPoll(object):
         res = self.signalled
         self.signalled = False
         return res
+
+    def restore(self):
+        signal.signal(self.sig_num, self._prev_handler)
+
+
+class SignalWakeup(object):
+    # Wakes up a wait whenever one of the signals with a Python handler, such
+    # as the SignalPoll ones, is received. The signal module writes a byte to
+    # a pipe for each of them, which is what the wait selects on.
+    # Only usable from the main thread.
+
+    def __init__(self):
+        self._read_fd, self._write_fd = os.pipe()
+        for fd in (self._read_fd, self._write_fd):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+        self._prev_fd = signal.set_wakeup_fd(self._write_fd)
+
+    def wait(self, timeout):
+        """
+        Blocks until a signal is received or the timeout (in seconds) expires
+
+        Returns:
+            True if woken up by a signal
+        """
+        try:
+            readable = select.select([self._read_fd], [], [], max(timeout, 0))[0]
+        except select.error as err:
+            if err.args[0] != errno.EINTR:
+                raise
+            readable = True
+
+        if not readable:
+            return False
+
+        # Drain the pipe, the SignalPoll objects tell which signals came in
+        try:
+            while os.read(self._read_fd, 512):
+                pass
+        except OSError as err:
+            if err.errno != errno.EAGAIN:
+                raise
+
+        return True
+
+    def close(self):
+        signal.set_wakeup_fd(self._prev_fd)
+        os.close(self._read_fd)
+        os.close(self._write_fd)
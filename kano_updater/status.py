@@ -8,6 +8,7 @@
 
 import os
 import json
+from contextlib import contextmanager
 
 from kano.utils import ensure_dir
 from kano.logging import logger
@@ -15,6 +16,7 @@ from kano.logging import logger
 from kano_updater.recovery import enable_system_recovery_flow, \
     cancel_system_recovery_flow
 from kano_updater.paths import STATUS_FILE_PATH
+from kano_updater.status_channel import make_record, publish
 
 
 class UpdaterStatusError(Exception):
@@ -63,6 +65,12 @@ class UpdaterStatus(object):
         self._last_check = 0
         self._updatable_independent_packages = []
         self._last_check_urgent = 0
+        self._last_check_bytes = 0
+        self._release_validators = {}
+        self._dpkg_status_mtime = 0
+        self._completed_batches = 0
+        self._pending_batch = []
+        self._checkpoints = []
         self._last_update = 0
         self._first_boot_countdown = 0
         self._is_urgent = False
@@ -70,6 +78,12 @@ class UpdaterStatus(object):
         self._notifications_muted = False
         self._is_shutdown = False
 
+        # Whether the recovery flow is configured, unknown until the first save
+        self._recovery_flow = None
+        self._transaction_depth = 0
+        self._save_pending = False
+        self._published_record = None
+
         ensure_dir(os.path.dirname(self._status_file))
         if not os.path.exists(self._status_file):
             self.save()
@@ -102,6 +116,12 @@ class UpdaterStatus(object):
             self._last_check = data['last_check']
             self._updatable_independent_packages = data.get('ind_pkg', [])
             self._last_check_urgent = data['last_check_urgent']
+            self._last_check_bytes = data.get('last_check_bytes', 0)
+            self._release_validators = data.get('release_validators', {})
+            self._dpkg_status_mtime = data.get('dpkg_status_mtime', 0)
+            self._completed_batches = data.get('completed_batches', 0)
+            self._pending_batch = data.get('pending_batch', [])
+            self._checkpoints = data.get('checkpoints', [])
             self._first_boot_countdown = data['first_boot_countdown']
             self._is_urgent = (data['is_urgent'] == 1)
             self._is_scheduled = (data['is_scheduled'] == 1)
@@ -111,6 +131,12 @@ class UpdaterStatus(object):
                 self._notifications_muted = (data['notifications_muted'] == 1)
 
     def save(self):
+        if self._transaction_depth:
+            self._save_pending = True
+            return
+
+        self._save_pending = False
+
         logger.debug("Saving status instance")
         data = {
             'state': self._state,
@@ -118,6 +144,12 @@ class UpdaterStatus(object):
             'last_check': self._last_check,
             'ind_pkg': self._updatable_independent_packages,
             'last_check_urgent': self._last_check_urgent,
+            'last_check_bytes': self._last_check_bytes,
+            'release_validators': self._release_validators,
+            'dpkg_status_mtime': self._dpkg_status_mtime,
+            'completed_batches': self._completed_batches,
+            'pending_batch': self._pending_batch,
+            'checkpoints': self._checkpoints,
             'first_boot_countdown': self._first_boot_countdown,
             'is_urgent': 1 if self._is_urgent else 0,
             'is_scheduled': 1 if self._is_scheduled else 0,
@@ -125,17 +157,84 @@ class UpdaterStatus(object):
             'notifications_muted': 1 if self._notifications_muted else 0
         }
 
-        with open(self._status_file, 'w') as status_file:
-            json.dump(data, status_file, indent=4)
+        recovery_needed = self.is_recovery_needed()
+
+        # Make sure the system recovers from a power failure before any
+        # installation is recorded, see below.
+        if recovery_needed and self._recovery_flow is not True:
+            enable_system_recovery_flow()
+            self._recovery_flow = True
+
+        self._write(data)
 
         # When installing updates, configure the recovery stategy for the next
         # boot in case of power failure. This sets a different splash screen
         # during bootup and configures the system to autologin as the user in
         # order to start the Updater immediately. See kano-ui-autostart.
-        if self.is_recovery_needed():
-            enable_system_recovery_flow()
-        else:
+        # It only changes when the need for recovery does.
+        if not recovery_needed and self._recovery_flow is not False:
             cancel_system_recovery_flow()
+            self._recovery_flow = False
+
+        # Tell the panel plugin and others about the change, see
+        # `kano_updater.status_channel`
+        record = make_record(self)
+        if record != self._published_record:
+            publish(record)
+            self._published_record = record
+
+    def _write(self, data):
+        '''
+        Replaces the status file atomically, so readers never see it half
+        written and a power failure leaves either the old or the new status.
+        '''
+
+        tmp_path = '{}.tmp-{}'.format(self._status_file, os.getpid())
+
+        try:
+            with open(tmp_path, 'w') as status_file:
+                json.dump(data, status_file, indent=4)
+                status_file.flush()
+                os.fsync(status_file.fileno())
+
+            os.rename(tmp_path, self._status_file)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        # Make the rename itself durable
+        try:
+            dir_fd = os.open(os.path.dirname(self._status_file), os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        except OSError:
+            pass
+
+    @contextmanager
+    def transaction(self):
+        """Coalesce the saves made within the context into a single write.
+
+        The status is written once when the outermost transaction ends, if
+        anything was saved within it, e.g.
+
+            with status.transaction():
+                status.state = UpdaterStatus.UPDATES_INSTALLED
+                status.save()
+                ...
+                status.save()
+        """
+
+        self._transaction_depth += 1
+        try:
+            yield self
+        finally:
+            self._transaction_depth -= 1
+
+            if not self._transaction_depth and self._save_pending:
+                self.save()
 
     def is_recovery_needed(self):
         """Check if the recovery flow should start.
@@ -250,6 +349,114 @@ class UpdaterStatus(object):
                      .format(value))
         self._last_check_urgent = value
 
+    # -- last_check_bytes - bytes of package indexes fetched by the last check
+    @property
+    def last_check_bytes(self):
+        return self._last_check_bytes
+
+    @last_check_bytes.setter
+    def last_check_bytes(self, value):
+        if not isinstance(value, (int, long)):
+            msg = "'last_check_bytes' must be a number of bytes (int)."
+            raise UpdaterStatusError(msg)
+
+        logger.info("Setting the status' last_check_bytes to: {}"
+                    .format(value))
+        self._last_check_bytes = value
+
+    # -- release_validators - ETag/Last-Modified of the repositories' InRelease
+    #    files as seen by the last complete check, keyed by their URLs
+    @property
+    def release_validators(self):
+        return self._release_validators
+
+    @release_validators.setter
+    def release_validators(self, value):
+        if not isinstance(value, dict):
+            msg = "'release_validators' must be a dict of validators per URL."
+            raise UpdaterStatusError(msg)
+
+        logger.info("Setting the status' release_validators to: {}"
+                    .format(value))
+        self._release_validators = value
+
+    # -- dpkg_status_mtime - state of the installed packages at the last check
+    @property
+    def dpkg_status_mtime(self):
+        return self._dpkg_status_mtime
+
+    @dpkg_status_mtime.setter
+    def dpkg_status_mtime(self, value):
+        if not isinstance(value, int):
+            msg = "'dpkg_status_mtime' must be an Unix timestamp (int)."
+            raise UpdaterStatusError(msg)
+
+        logger.info("Setting the status' dpkg_status_mtime to: {}"
+                    .format(value))
+        self._dpkg_status_mtime = value
+
+    # -- completed_batches - number of batches of the upgrade committed so far
+    @property
+    def completed_batches(self):
+        return self._completed_batches
+
+    @completed_batches.setter
+    def completed_batches(self, value):
+        if not isinstance(value, int):
+            msg = "'completed_batches' must be a number of batches (int)."
+            raise UpdaterStatusError(msg)
+
+        logger.info("Setting the status' completed_batches to: {}"
+                    .format(value))
+        self._completed_batches = value
+
+    # -- pending_batch - packages of the batch being committed, if any
+    @property
+    def pending_batch(self):
+        return self._pending_batch
+
+    @pending_batch.setter
+    def pending_batch(self, value):
+        if not isinstance(value, list):
+            msg = "'pending_batch' must be a list of package names."
+            raise UpdaterStatusError(msg)
+
+        logger.info("Setting the status' pending_batch to: {}"
+                    .format(value))
+        self._pending_batch = value
+
+    # -- checkpoints - the steps of the installation completed so far, for
+    #    resuming it after an interruption
+    @property
+    def checkpoints(self):
+        return self._checkpoints
+
+    @checkpoints.setter
+    def checkpoints(self, value):
+        if not isinstance(value, list):
+            msg = "'checkpoints' must be a list of step names."
+            raise UpdaterStatusError(msg)
+
+        logger.info("Setting the status' checkpoints to: {}".format(value))
+        self._checkpoints = value
+
+    def is_checkpoint_reached(self, step):
+        return step in self._checkpoints
+
+    def reach_checkpoint(self, step):
+        """Record a step of the installation as completed.
+
+        The status is saved straight away so the step isn't done again when
+        resuming the installation after an interruption.
+        """
+
+        if step in self._checkpoints:
+            return
+
+        logger.info("Reached the checkpoint: {}".format(step))
+        self._checkpoints.append(step)
+        self.save()
+
     # -- first_boot_countdown - used to stop updates for a set amount of time
     @property
     def first_boot_countdown(self):
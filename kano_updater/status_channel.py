@@ -0,0 +1,241 @@
+# status_channel.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Notifying the other processes of changes to the updater status.
+#
+# Every subscriber binds a datagram socket in the abstract namespace under
+# SOCKET_PREFIX. On each change, the status is sent to all of them as a single
+# line record and written to STATUS_RECORD_PATH for whoever only needs a
+# snapshot. The record reads:
+#
+#   <version> <state> <is_scheduled> <is_urgent> <notifications_muted> \
+#       <last_check> <last_check_urgent> <last_update>
+#
+# The status file stays the complete, authoritative source.
+
+
+import os
+import errno
+import select
+import socket
+
+from kano.logging import logger
+
+from kano_updater.paths import STATUS_RECORD_PATH
+
+
+RECORD_VERSION = '1'
+RECORD_FIELDS = [
+    'state', 'is_scheduled', 'is_urgent', 'notifications_muted',
+    'last_check', 'last_check_urgent', 'last_update'
+]
+SOCKET_PREFIX = 'kano-updater-status'
+PROC_NET_UNIX = '/proc/net/unix'
+MAX_RECORD_SIZE = 512  # bytes
+
+
+def make_record(status):
+    """Format the record of the status.
+
+    Args:
+        status (UpdaterStatus): The status to describe
+
+    Returns:
+        str: The record, terminated by a new line
+    """
+
+    values = [
+        status.state,
+        int(status.is_scheduled),
+        int(status.is_urgent),
+        int(status.notifications_muted),
+        status.last_check,
+        status.last_check_urgent,
+        status.last_update
+    ]
+
+    return ' '.join(str(value) for value in [RECORD_VERSION] + values) + '\n'
+
+
+def parse_record(record):
+    """Read a record back.
+
+    Returns:
+        dict: The fields of the record, None when it isn't a valid one
+    """
+
+    tokens = record.split()
+    if len(tokens) != len(RECORD_FIELDS) + 1 or tokens[0] != RECORD_VERSION:
+        return None
+
+    try:
+        values = [tokens[1]] + [int(token) for token in tokens[2:]]
+    except ValueError:
+        return None
+
+    return dict(zip(RECORD_FIELDS, values))
+
+
+def find_subscribers(proc_net_unix=PROC_NET_UNIX):
+    """List the addresses of the subscribers' sockets.
+
+    Returns:
+        list: Abstract socket addresses
+    """
+
+    subscribers = []
+
+    try:
+        with open(proc_net_unix, 'r') as sockets_file:
+            lines = sockets_file.readlines()
+    except IOError:
+        return subscribers
+
+    for line in lines[1:]:
+        tokens = line.split()
+        if len(tokens) < 8:
+            continue
+
+        path = tokens[7]
+        if path.startswith('@' + SOCKET_PREFIX):
+            address = '\0' + path[1:]
+            if address not in subscribers:
+                subscribers.append(address)
+
+    return subscribers
+
+
+def _write_record(record, path):
+    '''
+    Replaces the record as durably as the status file, which it must not
+    fall behind of after a power failure.
+    '''
+
+    tmp_path = '{}.tmp-{}'.format(path, os.getpid())
+
+    try:
+        with open(tmp_path, 'w') as record_file:
+            record_file.write(record)
+            record_file.flush()
+            os.fsync(record_file.fileno())
+        os.rename(tmp_path, path)
+    except (IOError, OSError) as err:
+        logger.warn("Failed to write the status record: {}".format(err))
+        return
+
+    # Make the rename itself durable
+    try:
+        dir_fd = os.open(os.path.dirname(path) or '.', os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except OSError:
+        pass
+
+
+def publish(record, record_path=STATUS_RECORD_PATH,
+            proc_net_unix=PROC_NET_UNIX):
+    """Let the subscribers know the status changed.
+
+    Args:
+        record (str): The record made by :func:`make_record`
+        record_path (str): Where to keep the latest record
+        proc_net_unix (str): Where to look for the subscribers
+
+    Returns:
+        int: Number of subscribers notified
+    """
+
+    _write_record(record, record_path)
+
+    subscribers = find_subscribers(proc_net_unix)
+    if not subscribers:
+        return 0
+
+    notified = 0
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+
+    try:
+        sock.setblocking(False)
+
+        for address in subscribers:
+            try:
+                sock.sendto(record, address)
+                notified += 1
+            except socket.error as err:
+                # Gone already or not keeping up, they can read the record
+                if err.errno not in (
+                        errno.ECONNREFUSED, errno.ENOENT, errno.EAGAIN
+                    ):
+                    logger.warn("Failed to notify {}: {}".format(
+                        address[1:], err
+                    ))
+    finally:
+        sock.close()
+
+    return notified
+
+
+def read_record(record_path=STATUS_RECORD_PATH):
+    """Get the latest record.
+
+    Returns:
+        dict: The fields of the record, None when there is no valid one
+    """
+
+    try:
+        with open(record_path, 'r') as record_file:
+            return parse_record(record_file.read())
+    except IOError:
+        return None
+
+
+class Subscriber(object):
+    '''
+    Receives the status records as they are published.
+
+    :param name: Distinguishes the sockets of a process, the PID by default
+    '''
+
+    def __init__(self, name=None):
+        if name is None:
+            name = str(os.getpid())
+
+        self._address = '\0{}.{}'.format(SOCKET_PREFIX, name)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+
+        try:
+            self._sock.bind(self._address)
+        except socket.error:
+            self._sock.close()
+            raise
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    def receive(self, timeout=None):
+        """Wait for the next record.
+
+        Args:
+            timeout (float): Seconds to wait for, forever when None
+
+        Returns:
+            dict: The fields of the record, None on timeout
+        """
+
+        while True:
+            readable, dummy_w, dummy_x = select.select(
+                [self._sock], [], [], timeout
+            )
+            if not readable:
+                return None
+
+            record = parse_record(self._sock.recv(MAX_RECORD_SIZE))
+            if record:
+                return record
+
+    def close(self):
+        self._sock.close()
@@ -17,6 +17,7 @@ from kano_updater.utils import kill_apps, kill_flappy_judoka, bring_flappy_judok
 from kano_updater.ui.paths import CSS_PATH
 from kano_updater.commands.install import install
 from kano_updater.ui.progress import GtkProgress
+from kano_updater.phase_history import PhaseHistory
 from kano_updater.ui.views.install import Install
 from kano_updater.ui.views.finish import Finish
 
@@ -57,6 +58,7 @@ class InstallWindow(Gtk.Window):
 
     def _start_install(self):
         progress = GtkProgress(self)
+        progress.use_history(PhaseHistory())
 
         self._timer_tag = GLib.timeout_add_seconds(60, self._is_install_running)
 
@@ -122,8 +124,9 @@ class InstallWindow(Gtk.Window):
     def close_window(self, widget=None, event=None):
         Gtk.main_quit()
 
-    def update_progress(self, percent, msg, phase_name, sub_msg=''):
-        self._install_screen.update_progress(percent, phase_name, msg, sub_msg)
+    def update_progress(self, percent, msg, phase_name, sub_msg='', eta=None):
+        self._install_screen.update_progress(percent, phase_name, msg, sub_msg,
+                                             eta)
 
         # FIXME Progress to next with the done
         if percent == 100:
@@ -8,7 +8,7 @@
 
 from gi.repository import GLib, Gtk
 
-from kano_updater.progress import Progress
+from kano_updater.progress import Progress, EVENT_START, EVENT_STEP
 from kano_updater.ui.main import relaunch_required
 from kano_updater.utils import kill_flappy_judoka
 
@@ -19,9 +19,19 @@ class GtkProgress(Progress):
         super(GtkProgress, self).__init__()
         self._window = window
 
+        # Off the updater thread, so the UI never holds the install back
+        self.subscribe(self._update_window)
+
     def _change(self, phase, msg):
-        GLib.idle_add(self._window.update_progress, phase.global_percent,
-                      phase.get_main_phase().label, phase.get_main_phase().name, msg)
+        pass
+
+    def _update_window(self, event):
+        if event.kind not in (EVENT_START, EVENT_STEP):
+            return
+
+        GLib.idle_add(self._window.update_progress, event.global_percent,
+                      event.main_label, event.main_phase, event.msg,
+                      event.eta)
 
     def _error(self, phase, msg):
         err_msg = "Error {} - {}".format(phase.label.lower(), msg)
@@ -41,7 +41,7 @@ class Install(Gtk.Overlay):
         self.add_overlay(self._create_warning_icon())
         self.add_overlay(self._create_warning_label())
 
-    def update_progress(self, percent, phase_name, msg, sub_msg=''):
+    def update_progress(self, percent, phase_name, msg, sub_msg='', eta=None):
         # Enabling flappy-judoka launch only during these phases (when a reboot is iminent)
         if phase_name in self.game_allowed_states and self.is_at_least_rpi2:
             self.get_toplevel().connect('key-release-event', self._launch_game)
@@ -49,7 +49,15 @@ class Install(Gtk.Overlay):
 
         self.progress_subphase_label.set_text(sub_msg + '...')
 
-        self.percent_completed_label.set_text(_("{}% Complete").format(percent))
+        if eta is None:
+            self.percent_completed_label.set_text(
+                _("{}% Complete").format(percent)
+            )
+        else:
+            minutes = max(1, (eta + 59) / 60)
+            self.percent_completed_label.set_text(
+                _("{}% Complete, about {} min left").format(percent, minutes)
+            )
 
     def hide_game_play_label(self):
         """ Hide the label with instructions to launch the game """
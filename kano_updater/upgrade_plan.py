@@ -0,0 +1,319 @@
+# upgrade_plan.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Snapshot of the changes the resolver decided on for an upgrade.
+#
+# The plan of a download is saved so the installation can go ahead with it
+# later on, for as long as the package lists it was solved from don't change.
+
+
+import os
+import json
+from collections import namedtuple
+
+from kano.logging import logger
+
+from kano_updater.archive_fetcher import ArchiveItem
+
+
+PLAN_FORMAT = 1
+MAX_BATCH_SIZE = 40  # packages
+
+
+# A single change to the system:
+#   name: Name of the package
+#   version: The version which is going to be installed, None on removal
+#   old_version: The installed version, None when newly installed
+#   is_delete: Whether the package is being removed
+#   is_auto: Whether the package is only installed as a dependency
+#   archive: A PlannedArchive to fetch the version ahead of apt, None when
+#            that isn't possible
+PlannedChange = namedtuple(
+    'PlannedChange',
+    ['name', 'version', 'old_version', 'is_delete', 'is_auto', 'archive']
+)
+
+# The arguments of the `kano_updater.archive_fetcher.ArchiveItem` of a change
+PlannedArchive = namedtuple(
+    'PlannedArchive',
+    ['name', 'uris', 'filename', 'size', 'sha256', 'delta_uris', 'old_sha256']
+)
+
+
+class UpgradePlan(object):
+    '''
+    The changes marked for an upgrade with a given priority, as solved by the
+    resolver for one generation of the apt cache. It can't be modified, so
+    it's safe to hand out to every stage of the update.
+    '''
+
+    __slots__ = (
+        '_generation', '_priority', '_changes', '_required_download',
+        '_required_space', '_batches'
+    )
+
+    def __init__(self, generation, priority, changes, required_download,
+                 required_space, batches=None):
+        self._generation = generation
+        self._priority = priority
+        self._changes = tuple(changes)
+        self._required_download = required_download
+        self._required_space = required_space
+
+        if batches is None:
+            batches = [[change.name for change in self._changes]]
+        self._batches = tuple(tuple(batch) for batch in batches if batch)
+
+    def __repr__(self):
+        return 'UpgradePlan(generation={}, priority={}, changes={})'.format(
+            self._generation, self._priority.priority, len(self._changes)
+        )
+
+    def __len__(self):
+        return len(self._changes)
+
+    @property
+    def generation(self):
+        return self._generation
+
+    @property
+    def priority(self):
+        return self._priority
+
+    @property
+    def changes(self):
+        return self._changes
+
+    @property
+    def batches(self):
+        '''
+        Names of the packages of each batch, in the order to commit them
+        '''
+
+        return self._batches
+
+    @property
+    def required_download(self):
+        '''
+        Bytes to download
+        '''
+
+        return self._required_download
+
+    @property
+    def required_space(self):
+        '''
+        Bytes taken by the download and the unpacked packages
+        '''
+
+        return self._required_download + self._required_space
+
+    @property
+    def is_fetchable(self):
+        '''
+        Whether all the archives are known ahead of apt
+        '''
+
+        return all(
+            change.is_delete or change.archive for change in self._changes
+        )
+
+    def get_archive_items(self):
+        """Items for fetching the archives of the plan.
+
+        Returns:
+            list: New :class:`kano_updater.archive_fetcher.ArchiveItem`
+            objects, which the caller is free to modify
+        """
+
+        return [
+            ArchiveItem(**change.archive._asdict())
+            for change in self._changes
+            if change.archive and not change.is_delete
+        ]
+
+    def get_batch_changes(self):
+        """The changes of each batch.
+
+        Returns:
+            list: A list of PlannedChange objects for every batch
+        """
+
+        changes = {change.name: change for change in self._changes}
+
+        return [
+            [changes[name] for name in batch]
+            for batch in self._batches
+        ]
+
+    def get_packages(self):
+        """The versions involved in each change.
+
+        Returns:
+            dict: The old and new version of each package, keyed by name
+        """
+
+        return {
+            change.name: [
+                version for version in (change.old_version, change.version)
+                if version
+            ]
+            for change in self._changes
+        }
+
+
+def split_batches(names, relations, max_size=MAX_BATCH_SIZE):
+    """Split the changes into batches which can be committed on their own.
+
+    Packages related to each other (depending on, breaking or conflicting
+    with one another) always end up in the same batch, so every batch leaves
+    the system in a consistent state. Unrelated groups are packed together up
+    to `max_size` packages to keep the number of commits down.
+
+    Args:
+        names (list): Names of the changed packages, in order
+        relations (dict): The names of the changed packages each package is
+            related to
+        max_size (int): Number of packages to aim for in a batch, groups
+            which are larger stay whole
+
+    Returns:
+        list: Lists of package names
+    """
+
+    parents = {name: name for name in names}
+
+    def find(name):
+        while parents[name] != name:
+            parents[name] = parents[parents[name]]
+            name = parents[name]
+
+        return name
+
+    for name in names:
+        for related in relations.get(name, ()):
+            if related in parents:
+                parents[find(related)] = find(name)
+
+    groups = {}
+    order = []
+    for name in names:
+        root = find(name)
+        if root not in groups:
+            groups[root] = []
+            order.append(root)
+        groups[root].append(name)
+
+    batches = []
+    batch = []
+    for root in order:
+        group = groups[root]
+        if batch and len(batch) + len(group) > max_size:
+            batches.append(batch)
+            batch = []
+        batch.extend(group)
+
+    if batch:
+        batches.append(batch)
+
+    return batches
+
+
+def save_plan(plan, lists_fingerprint, path):
+    """Write the plan to a file.
+
+    Args:
+        plan (UpgradePlan): The plan to save
+        lists_fingerprint (str): Digest of the package lists the plan was
+            solved from
+        path (str): Where to save the plan
+    """
+
+    data = {
+        'format': PLAN_FORMAT,
+        'lists_fingerprint': lists_fingerprint,
+        'priority': plan.priority.priority,
+        'os_match_required': plan.priority.os_match_required,
+        'required_download': plan.required_download,
+        'required_space': plan.required_space - plan.required_download,
+        'batches': plan.batches,
+        'changes': [
+            list(change[:-1]) + [
+                list(change.archive) if change.archive else None
+            ]
+            for change in plan.changes
+        ]
+    }
+
+    tmp_path = '{}.tmp-{}'.format(path, os.getpid())
+
+    try:
+        with open(tmp_path, 'w') as plan_file:
+            json.dump(data, plan_file, separators=(',', ':'))
+        os.rename(tmp_path, path)
+    except (IOError, OSError) as err:
+        logger.warn("Failed to save the upgrade plan: {}".format(err))
+
+
+def load_plan(priority, lists_fingerprint, generation, path):
+    """Read a saved plan, provided it's still valid.
+
+    Args:
+        priority (Priority): The priority the plan must have been solved for
+        lists_fingerprint (str): Digest of the current package lists
+        generation (int): The cache generation to attach the plan to
+        path (str): Where the plan was saved
+
+    Returns:
+        UpgradePlan: The plan or None if there is no valid one
+    """
+
+    try:
+        with open(path, 'r') as plan_file:
+            data = json.load(plan_file)
+    except (IOError, OSError, ValueError):
+        return None
+
+    try:
+        if (
+                data['format'] != PLAN_FORMAT or
+                not lists_fingerprint or
+                data['lists_fingerprint'] != lists_fingerprint or
+                data['priority'] != priority.priority or
+                data['os_match_required'] != priority.os_match_required
+            ):
+            logger.debug("The saved upgrade plan is out of date")
+            return None
+
+        changes = []
+        for change in data['changes']:
+            archive = change[-1]
+            if archive:
+                archive[1] = tuple(archive[1])
+                archive[5] = tuple(archive[5])
+                archive = PlannedArchive(*archive)
+
+            changes.append(PlannedChange(*(change[:-1] + [archive])))
+
+        batched = set(name for batch in data['batches'] for name in batch)
+        if batched != set(change.name for change in changes):
+            logger.warn("The batches of the saved upgrade plan don't match")
+            return None
+
+        return UpgradePlan(
+            generation, priority, changes,
+            data['required_download'], data['required_space'],
+            data['batches']
+        )
+    except (KeyError, TypeError, IndexError) as err:
+        logger.warn("The saved upgrade plan is corrupted: {}".format(err))
+        return None
+
+
+def remove_plan(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -13,6 +13,10 @@ import shutil
 import pwd
 import grp
 import signal
+import socket
+import httplib
+import threading
+import time
 import traceback
 
 from kano.logging import logger
@@ -37,16 +41,24 @@ except ImportError:
 
 import kano_updater.apt_wrapper
 import kano_updater.progress
+import kano_updater.http_pool as http_pool
+from kano_updater.paths import KANO_SOURCES_LIST
+from kano_updater.release_check import get_release_urls
 
 
 UPDATER_CACHE_DIR = "/var/cache/kano-updater/"
 STATUS_FILE = UPDATER_CACHE_DIR + "status"
 
 REPO_SERVER = 'repo.kano.me'
+SERVER_PROBE_TIMEOUT = 5  # seconds
+SERVER_PROBE_TTL = 60  # seconds
 PID_FILE = '/var/run/kano-updater.pid'
 
 TRACKING_UUID_KEY = 'kano-updater'
 
+_server_probes = {}
+_server_probes_lock = threading.Lock()
+
 # Pidfile handling taken from https://pypi.python.org/pypi/pid
 # By trbs and Naveen Nathan (Apache licence)
 # but we don't want to install a pip
@@ -130,21 +142,83 @@ def run_for_every_user(cmd):
         run_cmd_log("sudo su -c '{cmd}' - {user}".format(cmd=cmd, user=user))
 
 
-def is_server_available():
-    """ Pings REPO_SERVER to diagnose packet loss
-    and server availability.
+def _get_probe_url():
+    urls = get_release_urls(KANO_SOURCES_LIST)
+    if urls:
+        return urls[0]
+
+    return 'http://{}/'.format(REPO_SERVER)
+
+
+def is_server_available(url=None):
+    """ Checks whether the apt repository answers over HTTP.
+
+    The result is reused for SERVER_PROBE_TTL seconds. The connection is
+    closed afterwards: the index fetch which follows is apt's own and can't
+    take it over, and it would only go stale in the pool before the archive
+    downloads.
 
     Args:
-        REPO_SERVER: is the pre-set address
-        count: Number of times to ping the server
+        url (str): What to probe, the InRelease of the first Kano repository
+            by default
 
     Returns: A boolean, True for server availability.
     """
-    import ping
 
-    lost_packet_percent = ping.quiet_ping(REPO_SERVER, timeout=3, count=5)[0]
+    if not url:
+        url = _get_probe_url()
+
+    with _server_probes_lock:
+        last_probe = _server_probes.get(url)
+        if last_probe and time.time() - last_probe[0] < SERVER_PROBE_TTL:
+            return last_probe[1]
+
+    try:
+        conn, response = http_pool.request(
+            url, method='HEAD', timeout=SERVER_PROBE_TIMEOUT
+        )
+        response.read()
+        http_pool.discard(conn)
+
+        # Anything but a server error means the repository is up
+        available = response.status < 500
+        if not available:
+            logger.warn("{} returned {} {}".format(
+                url, response.status, response.reason
+            ))
+    except (socket.error, httplib.HTTPException) as err:
+        logger.warn("Could not reach {}: {}".format(url, err))
+        available = False
+
+    with _server_probes_lock:
+        _server_probes[url] = (time.time(), available)
+
+    return available
+
+
+def check_connectivity():
+    """ Checks for internet and whether the repository is reachable at the
+    same time.
+
+    Returns: A tuple of booleans, whether there is internet and whether the
+    server is available.
+    """
+
+    import kano.network
+
+    result = {}
+
+    def probe_server():
+        result['server'] = is_server_available()
+
+    thread = threading.Thread(target=probe_server)
+    thread.daemon = True
+    thread.start()
+
+    internet = kano.network.is_internet()
+    thread.join()
 
-    return lost_packet_percent < 50
+    return internet, result.get('server', False)
 
 
 def kill_apps():
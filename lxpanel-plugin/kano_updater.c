@@ -13,9 +13,11 @@
 #include <glib/gi18n-lib.h>
 #include <gdk-pixbuf/gdk-pixbuf.h>
 #include <gio/gio.h>
+#include <glib/gstdio.h>
 
 #include <lxpanel/plugin.h>
 
+#include <stddef.h>
 #include <stdio.h>
 #include <stdlib.h>
 #include <ctype.h>
@@ -24,7 +26,11 @@
 
 #include <sys/types.h>
 #include <sys/stat.h>
+#include <sys/socket.h>
+#include <sys/un.h>
 #include <fcntl.h>
+#include <unistd.h>
+#include <string.h>
 
 #include <kdesk-hourglass.h>
 
@@ -42,6 +48,12 @@
 
 #define UPDATE_STATUS_FILE "/var/cache/kano-updater/status.json"
 
+/* Status changes are pushed by the updater, see kano_updater/status_channel.py */
+#define STATUS_RECORD_FILE "/var/cache/kano-updater/status.record"
+#define STATUS_SOCKET_PREFIX "kano-updater-status"
+#define STATUS_RECORD_VERSION 1
+#define MAX_RECORD_LENGTH 512
+
 #define CHECK_FOR_UPDATES_CMD "sudo /usr/bin/kano-updater check --gui"
 #define CHECK_FOR_UPDATES_BG_CMD "sudo /usr/bin/kano-updater check"
 #define CHECK_FOR_URGENT_UPDATES_CMD "sudo /usr/bin/kano-updater check --gui --urgent"
@@ -59,7 +71,8 @@
 
 #define FIFO_FILENAME ".kano-notifications.fifo"
 
-#define MAX_STATE_LENGTH 20
+/* Fits the longest state of kano_updater/status.py with its terminator */
+#define MAX_STATE_LENGTH 32
 #define IS_IN_STATE(plugin_data, s) \
     (g_strcmp0(plugin_data->state, s) == 0)
 
@@ -112,6 +125,10 @@ typedef struct {
     GFile *status_file;
     GFileMonitor *monitor;
 
+    int status_socket;
+    GIOChannel *status_channel;
+    guint status_watch;
+
     gchar *state;
     gchar *prev_state;
     int last_update;
@@ -130,6 +147,12 @@ static gboolean show_menu(GtkWidget *, GdkEventButton *,
               kano_updater_plugin_t *);
 static void selection_done(GtkWidget *);
 static gboolean update_status(kano_updater_plugin_t *);
+static gboolean read_status(kano_updater_plugin_t *);
+static gboolean is_status_record_current(void);
+static gboolean read_status_record(kano_updater_plugin_t *);
+static gboolean parse_status_record(kano_updater_plugin_t *, const char *);
+static void show_status(kano_updater_plugin_t *);
+static gboolean subscribe_status(kano_updater_plugin_t *);
 static gboolean check_for_updates(kano_updater_plugin_t *);
 
 static void plugin_destructor(gpointer user_data);
@@ -138,6 +161,8 @@ static void menu_pos(GtkMenu *menu, gint *x, gint *y, gboolean *push_in,
 
 void file_monitor_cb(GFileMonitor *monitor, GFile *first, GFile *second,
              GFileMonitorEvent event, gpointer user_data);
+static gboolean status_socket_cb(GIOChannel *source, GIOCondition condition,
+                 gpointer user_data);
 
 static GtkWidget *plugin_constructor(LXPanel *panel, config_setting_t *settings)
 {
@@ -152,6 +177,7 @@ static GtkWidget *plugin_constructor(LXPanel *panel, config_setting_t *settings)
     plugin_data->last_check = 0;
     plugin_data->last_check_urgent = 0;
     plugin_data->notifications_muted = FALSE;
+    plugin_data->status_socket = -1;
 
     GtkWidget *icon = gtk_image_new_from_file(NO_UPDATES_ICON_FILE);
     plugin_data->icon = icon;
@@ -189,15 +215,26 @@ static GtkWidget *plugin_constructor(LXPanel *panel, config_setting_t *settings)
     /* show our widget */
     gtk_widget_show_all(pwid);
 
-    /* Start watching the pipe for input. */
-    plugin_data->status_file = g_file_new_for_path(UPDATE_STATUS_FILE);
-    g_assert(plugin_data->status_file != NULL);
+    /*
+     * Have the updater tell us about the status changes, only watch the
+     * status file when that isn't possible.
+     */
+    if (!subscribe_status(plugin_data)) {
+        plugin_data->status_file = g_file_new_for_path(UPDATE_STATUS_FILE);
+        g_assert(plugin_data->status_file != NULL);
+
+        plugin_data->monitor = g_file_monitor(plugin_data->status_file,
+                              G_FILE_MONITOR_NONE, NULL, NULL);
+        g_assert(plugin_data->monitor != NULL);
+        g_signal_connect(plugin_data->monitor, "changed",
+                 G_CALLBACK(file_monitor_cb), (gpointer) plugin_data);
+    }
 
-    plugin_data->monitor = g_file_monitor(plugin_data->status_file,
-                          G_FILE_MONITOR_NONE, NULL, NULL);
-    g_assert(plugin_data->monitor != NULL);
-    g_signal_connect(plugin_data->monitor, "changed",
-             G_CALLBACK(file_monitor_cb), (gpointer) plugin_data);
+    /* Start from the current status, the next one is only sent on change */
+    if (read_status_record(plugin_data))
+        show_status(plugin_data);
+    else
+        update_status(plugin_data);
 
     return pwid;
 }
@@ -209,7 +246,18 @@ static void plugin_destructor(gpointer user_data)
     g_free(plugin_data->state);
     g_free(plugin_data->prev_state);
 
-    g_object_unref(plugin_data->monitor);
+    if (plugin_data->monitor)
+        g_object_unref(plugin_data->monitor);
+    if (plugin_data->status_file)
+        g_object_unref(plugin_data->status_file);
+
+    /* Stop listening to the updater. */
+    if (plugin_data->status_watch)
+        g_source_remove(plugin_data->status_watch);
+    if (plugin_data->status_channel)
+        g_io_channel_unref(plugin_data->status_channel);
+    if (plugin_data->status_socket >= 0)
+        close(plugin_data->status_socket);
 
     /* Disconnect the timer. */
     g_source_remove(plugin_data->timer);
@@ -224,6 +272,58 @@ void file_monitor_cb(GFileMonitor *monitor, GFile *first, GFile *second,
     update_status(plugin_data);
 }
 
+static gboolean status_socket_cb(GIOChannel *source, GIOCondition condition,
+                 gpointer user_data)
+{
+    kano_updater_plugin_t *plugin_data = (kano_updater_plugin_t *)user_data;
+    char record[MAX_RECORD_LENGTH];
+    ssize_t length;
+
+    length = recv(plugin_data->status_socket, record, sizeof(record) - 1,
+              MSG_DONTWAIT);
+    if (length <= 0)
+        return TRUE;
+
+    record[length] = '\0';
+    if (parse_status_record(plugin_data, record))
+        show_status(plugin_data);
+
+    return TRUE;
+}
+
+static gboolean subscribe_status(kano_updater_plugin_t *plugin_data)
+{
+    struct sockaddr_un addr;
+    socklen_t addr_len;
+    int name_len;
+    int sock;
+
+    sock = socket(AF_UNIX, SOCK_DGRAM, 0);
+    if (sock < 0)
+        return FALSE;
+
+    /* The updater finds us by the name in the abstract namespace */
+    memset(&addr, 0, sizeof(addr));
+    addr.sun_family = AF_UNIX;
+    name_len = g_snprintf(addr.sun_path + 1, sizeof(addr.sun_path) - 1,
+                  "%s.%d", STATUS_SOCKET_PREFIX, getpid());
+    addr_len = offsetof(struct sockaddr_un, sun_path) + 1 + name_len;
+
+    if (bind(sock, (struct sockaddr *) &addr, addr_len) < 0) {
+        close(sock);
+        return FALSE;
+    }
+
+    plugin_data->status_socket = sock;
+    plugin_data->status_channel = g_io_channel_unix_new(sock);
+    plugin_data->status_watch = g_io_add_watch(plugin_data->status_channel,
+                           G_IO_IN,
+                           status_socket_cb,
+                           (gpointer) plugin_data);
+
+    return TRUE;
+}
+
 static void launch_cmd(const char *cmd, const char *appname)
 {
     GAppInfo *appinfo = NULL;
@@ -348,10 +448,79 @@ static gboolean read_status(kano_updater_plugin_t *plugin_data)
     return FALSE;
 }
 
+static gboolean parse_status_record(kano_updater_plugin_t *plugin_data,
+                    const char *record)
+{
+    char state[MAX_STATE_LENGTH];
+    int version, is_scheduled, is_urgent, notifications_muted;
+    int last_check, last_check_urgent, last_update;
+
+    /*
+     * See kano_updater/status_channel.py for the format, the width of the
+     * state is MAX_STATE_LENGTH - 1
+     */
+    if (sscanf(record, "%d %31s %d %d %d %d %d %d", &version, state,
+           &is_scheduled, &is_urgent, &notifications_muted,
+           &last_check, &last_check_urgent, &last_update) != 8)
+        return FALSE;
+
+    if (version != STATUS_RECORD_VERSION)
+        return FALSE;
+
+    SET_STATE(plugin_data, state);
+    plugin_data->notifications_muted = notifications_muted;
+    plugin_data->last_check = last_check;
+    plugin_data->last_check_urgent = last_check_urgent;
+    plugin_data->last_update = last_update;
+
+    return TRUE;
+}
+
+static gboolean is_status_record_current(void)
+{
+    GStatBuf record_stat, status_stat;
+
+    if (g_stat(STATUS_RECORD_FILE, &record_stat) != 0)
+        return FALSE;
+
+    if (g_stat(UPDATE_STATUS_FILE, &status_stat) != 0)
+        return TRUE;
+
+    /*
+     * The record is written after the status file, it's stale when the
+     * writing failed or didn't happen. Same as kano-updater-quickcheck.
+     */
+    if (status_stat.st_mtim.tv_sec != record_stat.st_mtim.tv_sec)
+        return status_stat.st_mtim.tv_sec < record_stat.st_mtim.tv_sec;
+
+    return status_stat.st_mtim.tv_nsec <= record_stat.st_mtim.tv_nsec;
+}
+
+static gboolean read_status_record(kano_updater_plugin_t *plugin_data)
+{
+    gchar *record = NULL;
+    gboolean is_valid = FALSE;
+
+    if (!is_status_record_current())
+        return FALSE;
+
+    if (g_file_get_contents(STATUS_RECORD_FILE, &record, NULL, NULL))
+        is_valid = parse_status_record(plugin_data, record);
+
+    g_free(record);
+    return is_valid;
+}
+
 static gboolean update_status(kano_updater_plugin_t *plugin_data)
 {
     read_status(plugin_data);
+    show_status(plugin_data);
 
+    return TRUE;
+}
+
+static void show_status(kano_updater_plugin_t *plugin_data)
+{
     /* printf("%s lu%d lc%d\n", plugin_data->state,
                  plugin_data->last_update,
                  plugin_data->last_check); */
@@ -387,8 +556,6 @@ static gboolean update_status(kano_updater_plugin_t *plugin_data)
         gtk_image_set_from_file(GTK_IMAGE(plugin_data->icon),
                     NO_UPDATES_ICON_FILE);
     }
-
-    return TRUE;
 }
 
 void download_clicked(GtkWidget *widget, gpointer data)
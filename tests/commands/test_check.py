@@ -0,0 +1,56 @@
+#
+# test_check.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Tests for the `kano_updater.commands.check` module.
+#
+
+
+import pytest
+
+
+@pytest.mark.parametrize('state', ('no-updates',), indirect=True)
+@pytest.mark.parametrize('releases_changed', (False, True, None))
+def test_check_skipped_when_unchanged(apt, state, internet, mocker,
+                                      monkeypatch, releases_changed):
+    import kano_updater.commands.check as check
+    import kano_updater.utils
+    from kano_updater.apt_wrapper import AptWrapper
+    from kano_updater.return_codes import RC, RCState
+    from kano_updater.status import UpdaterStatus
+
+    validators = {'http://repo/dists/stretch/InRelease': {'etag': '"1"'}}
+    monkeypatch.setattr(
+        check, 'check_releases',
+        lambda sources_list, last: (releases_changed, validators)
+    )
+    monkeypatch.setattr(check, 'get_dpkg_status_mtime', lambda: 0)
+    monkeypatch.setattr(
+        kano_updater.utils, 'is_server_available', lambda: True
+    )
+    monkeypatch.setattr(check, 'run_cmd_log', mocker.MagicMock())
+
+    monkeypatch.setattr(check, 'get_ind_packages', lambda priority=None: [])
+
+    apt_handle = AptWrapper.get_instance()
+    update = mocker.MagicMock()
+    monkeypatch.setattr(apt_handle, 'update', update)
+    monkeypatch.setattr(
+        apt_handle, 'is_update_available', lambda priority=None: False
+    )
+    apt_handle._update_succeeded = True
+
+    assert not check.check_for_updates()
+
+    status = UpdaterStatus.get_instance()
+    assert status.last_check > 0
+
+    if releases_changed is False:
+        assert update.call_count == 0
+        assert RCState.get_instance().rc == RC.NO_UPDATES_AVAILABLE
+    elif internet:
+        assert update.call_count == 1
+        if releases_changed:
+            assert status.release_validators == validators
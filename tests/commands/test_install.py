@@ -53,3 +53,78 @@ def test_install(apt, state, system_version, free_space,
             pytest.xfail(rc_warning)
         else:
             raise
+
+
+@pytest.fixture
+def nested_download(apt, state, mocker, monkeypatch):
+    '''
+    Has install() go through a download on the way, with the system calls and
+    the actual work of both mocked away.
+    '''
+
+    import kano_updater.commands.download as download
+    import kano_updater.commands.install as install
+
+    for module in (download, install):
+        monkeypatch.setattr(module, 'run_cmd', mocker.MagicMock())
+        monkeypatch.setattr(
+            module, 'check_disk_space', lambda priority: (True, None)
+        )
+
+    monkeypatch.setattr(download, 'check_connectivity', lambda: (True, True))
+    monkeypatch.setattr(
+        download, '_start_sharing', mocker.MagicMock(return_value=None)
+    )
+    monkeypatch.setattr(download, '_cache_deb_packages', mocker.MagicMock())
+    monkeypatch.setattr(
+        install, '_is_download_complete', lambda status, priority: False
+    )
+
+    def do_install(progress, status, priority=None):
+        progress.finish('Update completed')
+        return True
+
+    monkeypatch.setattr(install, 'do_install', do_install)
+
+    return install
+
+
+def test_install_with_download_finishes_once(nested_download):
+    import kano_updater.progress
+
+    progress = PyTestProgress(throttle_interval=0)
+    events = []
+    progress.subscribe(events.append)
+
+    assert nested_download.install(progress=progress, gui=False)
+
+    kinds = [event.kind for event in events]
+    assert kinds.count(kano_updater.progress.EVENT_DONE) == 1
+    assert kinds[-1] == kano_updater.progress.EVENT_DONE
+    assert events[-1].msg == 'Update completed'
+    assert ('start', 'install') in [(event.kind, event.phase) for event in events]
+
+
+def test_install_with_download_records_history_once(nested_download):
+    from kano_updater.phase_history import PhaseHistory
+
+    history_path = '/tmp/phase-history.json'
+
+    progress = PyTestProgress(throttle_interval=0)
+    progress.use_history(PhaseHistory(history_path))
+
+    assert nested_download.install(progress=progress, gui=False)
+
+    history = PhaseHistory(history_path)
+    assert history._phases
+    for runs in history._phases.itervalues():
+        assert len(runs) == 1
+
+
+def test_install_with_download_doesnt_share(nested_download):
+    import kano_updater.commands.download as download
+
+    assert nested_download.install(progress=PyTestProgress(), gui=False)
+
+    # Serving the package cache to the network is opt-in
+    assert download._start_sharing.call_count == 0
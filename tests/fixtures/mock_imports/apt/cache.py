@@ -10,6 +10,8 @@
 
 
 import re
+from contextlib import contextmanager
+
 from apt.package import Package, Version
 
 from kano_updater.version import VERSION
@@ -76,6 +78,9 @@ class Cache(object):
     def update(self, fetch_progress=None, sources_list=None):
         pass
 
+    def get_changes(self):
+        return [pkg for pkg in self if pkg.marked_upgrade]
+
     @property
     def install_count(self):
         return len([
@@ -99,6 +104,8 @@ class Cache(object):
         for pkg in self:
             if pkg.marked_upgrade:
                 sz += pkg.candidate.installed_size
+                if pkg.installed:
+                    sz -= pkg.installed.installed_size
 
         return sz
 
@@ -114,7 +121,12 @@ class Cache(object):
         sz = 0
 
         for pkg in self:
+            if not pkg.is_upgradable:
+                continue
+
             sz += pkg.candidate.size + pkg.candidate.installed_size
+            if pkg.installed:
+                sz -= pkg.installed.installed_size
 
         return sz / (1024. * 1024.)
 
@@ -129,7 +141,12 @@ class Cache(object):
         pass
 
     def clear(self):
-        pass
+        for pkg in self.packages.itervalues():
+            pkg.mark_keep()
+
+    @contextmanager
+    def actiongroup(self):
+        yield
 
     @property
     def dpkg_journal_dirty(self):
@@ -12,6 +12,22 @@
 import collections
 
 
+class BaseDependency(object):
+    def __init__(self, name, rawtype='Depends'):
+        self.name = name
+        self.rawtype = rawtype
+
+
+class Dependency(list):
+    @property
+    def or_dependencies(self):
+        return list(self)
+
+    @property
+    def rawtype(self):
+        return self[0].rawtype
+
+
 class Version(object):
     def __init__(self, pkg, version, dl_sz=0, install_sz=0, prio=500):
         '''
@@ -34,6 +50,11 @@ class Version(object):
         self.policy_priority = prio
         self.architecture = 'armhf'
 
+        self.filename = 'pool/main/{}_{}_armhf.deb'.format(pkg, version)
+        self.uris = []
+        self.sha256 = ''
+        self.dependencies = []
+
         self._is_installed = False
 
     def __str__(self):
@@ -49,6 +70,9 @@ class Version(object):
     def __eq__(self, other):
         return self.version == other.version
 
+    def get_dependencies(self, *types):
+        return [dep for dep in self.dependencies if dep.rawtype in types]
+
     @property
     def is_installed(self):
         return self._is_installed
@@ -88,6 +112,17 @@ class Package(object):
     def mark_keep(self):
         self._marked_upgrade = False
 
+    def mark_install(self, auto_fix=True, auto_inst=True, from_user=True):
+        if self.is_upgradable:
+            self._marked_upgrade = True
+
+    def mark_delete(self, auto_fix=True, purge=False):
+        pass
+
+    @property
+    def is_auto_installed(self):
+        return False
+
     @property
     def marked_keep(self):
         return not self.marked_upgrade
@@ -128,7 +163,7 @@ class Package(object):
 
     @property
     def is_upgradable(self):
-        return self.installed < self.candidate
+        return self.installed is not None and self.installed < self.candidate
 
     @property
     def installed(self):
@@ -10,7 +10,10 @@
 
 
 class AcquireProgress(object):
-    pass
+    # Floats, like in python-apt
+    current_bytes = 0.0
+    fetched_bytes = 0.0
+    total_bytes = 0.0
 
 
 class OpProgress(object):
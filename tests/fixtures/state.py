@@ -11,6 +11,10 @@
 import json
 import pytest
 
+# Imported ahead of the fake filesystem, otherwise the module keeps the fake
+# `os` of the first test using it
+import kano_updater.status
+
 
 STATUS_TEMPLATE = {
     "state": "no-updates",
@@ -8,6 +8,7 @@
 #
 
 
+import os
 import pytest
 
 
@@ -61,6 +62,231 @@ def test_space(apt):
     assert wrapper.get_required_upgrade_space() == install_req + dl_req
 
 
+def test_space_estimate_is_side_effect_free(apt, mocker, monkeypatch):
+    '''
+    Tests that estimating the upgrade size doesn't touch the package marks or
+    run the resolver and is only calculated once per cache generation
+    '''
+
+    from kano_updater.apt_wrapper import AptWrapper
+
+    wrapper = AptWrapper.get_instance()
+    upgrade = mocker.MagicMock()
+    monkeypatch.setattr(wrapper._cache, 'upgrade', upgrade)
+
+    size = wrapper.get_required_upgrade_space()
+
+    assert upgrade.call_count == 0
+    assert not wrapper._cache.get_changes()
+    assert size == pytest.approx(apt.required_test_space)
+
+    # Memoized until the cache is reopened
+    pkg = next(iter(wrapper._cache))
+    monkeypatch.setattr(pkg.candidate, 'size', pkg.candidate.size + 1048576)
+    assert wrapper.get_required_upgrade_space() == size
+
+    wrapper.clear_cache()
+    assert wrapper.get_required_upgrade_space() == pytest.approx(size + 1)
+
+
+def test_space_counts_growth_over_installed_version(apt):
+    '''
+    Tests that an upgrade only counts for what it adds to the installed
+    version, both in the estimate and in the solved plan
+    '''
+
+    from kano_updater.apt_wrapper import AptWrapper
+
+    wrapper = AptWrapper.get_instance()
+
+    full_size = wrapper._cache.required_test_space
+
+    pkg = wrapper._cache['test-pkg-4']
+    pkg.installed.installed_size = pkg.candidate.installed_size - 1048576
+    expected = full_size - pkg.installed.installed_size / 1048576.
+
+    assert expected == pytest.approx(wrapper._cache.required_test_space)
+    assert expected < full_size - 200
+    assert wrapper.get_required_upgrade_space() == pytest.approx(expected)
+
+    wrapper.clear_cache()
+    wrapper.get_upgrade_plan()
+    assert wrapper.get_required_upgrade_space() == pytest.approx(expected)
+
+
+def test_space_estimate_follows_dependencies(apt):
+    '''
+    Tests that the estimate takes in the new dependencies of the candidates
+    and leaves out the installed packages they conflict with
+    '''
+
+    from apt.package import BaseDependency, Dependency, Package, Version
+    from kano_updater.apt_wrapper import AptWrapper
+
+    wrapper = AptWrapper.get_instance()
+    size = wrapper.get_required_upgrade_space()
+
+    new_dep = Package('test-pkg-new', [Version('test-pkg-new', '1.0', 2, 5)])
+    new_dep.installed.is_installed = False
+    wrapper._cache.packages['test-pkg-new'] = new_dep
+
+    conflict = wrapper._cache['test-pkg-5']
+    conflict.installed.installed_size = 3 * 1048576
+
+    candidate = wrapper._cache['test-pkg-1'].candidate
+    candidate.dependencies = [
+        Dependency([BaseDependency('test-pkg-new')]),
+        Dependency([BaseDependency('test-pkg-5', 'Conflicts')]),
+    ]
+
+    wrapper.clear_cache()
+    assert wrapper.get_required_upgrade_space() == \
+        pytest.approx(size + 2 + 5 - 3)
+
+
+def test_upgrade_index_scans_cache_once(apt, monkeypatch):
+    '''
+    Tests that the upgradable packages are only collected once per cache
+    generation and that reopening the cache invalidates them
+    '''
+
+    from kano_updater.apt_wrapper import AptWrapper
+    import kano_updater.priority as Priority
+
+    wrapper = AptWrapper.get_instance()
+
+    cache_cls = type(wrapper._cache)
+    cache_iter = cache_cls.__iter__
+    scans = []
+
+    def counting_iter(self):
+        scans.append(self)
+        return cache_iter(self)
+
+    monkeypatch.setattr(cache_cls, '__iter__', counting_iter)
+
+    assert wrapper.is_update_available()
+    assert wrapper.is_update_available(priority=Priority.NONE)
+    assert wrapper.independent_packages_available() == []
+    upgradable = set(
+        pkg.name for pkg in wrapper.upgradable_packages()
+    )
+
+    assert len(scans) == 1
+    assert upgradable == set(
+        pkg.name for pkg in cache_iter(wrapper._cache) if pkg.is_upgradable
+    )
+
+    wrapper.clear_cache()
+    wrapper.is_update_available()
+
+    assert len(scans) == 2
+
+
+def test_upgrade_plan_solved_once(apt, mocker, monkeypatch):
+    '''
+    Tests that the resolver only runs once for the space check, the download
+    and the installation, all of which share the same plan
+    '''
+
+    from kano_updater.apt_wrapper import AptWrapper
+    from kano_updater.progress import CLIProgress
+
+    wrapper = AptWrapper.get_instance()
+    cache_upgrade = wrapper._cache.upgrade
+    upgrade = mocker.MagicMock(side_effect=cache_upgrade)
+    monkeypatch.setattr(wrapper._cache, 'upgrade', upgrade)
+    monkeypatch.setattr(wrapper, '_prefetch_archives', mocker.MagicMock())
+
+    plan = wrapper.get_upgrade_plan()
+    assert wrapper.get_upgrade_plan() is plan
+    assert wrapper.get_required_upgrade_space() == \
+        pytest.approx(apt.required_test_space)
+
+    upgradable = set(
+        pkg.name for pkg in wrapper._cache if pkg.is_upgradable
+    )
+    assert set(plan.get_packages()) == upgradable
+
+    # Marks are restored from the plan rather than solved again
+    wrapper._cache.clear()
+    wrapper._marked_plan = None
+    wrapper.cache_updates(CLIProgress(), plan=plan)
+    assert set(pkg.name for pkg in wrapper._cache.get_changes()) == upgradable
+
+    wrapper.upgrade_all(progress=CLIProgress(), plan=plan)
+
+    assert upgrade.call_count == 1
+    for pkg in wrapper._cache:
+        assert pkg.installed == pkg.candidate
+
+
+def test_update_reuses_cache_for_unchanged_lists(apt, fs, mocker, monkeypatch):
+    '''
+    Tests that `AptWrapper.update()` only reopens the apt cache when the
+    package lists have changed
+    '''
+
+    from kano_updater.apt_wrapper import AptWrapper
+    from kano_updater.paths import APT_LISTS_DIR
+    from kano_updater.progress import CLIProgress
+
+    release = os.path.join(
+        APT_LISTS_DIR, 'repo.kano.me_archive-stretch_dists_release_InRelease'
+    )
+    fs.create_file(release, contents='Origin: Kano\n')
+
+    wrapper = AptWrapper.get_instance()
+    cache_open = mocker.MagicMock()
+    monkeypatch.setattr(wrapper._cache, 'open', cache_open)
+
+    wrapper.update(CLIProgress())
+    assert cache_open.call_count == 0
+
+    with open(release, 'a') as release_file:
+        release_file.write('Date: Tue, 15 Jan 2019 12:00:00 UTC\n')
+
+    wrapper.update(CLIProgress())
+    assert cache_open.call_count == 1
+
+    wrapper.update(CLIProgress())
+    assert cache_open.call_count == 1
+
+
+def test_update_counts_fetched_bytes(apt, mocker, monkeypatch):
+    '''
+    Tests that `AptWrapper.update()` uses index diffs and records the bytes
+    transferred across all the attempts
+    '''
+
+    import kano_updater.retry
+    monkeypatch.setattr(kano_updater.retry, 'heartbeat', mocker.MagicMock())
+
+    import apt as apt_module
+    from kano_updater.apt_progress_wrapper import AptDownloadFailException
+    from kano_updater.apt_wrapper import AptWrapper
+    from kano_updater.progress import CLIProgress
+
+    attempts = []
+
+    def cache_update(fetch_progress=None, sources_list=None):
+        attempts.append(sources_list)
+        fetch_progress.fetched_bytes += 1000.0 * len(attempts)
+        if len(attempts) == 1:
+            raise AptDownloadFailException('Index')
+
+    wrapper = AptWrapper.get_instance()
+    monkeypatch.setattr(wrapper._cache, 'update', cache_update)
+
+    assert apt_module.apt_pkg.config['Acquire::PDiffs'] == 'true'
+    assert apt_module.apt_pkg.config['Acquire::PDiffs::Merge'] == 'true'
+
+    wrapper.update(CLIProgress())
+    assert len(attempts) == 2
+    assert wrapper.update_fetched_bytes == 3000
+    assert isinstance(wrapper.update_fetched_bytes, int)
+
+
 COUNT = 0
 EXPECTED_FAILS = 2
 
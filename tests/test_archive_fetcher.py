@@ -0,0 +1,177 @@
+#
+# test_archive_fetcher.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Tests for the `kano_updater.archive_fetcher` module
+#
+
+
+import os
+import hashlib
+import threading
+import BaseHTTPServer
+import SocketServer
+
+import pytest
+
+from tests.fixtures.progress import PyTestProgress
+
+
+ARCHIVE_SIZE = 256 * 1024
+
+
+def make_archive(seed):
+    return ''.join(chr((idx * seed) % 251) for idx in xrange(ARCHIVE_SIZE))
+
+
+class ArchiveHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''
+    Serves the archives with support for range requests, corrupting the
+    ones listed in `corrupt`
+    '''
+
+    protocol_version = 'HTTP/1.1'
+
+    archives = {}
+    corrupt = set()
+    requests = []
+
+    def do_GET(self):
+        self.requests.append((self.path, self.headers.get('Range')))
+
+        content = self.archives.get(self.path)
+        if content is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if self.path in self.corrupt:
+            content = content[::-1]
+
+        start = 0
+        byte_range = self.headers.get('Range')
+        if byte_range:
+            start = int(byte_range.split('=')[1].rstrip('-'))
+            self.send_response(206)
+        else:
+            self.send_response(200)
+
+        body = content[start:]
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadedServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture
+def archive_server():
+    ArchiveHandler.archives = {}
+    ArchiveHandler.corrupt = set()
+    ArchiveHandler.requests = []
+
+    server = ThreadedServer(('127.0.0.1', 0), ArchiveHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    yield 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+    server.shutdown()
+    server.server_close()
+
+
+def make_items(server_url, count):
+    from kano_updater.archive_fetcher import ArchiveItem
+
+    items = []
+    for idx in xrange(count):
+        path = '/pool/test-pkg-{}.deb'.format(idx)
+        content = make_archive(idx + 2)
+        ArchiveHandler.archives[path] = content
+
+        items.append(ArchiveItem(
+            'test-pkg-{}'.format(idx),
+            [server_url + path],
+            'test-pkg-{}_1.0_armhf.deb'.format(idx),
+            len(content),
+            hashlib.sha256(content).hexdigest()
+        ))
+
+    return items
+
+
+def fetch(items, archives_dir, **kwargs):
+    from kano_updater.archive_fetcher import ArchiveFetcher
+    from kano_updater.progress import Phase
+
+    progress = PyTestProgress()
+    progress.split(Phase('fetching', 'Fetching'))
+    progress.start('fetching')
+
+    fetcher = ArchiveFetcher(items, archives_dir=archives_dir, **kwargs)
+    return fetcher, fetcher.fetch(progress, 'fetching')
+
+
+def test_archive_filename():
+    from kano_updater.archive_fetcher import archive_filename
+
+    assert archive_filename(
+        'kano-updater', '1:4.2.0-0', 'armhf',
+        'pool/main/k/kano-updater/kano-updater_4.2.0-0_armhf.deb'
+    ) == 'kano-updater_1%3a4.2.0-0_armhf.deb'
+
+
+def test_fetch_archives(archive_server, tmpdir):
+    items = make_items(archive_server, 5)
+
+    fetcher, failed = fetch(items, str(tmpdir), connections=3)
+
+    assert failed == []
+    for item in items:
+        with open(fetcher.get_path(item), 'rb') as archive:
+            assert hashlib.sha256(archive.read()).hexdigest() == item.sha256
+
+
+def test_resume_partial_archive(archive_server, tmpdir):
+    items = make_items(archive_server, 1)
+    item = items[0]
+    content = ArchiveHandler.archives.values()[0]
+
+    os.makedirs(str(tmpdir.join('partial')))
+    with open(str(tmpdir.join('partial', item.filename)), 'wb') as partial:
+        partial.write(content[:1000])
+
+    fetcher, failed = fetch(items, str(tmpdir))
+
+    assert failed == []
+    assert ArchiveHandler.requests[-1][1] == 'bytes=1000-'
+    with open(fetcher.get_path(item), 'rb') as archive:
+        assert archive.read() == content
+
+
+def test_only_failed_archives_are_retried(archive_server, tmpdir, monkeypatch):
+    import kano_updater.archive_fetcher
+    monkeypatch.setattr(kano_updater.archive_fetcher, 'RETRY_DELAY', 0)
+
+    items = make_items(archive_server, 3)
+    corrupt_path = '/pool/test-pkg-1.deb'
+    ArchiveHandler.corrupt.add(corrupt_path)
+
+    fetcher, failed = fetch(items, str(tmpdir), retries=3)
+
+    assert [item.name for item in failed] == ['test-pkg-1']
+    assert not os.path.exists(fetcher.get_partial_path(failed[0]))
+
+    requested = [path for path, dummy_range in ArchiveHandler.requests]
+    assert requested.count(corrupt_path) == 3
+    assert requested.count('/pool/test-pkg-0.deb') == 1
+    assert requested.count('/pool/test-pkg-2.deb') == 1
@@ -0,0 +1,135 @@
+#
+# test_bandwidth.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Tests for the `kano_updater.bandwidth` module
+#
+
+
+import pytest
+
+
+class FakeTime(object):
+    '''
+    Replacement for the `time` module where sleeping only advances the clock
+    '''
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = 0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, secs):
+        self.now += secs
+        self.slept += secs
+
+
+@pytest.fixture
+def fake_time(monkeypatch, mocker):
+    import kano_updater.bandwidth
+
+    clock = FakeTime()
+    monkeypatch.setattr(kano_updater.bandwidth, 'time', clock)
+    monkeypatch.setattr(kano_updater.bandwidth, 'heartbeat', mocker.MagicMock())
+
+    return clock
+
+
+def test_rate_is_capped_at_ceiling(fake_time):
+    from kano_updater.bandwidth import RateLimiter
+
+    ceiling = 100 * 1024
+    limiter = RateLimiter(ceiling)
+
+    start = fake_time.now
+    for dummy_chunk in xrange(100):
+        limiter.consume(10 * 1024)
+
+    # 1000 KB at 100 KB/s with a burst of a second worth of data
+    assert fake_time.now - start == pytest.approx(9, abs=0.5)
+    assert limiter.rate <= ceiling
+
+
+def test_rate_backs_off_on_contention(fake_time):
+    from kano_updater.bandwidth import RateLimiter, RATE_BACKOFF
+
+    ceiling = 100 * 1024
+    limiter = RateLimiter(ceiling)
+
+    # The link only manages 20 KB/s
+    for dummy_chunk in xrange(20):
+        fake_time.now += 1
+        limiter.consume(20 * 1024)
+
+    assert limiter.rate == pytest.approx(20 * 1024 * RATE_BACKOFF, rel=0.2)
+
+
+def test_pause_while_interactive(fake_time):
+    from kano_updater.bandwidth import RateLimiter, PAUSE_CHECK_INTERVAL
+
+    checks = [True, True, False]
+
+    def is_paused():
+        return checks.pop(0) if checks else False
+
+    limiter = RateLimiter(100 * 1024, is_paused=is_paused)
+    limiter.consume(1024)
+
+    assert fake_time.slept == 2 * PAUSE_CHECK_INTERVAL
+    assert not checks
+
+
+def test_interactive_session(fs, monkeypatch):
+    import os
+    import time
+    import kano_updater.bandwidth as bandwidth
+
+    sessions = bandwidth.LOGIND_SESSIONS_DIR
+    fs.create_file(
+        os.path.join(sessions, '1'),
+        contents='ACTIVE=1\nREMOTE=0\nCLASS=user\nTTY=tty1\n'
+    )
+    fs.create_file('/dev/tty1')
+
+    idle = time.time() - 2 * bandwidth.INTERACTIVE_IDLE_TIME
+    os.utime('/dev/tty1', (idle, idle))
+    assert not bandwidth.is_interactive_session()
+
+    os.utime('/dev/tty1', None)
+    assert bandwidth.is_interactive_session()
+
+
+def test_interactive_graphical_session(fs, mocker, monkeypatch):
+    import os
+    import kano_updater.bandwidth as bandwidth
+
+    # The desktop has no terminal of its own
+    fs.create_file(
+        os.path.join(bandwidth.LOGIND_SESSIONS_DIR, '2'),
+        contents='ACTIVE=1\nREMOTE=0\nCLASS=user\nTYPE=x11\n'
+                 'DISPLAY=:0\nNAME=kano\n'
+    )
+    monkeypatch.setattr(
+        bandwidth, 'find_executable', lambda name: '/usr/bin/' + name
+    )
+
+    idle_ms = str(2 * bandwidth.INTERACTIVE_IDLE_TIME * 1000)
+    run_cmd = mocker.MagicMock(return_value=(idle_ms + '\n', '', 0))
+    monkeypatch.setattr(bandwidth, 'run_cmd', run_cmd)
+    assert not bandwidth.is_interactive_session()
+
+    cmd = run_cmd.call_args[0][0]
+    assert cmd.startswith('DISPLAY=:0 XAUTHORITY=')
+    assert '/.Xauthority' in cmd
+    assert cmd.endswith(' xprintidle')
+
+    run_cmd.return_value = ('1500\n', '', 0)
+    assert bandwidth.is_interactive_session()
+
+    # Without the X idle time there is nothing to tell from
+    run_cmd.return_value = ('', 'unable to open display', 1)
+    assert not bandwidth.is_interactive_session()
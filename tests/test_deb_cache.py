@@ -0,0 +1,114 @@
+#
+# test_deb_cache.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Tests for the `kano_updater.deb_cache` module
+#
+
+
+import os
+import hashlib
+
+import pytest
+
+from tests.fixtures.progress import PyTestProgress
+
+
+def make_archive(path, content):
+    with open(path, 'wb') as archive:
+        archive.write(content)
+
+    return hashlib.sha256(content).hexdigest()
+
+
+@pytest.fixture
+def deb_cache(tmpdir):
+    from kano_updater.deb_cache import DebCache
+
+    return DebCache(cache_dir=str(tmpdir.join('debs')))
+
+
+def test_store_and_restore(deb_cache, tmpdir):
+    archive = str(tmpdir.join('test-pkg_1.0_armhf.deb'))
+    sha256 = make_archive(archive, 'archive')
+
+    assert deb_cache.lookup(sha256) is None
+    assert deb_cache.store(archive) == sha256
+
+    # The archive survives `apt-get clean`
+    os.remove(archive)
+    cached = deb_cache.lookup(sha256)
+    assert cached == deb_cache.get_path(sha256)
+
+    restored = str(tmpdir.join('restored.deb'))
+    assert deb_cache.restore(sha256, restored)
+    with open(restored, 'rb') as restored_file:
+        assert restored_file.read() == 'archive'
+
+    # Hardlinked rather than copied
+    assert os.stat(restored).st_ino == os.stat(cached).st_ino
+
+
+def test_prune_evicts_least_recently_used(deb_cache, tmpdir):
+    hashes = []
+    for idx in xrange(3):
+        archive = str(tmpdir.join('pkg-{}.deb'.format(idx)))
+        sha256 = make_archive(archive, str(idx) * 1024 * 1024)
+        deb_cache.store(archive, sha256)
+        os.utime(deb_cache.get_path(sha256), (1000 + idx, 1000 + idx))
+        hashes.append(sha256)
+
+    # Using the oldest entry makes it the most recent one
+    deb_cache.lookup(hashes[0])
+    deb_cache.prune(budget=2)
+
+    assert deb_cache.lookup(hashes[0])
+    assert deb_cache.lookup(hashes[1]) is None
+    assert deb_cache.lookup(hashes[2])
+
+
+def test_budget_follows_free_space(deb_cache, monkeypatch):
+    import kano.utils.disk
+    from kano_updater.deb_cache import RESERVED_SPACE, FREE_SPACE_SHARE, \
+        MAX_CACHE_SIZE
+
+    monkeypatch.setattr(kano.utils.disk, 'get_free_space', lambda: 0)
+    assert deb_cache.get_budget() == 0
+
+    monkeypatch.setattr(
+        kano.utils.disk, 'get_free_space', lambda: RESERVED_SPACE + 400
+    )
+    assert deb_cache.get_budget() == pytest.approx(400 * FREE_SPACE_SHARE)
+
+    monkeypatch.setattr(kano.utils.disk, 'get_free_space', lambda: 999999)
+    assert deb_cache.get_budget() == MAX_CACHE_SIZE
+
+
+def test_fetcher_uses_cache_offline(deb_cache, tmpdir):
+    from kano_updater.archive_fetcher import ArchiveFetcher, ArchiveItem
+    from kano_updater.progress import Phase
+
+    content = 'cached archive'
+    source = str(tmpdir.join('source.deb'))
+    sha256 = make_archive(source, content)
+    deb_cache.store(source, sha256)
+
+    # Nothing listens on the URI, the archive must come from the cache
+    item = ArchiveItem(
+        'test-pkg', ['http://127.0.0.1:1/test-pkg.deb'],
+        'test-pkg_1.0_armhf.deb', len(content), sha256
+    )
+
+    progress = PyTestProgress()
+    progress.split(Phase('fetching', 'Fetching'))
+    progress.start('fetching')
+
+    archives_dir = str(tmpdir.join('archives'))
+    fetcher = ArchiveFetcher(
+        [item], archives_dir=archives_dir, retries=1, deb_cache=deb_cache
+    )
+
+    assert fetcher.fetch(progress, 'fetching') == []
+    assert fetcher.is_fetched(item)
@@ -0,0 +1,106 @@
+#
+# test_deltas.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Tests for fetching archives through deltas
+#
+
+
+import pytest
+
+from tests.test_archive_fetcher import ArchiveHandler, archive_server, \
+    make_items, fetch
+
+
+DELTA_PATH = '/pool/test-pkg-0_0.9_1.0_armhf.debdelta'
+
+
+@pytest.fixture
+def delta_item(archive_server):
+    item = make_items(archive_server, 1)[0]
+    item.delta_uris = [archive_server + DELTA_PATH]
+    ArchiveHandler.archives[DELTA_PATH] = 'delta'
+
+    return item
+
+
+@pytest.fixture
+def patched(monkeypatch):
+    '''
+    Replaces debpatch, reconstructing the archive served by the test server,
+    corrupted when `patched['content']` is changed
+    '''
+
+    import kano_updater.archive_fetcher
+
+    applied = {'content': None, 'calls': []}
+
+    def apply_delta(delta_path, dest, old_archive=None):
+        with open(delta_path, 'rb') as delta:
+            assert delta.read() == 'delta'
+
+        applied['calls'].append(old_archive)
+        with open(dest, 'wb') as archive:
+            archive.write(applied['content'])
+
+    monkeypatch.setattr(
+        kano_updater.archive_fetcher, 'apply_delta', apply_delta
+    )
+
+    return applied
+
+
+def test_delta_filename():
+    from kano_updater.deltas import delta_filename, delta_uris
+
+    name = delta_filename('kano-updater', '1:4.1.0-0', '1:4.2.0-0', 'armhf')
+    assert name == 'kano-updater_1%3a4.1.0-0_1%3a4.2.0-0_armhf.debdelta'
+
+    assert delta_uris(
+        ['http://repo/pool/k/kano-updater_4.2.0-0_armhf.deb'], name
+    ) == ['http://repo/pool/k/' + name]
+
+
+def test_fetch_through_delta(delta_item, patched, tmpdir):
+    patched['content'] = ArchiveHandler.archives['/pool/test-pkg-0.deb']
+
+    fetcher, failed = fetch([delta_item], str(tmpdir))
+
+    assert failed == []
+    assert fetcher.is_fetched(delta_item)
+    assert patched['calls'] == [None]
+
+    requested = [path for path, dummy_range in ArchiveHandler.requests]
+    assert requested == [DELTA_PATH]
+
+
+def test_delta_mismatch_falls_back(delta_item, patched, tmpdir):
+    patched['content'] = 'not the archive'
+
+    fetcher, failed = fetch([delta_item], str(tmpdir))
+
+    assert failed == []
+    assert fetcher.is_fetched(delta_item)
+
+    requested = [path for path, dummy_range in ArchiveHandler.requests]
+    assert requested == [DELTA_PATH, '/pool/test-pkg-0.deb']
+
+
+def test_delta_uses_cached_old_archive(delta_item, patched, tmpdir):
+    from kano_updater.deb_cache import DebCache
+
+    deb_cache = DebCache(cache_dir=str(tmpdir.join('debs')))
+    old_archive = tmpdir.join('old.deb')
+    old_archive.write('old archive', mode='wb')
+    delta_item.old_sha256 = deb_cache.store(str(old_archive))
+
+    patched['content'] = ArchiveHandler.archives['/pool/test-pkg-0.deb']
+
+    dummy_fetcher, failed = fetch(
+        [delta_item], str(tmpdir.join('archives')), deb_cache=deb_cache
+    )
+
+    assert failed == []
+    assert patched['calls'] == [deb_cache.get_path(delta_item.old_sha256)]
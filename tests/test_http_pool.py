@@ -0,0 +1,28 @@
+#
+# test_http_pool.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Tests for the `kano_updater.http_pool` module
+#
+
+
+def test_reused_connection_takes_new_timeout(mocker):
+    import kano_updater.http_pool as http_pool
+
+    http_pool.close_all()
+
+    conn = http_pool.acquire('http://repo.example.com/probe', timeout=3)
+    assert conn.timeout == 3
+
+    conn.sock = mocker.MagicMock()
+    http_pool.release(conn)
+
+    reused = http_pool.acquire('http://REPO.example.com/pool/a.deb')
+    assert reused is conn
+    assert conn.timeout == http_pool.TIMEOUT
+    conn.sock.settimeout.assert_called_once_with(http_pool.TIMEOUT)
+
+    http_pool.release(conn)
+    http_pool.close_all()
@@ -0,0 +1,120 @@
+#
+# test_lan_share.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Tests for the `kano_updater.lan_share` module, with two updaters sharing
+# over loopback
+#
+
+
+import hashlib
+
+import pytest
+
+from tests.fixtures.progress import PyTestProgress
+
+
+LOOPBACK = '127.0.0.1'
+ARCHIVE = 'shared archive' * 1024
+
+
+@pytest.fixture
+def peer(tmpdir):
+    '''
+    An updater sharing a package cache which has `ARCHIVE` in it
+    '''
+
+    from kano_updater.deb_cache import DebCache
+    from kano_updater.lan_share import PeerServer
+
+    deb_cache = DebCache(cache_dir=str(tmpdir.join('peer-debs')))
+    source = tmpdir.join('source.deb')
+    source.write(ARCHIVE, mode='wb')
+    deb_cache.store(str(source))
+
+    server = PeerServer(
+        deb_cache, address=LOOPBACK, http_port=0, discovery_port=0
+    )
+    server.start()
+
+    yield server, deb_cache
+
+    server.stop()
+
+
+def make_item():
+    from kano_updater.archive_fetcher import ArchiveItem
+
+    # Nothing listens on the repository URI, only the peer can help
+    return ArchiveItem(
+        'test-pkg', ['http://127.0.0.1:1/test-pkg.deb'],
+        'test-pkg_1.0_armhf.deb', len(ARCHIVE),
+        hashlib.sha256(ARCHIVE).hexdigest()
+    )
+
+
+def fetch(items, tmpdir):
+    from kano_updater.archive_fetcher import ArchiveFetcher
+    from kano_updater.deb_cache import DebCache
+    from kano_updater.progress import Phase
+
+    progress = PyTestProgress()
+    progress.split(Phase('fetching', 'Fetching'))
+    progress.start('fetching')
+
+    deb_cache = DebCache(cache_dir=str(tmpdir.join('debs')))
+    fetcher = ArchiveFetcher(
+        items, archives_dir=str(tmpdir.join('archives')), retries=1,
+        deb_cache=deb_cache
+    )
+
+    return fetcher, deb_cache, fetcher.fetch(progress, 'fetching')
+
+
+def test_discover_peers(peer):
+    from kano_updater.lan_share import discover_peers
+
+    server, dummy_cache = peer
+
+    assert discover_peers(
+        addresses=[LOOPBACK], port=server.discovery_port
+    ) == ['http://{}:{}'.format(LOOPBACK, server.http_port)]
+
+
+def test_fetch_from_peer(peer, tmpdir):
+    from kano_updater.lan_share import add_peer_uris
+
+    server, dummy_cache = peer
+    item = make_item()
+
+    assert add_peer_uris(
+        [item], addresses=[LOOPBACK], port=server.discovery_port
+    ) == 1
+    assert item.uris[0].endswith('/debs/' + item.sha256)
+
+    fetcher, deb_cache, failed = fetch([item], tmpdir)
+
+    assert failed == []
+    assert fetcher.is_fetched(item)
+
+    # Available to share further
+    assert deb_cache.get_hashes() == [item.sha256]
+
+
+def test_corrupt_peer_archive_is_rejected(peer, tmpdir):
+    from kano_updater.lan_share import add_peer_uris
+
+    server, peer_cache = peer
+    item = make_item()
+
+    with open(peer_cache.get_path(item.sha256), 'r+b') as archive:
+        archive.write('corrupt')
+
+    add_peer_uris([item], addresses=[LOOPBACK], port=server.discovery_port)
+    fetcher, deb_cache, failed = fetch([item], tmpdir)
+
+    assert failed == [item]
+    assert not fetcher.is_fetched(item)
+    assert deb_cache.get_hashes() == []
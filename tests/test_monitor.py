@@ -9,6 +9,7 @@
 
 
 import imp
+import time
 
 
 def run_monitor(mon_timeout, test_cmd):
@@ -25,6 +26,64 @@ def run_monitor_wrap(mon_timeout, test_cmd):
     return subprocess.call(["./tests/monitor_wrap.py"]+test_cmd, shell=False)
 
 
+def make_proc(tmpdir, tree, children_files):
+    # `tree` maps the pids to their parent, the names trip up naive parsing
+    proc = tmpdir.mkdir('proc')
+    proc.mkdir('self')
+
+    for pid, ppid in tree.iteritems():
+        pid_dir = proc.mkdir(str(pid))
+        pid_dir.join('stat').write(
+            '{} (a (b) c) S {} 1 1 0 -1\n'.format(pid, ppid)
+        )
+
+        task_dir = pid_dir.mkdir('task').mkdir(str(pid))
+        if children_files:
+            children = [child for child, parent in tree.iteritems()
+                        if parent == pid]
+            task_dir.join('children').write(
+                ''.join('{} '.format(child) for child in children)
+            )
+
+    return str(proc)
+
+
+def test_monitor_pids(tmpdir, apt):
+    from kano_updater.monitor import MonitorPids
+
+    tree = {1: 0, 10: 1, 11: 10, 12: 10, 13: 12, 20: 1, 21: 20}
+
+    for children_files in (True, False):
+        proc_dir = make_proc(tmpdir.mkdir(str(children_files)), tree,
+                             children_files)
+        pids = MonitorPids(10, proc_dir=proc_dir)
+
+        assert pids.has_children_files == children_files
+        assert pids.is_changed()
+        assert pids.curr_children == set([10, 11, 12, 13])
+        assert not pids.is_changed()
+
+
+def test_monitor_pids_live(apt):
+    import subprocess
+    from kano_updater.monitor import MonitorPids
+
+    proc = subprocess.Popen(['sh', '-c', 'sleep 10 & sleep 10; wait'])
+
+    try:
+        pids = MonitorPids(proc.pid)
+        for dummy_i in xrange(50):
+            if len(pids._get_children()) == 3:
+                break
+            time.sleep(0.1)
+
+        assert len(pids._get_children()) == 3
+        assert proc.pid in pids._get_children()
+    finally:
+        proc.kill()
+        proc.wait()
+
+
 def test_return_code(monitor_pid, apt):
     import os
     import random
@@ -106,5 +165,55 @@ def test_monitor_term(monitor_pid, apt):
     rc = proc.returncode
     assert rc == -signal.SIGTERM
 
+
+def test_exit_wakes_up_monitor(monitor_pid, apt):
+    import subprocess
+    import kano_updater.monitor
+
+    # When the command exits between samples of the process tree,
+    # Then the monitor returns straight away
+    proc = subprocess.Popen(['sleep', '0.2'])
+    start = time.time()
+
+    assert not kano_updater.monitor.monitor(proc, 300)
+    assert time.time() - start < 2
+    assert proc.returncode == 0
+
+def test_heartbeat_channel(monitor_pid, mocker, monkeypatch):
+    import os
+    import kano_updater.monitor_heartbeat as monitor_heartbeat
+    from kano_updater.monitor_heartbeat import HeartbeatChannel, \
+        HEARTBEAT_ENV, heartbeat
+
+    kill = mocker.MagicMock()
+    monkeypatch.setattr(monitor_heartbeat.os, 'kill', kill)
+
+    channel = HeartbeatChannel.create()
+    try:
+        assert channel.read() == (0, '')
+
+        # The processes being monitored find the channel in the environment
+        monkeypatch.setenv(HEARTBEAT_ENV, channel.path)
+        monkeypatch.setenv('MONITOR_PID', str(os.getpid()))
+        heartbeat('phase-1')
+        heartbeat()
+        heartbeat(u'phase-2')
+
+        assert channel.read() == (3, 'phase-2')
+        assert kill.call_count == 0
+    finally:
+        channel.close()
+
+    assert not os.path.exists(channel.path)
+
+    # Without the channel, the monitor is signalled but not for every beat
+    monkeypatch.delenv(HEARTBEAT_ENV)
+    monkeypatch.setattr(monitor_heartbeat, '_last_signal', 0)
+    for dummy_i in xrange(100):
+        heartbeat('phase-3')
+
+    assert kill.call_count == 1
+
+
 # TBD:
 #   - test gui mode
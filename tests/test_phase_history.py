@@ -0,0 +1,156 @@
+#
+# test_phase_history.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Tests for the `kano_updater.phase_history` module
+#
+
+
+import pytest
+
+
+@pytest.fixture
+def history_path(tmpdir):
+    return str(tmpdir.join('phase-history.json'))
+
+
+@pytest.fixture
+def clock(mocker, monkeypatch):
+    import kano_updater.progress
+
+    clock = mocker.MagicMock(return_value=1000.0)
+    monkeypatch.setattr(kano_updater.progress.time, 'time', clock)
+
+    return clock
+
+
+def run_progress(history, clock, durations, relaunch_after=None):
+    import kano_updater.progress as progress
+
+    prog = progress.CLIProgress()
+    prog.use_history(history)
+
+    prog.split(
+        progress.Phase('download', 'Download', 50, is_main=True),
+        progress.Phase('install', 'Install', 50, is_main=True)
+    )
+    prog.split(
+        progress.Phase('unpack', 'Unpack', 1),
+        progress.Phase('configure', 'Configure', 1),
+        phase_name='install'
+    )
+
+    for name in ('download', 'unpack', 'configure'):
+        prog.start(name)
+        if name == 'download':
+            prog.set_bytes(name, 1000, 1000)
+
+        clock.return_value += durations[name]
+
+        if name == relaunch_after:
+            with pytest.raises(progress.Relaunch):
+                prog.relaunch()
+            return prog
+
+    prog.finish('Done')
+
+    return prog
+
+
+def test_history_rebalances_phases(history_path, clock):
+    from kano_updater.phase_history import PhaseHistory
+
+    durations = {'download': 30, 'unpack': 10, 'configure': 60}
+    run_progress(PhaseHistory(history_path), clock, durations)
+
+    history = PhaseHistory(history_path)
+    assert history.get_duration('download') == 30
+    assert history.get_duration('install') == 70
+    assert history.get_duration('configure') == 60
+
+    prog = run_progress(history, clock, durations)
+    phases = prog._phases
+
+    # The percentage follows the time taken
+    assert phases['download'].length == pytest.approx(30)
+    assert phases['unpack'].start == pytest.approx(30)
+    assert phases['configure'].length == pytest.approx(60)
+
+    assert PhaseHistory(history_path)._phases['download'] == \
+        [[30, 1000], [30, 1000]]
+
+
+def test_history_across_relaunch(history_path, clock):
+    from kano_updater.phase_history import PhaseHistory
+
+    durations = {'download': 30, 'unpack': 10, 'configure': 60}
+    run_progress(PhaseHistory(history_path), clock, durations,
+                 relaunch_after='unpack')
+
+    history = PhaseHistory(history_path)
+    assert history.get_duration('unpack') is None
+
+    # The relaunched updater only goes through the rest
+    run_progress(history, clock, {'download': 0, 'unpack': 0, 'configure': 60})
+
+    history = PhaseHistory(history_path)
+    assert history.get_duration('download') == 30
+    assert history.get_duration('unpack') == 10
+    assert history.get_duration('install') == 70
+
+
+def test_eta(clock):
+    import kano_updater.progress as progress
+
+    prog = progress.CLIProgress()
+    assert prog.get_eta() is None
+
+    prog.split(progress.Phase('work', 'Work'))
+    prog.init_steps('work', 4)
+    prog.start('work')
+
+    clock.return_value += 30
+    prog.next_step('work', 'Step 1')
+
+    assert prog.get_eta() == 90
+
+
+def test_history_leaves_out_skipped_phases(history_path, clock):
+    import kano_updater.progress as progress
+    from kano_updater.phase_history import PhaseHistory
+
+    durations = {'download': 30, 'unpack': 10, 'configure': 60}
+    run_progress(PhaseHistory(history_path), clock, durations)
+
+    history = PhaseHistory(history_path)
+    prog = progress.CLIProgress()
+    prog.use_history(history)
+
+    prog.split(
+        progress.Phase('download', 'Download', 50, is_main=True),
+        progress.Phase('install', 'Install', 50, is_main=True)
+    )
+
+    # Nothing to download this time
+    prog.start('download')
+    prog.set_step('download', 1, 'Using the downloaded updates', skipped=True)
+
+    prog.start('install')
+    batches = [
+        progress.Phase('install-batch-{}'.format(index), 'Batch', 1,
+                       in_history=False)
+        for index in xrange(2)
+    ]
+    prog.split(*batches)
+    for batch in batches:
+        prog.start(batch.name)
+        clock.return_value += 35
+
+    prog.finish('Done')
+
+    history = PhaseHistory(history_path)
+    assert history._phases['download'] == [[30, 1000]]
+    assert history._phases['install'] == [[70, None], [70, None]]
+    assert 'install-batch-0' not in history._phases
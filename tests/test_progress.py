@@ -81,3 +81,234 @@ def test_progress_abort_issues_crash_report(send_crash_report):
         'Updater aborted',
         'Aborted with error: {}'.format(abort_msg)
     )
+
+
+def test_crash_report_off_updater_thread(send_crash_report):
+    import threading
+    import kano_updater.progress as progress
+    imp.reload(progress)
+    prog = progress.CLIProgress()
+
+    threads = []
+    send_crash_report.side_effect = \
+        lambda *args: threads.append(threading.current_thread())
+
+    prog.fail('test-fail')
+
+    # Sent by the time the failure is handed over
+    assert len(threads) == 1
+    assert threads[0] is not threading.current_thread()
+
+
+def test_split_phases():
+    import pytest
+    import kano_updater.progress as progress
+    prog = progress.CLIProgress()
+
+    prog.split(
+        progress.Phase('download', 'Download', 40, is_main=True),
+        progress.Phase('install', 'Install', 60, is_main=True)
+    )
+
+    # The first subphase takes over when the current phase is split
+    assert prog.get_current_phase().name == 'download'
+
+    prog.start('install')
+    prog.split(
+        progress.Phase('unpack', 'Unpack', 1),
+        progress.Phase('configure', 'Configure', 3)
+    )
+    prog.split(
+        progress.Phase('configure-a', 'Configure A', 1),
+        progress.Phase('configure-b', 'Configure B', 1),
+        phase_name='configure'
+    )
+
+    # Only the phases which weren't split can be started
+    with pytest.raises(ValueError):
+        prog.start('configure')
+
+    prog.start('configure-b')
+    phase = prog.get_current_phase()
+
+    assert phase.name == 'configure-b'
+    assert phase.get_main_phase().name == 'install'
+    assert phase.start == 40 + 15 + 22.5
+    assert phase.length == 22.5
+
+    with pytest.raises(ValueError):
+        prog.split(progress.Phase('unpack', 'Unpack again'))
+
+
+def test_steps_coalesced(mocker, monkeypatch):
+    import kano_updater.progress as progress
+
+    clock = mocker.MagicMock(return_value=1000.0)
+    monkeypatch.setattr(progress.time, 'time', clock)
+
+    prog = progress.CLIProgress(throttle_interval=1)
+    change = mocker.MagicMock()
+    monkeypatch.setattr(prog, '_change', change)
+
+    prog.split(
+        progress.Phase('phase-1', 'Phase 1'),
+        progress.Phase('phase-2', 'Phase 2')
+    )
+    prog.init_steps('phase-1', 1000)
+
+    # Phase transitions always go through
+    prog.start('phase-1')
+    assert change.call_count == 1
+
+    # Nothing new to show
+    prog.set_step('phase-1', 1, 'Phase 1')
+    assert change.call_count == 1
+
+    # Too soon after the last update
+    for step in xrange(2, 500):
+        prog.set_step('phase-1', step, 'Step {}'.format(step))
+    assert change.call_count == 1
+
+    clock.return_value += 1
+    prog.set_step('phase-1', 500, 'Step 500')
+    assert change.call_count == 2
+
+    # Completing the phase
+    prog.set_step('phase-1', 1000, 'Done')
+    assert change.call_count == 3
+
+    prog.start('phase-2')
+    prog.set_step('phase-2', 1, 'Phase 2 done')
+    assert change.call_count == 5
+
+
+def test_last_coalesced_step_delivered(mocker, monkeypatch):
+    import kano_updater.progress as progress
+
+    clock = mocker.MagicMock(return_value=1000.0)
+    monkeypatch.setattr(progress.time, 'time', clock)
+
+    timers = []
+
+    class Timer(object):
+        def __init__(self, interval, function):
+            self.interval = interval
+            self.function = function
+            timers.append(self)
+
+        def start(self):
+            pass
+
+        def cancel(self):
+            pass
+
+    monkeypatch.setattr(progress.threading, 'Timer', Timer)
+
+    prog = progress.CLIProgress(throttle_interval=1)
+    change = mocker.MagicMock()
+    monkeypatch.setattr(prog, '_change', change)
+
+    prog.split(
+        progress.Phase('phase-1', 'Phase 1'),
+        progress.Phase('phase-2', 'Phase 2')
+    )
+    prog.init_steps('phase-1', 100)
+    prog.start('phase-1')
+
+    # A burst only schedules the last step, which goes out once the interval
+    # is over
+    for step in xrange(1, 10):
+        prog.set_step('phase-1', step, 'Step {}'.format(step))
+    assert change.call_count == 1
+    assert len(timers) == 1
+    assert timers[0].interval == 1
+
+    clock.return_value += 1
+    timers[0].function()
+    assert change.call_count == 2
+    assert change.call_args[0][1] == 'Step 9'
+    assert prog._pending_step is None
+
+    # A phase transition passes it on first
+    prog.set_step('phase-1', 10, 'Step 10')
+    prog.start('phase-2')
+    assert [call[0][1] for call in change.call_args_list[2:]] == \
+        ['Step 10', 'Phase 2']
+
+
+def test_progress_bus(mocker, monkeypatch):
+    import threading
+    import kano_updater.progress as progress
+
+    prog = progress.CLIProgress(throttle_interval=0)
+    monkeypatch.setattr(prog, '_change', mocker.MagicMock())
+    monkeypatch.setattr(prog, '_done', mocker.MagicMock())
+
+    prog.split(progress.Phase('phase-1', 'Phase 1', is_main=True))
+    prog.init_steps('phase-1', 1000)
+
+    events = []
+    subscriber = prog.subscribe(events.append)
+
+    # A sink which can't keep up doesn't hold the progress back
+    released = threading.Event()
+    slow_events = []
+
+    def slow_sink(event):
+        released.wait()
+        slow_events.append(event)
+
+    slow_subscriber = prog.subscribe(slow_sink, queue_size=10)
+
+    prog.start('phase-1')
+    for step in xrange(1, 100):
+        prog.set_step('phase-1', step, 'Step {}'.format(step))
+
+    assert slow_subscriber.dropped > 0
+
+    released.set()
+    prog.finish('Done')
+
+    assert [event.kind for event in events] == \
+        [progress.EVENT_START] + [progress.EVENT_STEP] * 99 + \
+        [progress.EVENT_DONE]
+    assert events[1].phase == 'phase-1'
+    assert events[1].main_label == 'Phase 1'
+    assert events[-1].global_percent == 100
+
+    # The outcome makes it through in any case
+    assert len(slow_events) < 50
+    assert slow_events[-1].kind == progress.EVENT_DONE
+
+    prog.unsubscribe(subscriber)
+    prog.unsubscribe(slow_subscriber)
+
+
+def test_dummy_progress_has_no_subscribers():
+    import kano_updater.progress as progress
+
+    assert len(progress.DummyProgress()._bus) == 0
+    assert len(progress.CLIProgress()._bus) == 1
+
+
+def test_flush_timeout_logged(mocker, monkeypatch):
+    import threading
+    import kano_updater.progress as progress
+
+    logger = mocker.MagicMock()
+    monkeypatch.setattr(progress, 'logger', logger)
+
+    released = threading.Event()
+    bus = progress.ProgressBus()
+    subscriber = bus.subscribe(lambda event: released.wait())
+
+    subscriber.put(mocker.MagicMock(kind=progress.EVENT_FAIL))
+    bus.flush(timeout=0.1)
+
+    assert logger.warn.call_count == 1
+
+    released.set()
+    bus.flush()
+    assert logger.warn.call_count == 1
+
+    bus.unsubscribe(subscriber)
@@ -0,0 +1,75 @@
+#
+# test_progress_stream.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Tests for the `kano_updater.progress_stream` module
+#
+
+
+import os
+import json
+
+
+def test_stream_progress(mocker, monkeypatch):
+    import kano_updater.progress as progress
+    from kano_updater.progress_stream import stream_progress
+
+    prog = progress.CLIProgress(throttle_interval=0)
+    monkeypatch.setattr(prog, '_change', mocker.MagicMock())
+    monkeypatch.setattr(prog, '_done', mocker.MagicMock())
+
+    read_fd, write_fd = os.pipe()
+
+    try:
+        assert stream_progress(prog, write_fd)
+
+        prog.split(progress.Phase('download', 'Download', is_main=True))
+        prog.split(
+            progress.Phase('fetch', 'Fetch'),
+            phase_name='download'
+        )
+        prog.init_steps('fetch', 2)
+
+        prog.start('fetch')
+        prog.set_bytes('fetch', 100, 300)
+        prog.next_step('fetch', u'Downloading p\xe2ckage')
+        prog.finish('Done')
+
+        os.close(write_fd)
+        write_fd = None
+
+        with os.fdopen(read_fd) as stream:
+            read_fd = None
+            events = [json.loads(line) for line in stream]
+    finally:
+        for fd in (read_fd, write_fd):
+            if fd is not None:
+                os.close(fd)
+
+    assert [event['event'] for event in events] == ['start', 'step', 'done']
+
+    step = events[1]
+    assert step['path'] == ['download', 'fetch']
+    assert step['main_phase'] == 'download'
+    assert step['percent'] == 50
+    assert step['step'] == 1
+    assert step['step_count'] == 2
+    assert step['bytes_done'] == 100
+    assert step['bytes_total'] == 300
+    assert step['msg'] == u'Downloading p\xe2ckage'
+    assert step['elapsed'] >= 0
+
+    assert events[2]['percent'] == 100
+
+
+def test_stream_progress_bad_fd():
+    from kano_updater.progress import CLIProgress
+    from kano_updater.progress_stream import stream_progress
+
+    read_fd, write_fd = os.pipe()
+    os.close(read_fd)
+    os.close(write_fd)
+
+    assert stream_progress(CLIProgress(), write_fd) is None
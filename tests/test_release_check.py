@@ -0,0 +1,99 @@
+#
+# test_release_check.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Tests for the `kano_updater.release_check` module
+#
+
+
+import threading
+import BaseHTTPServer
+
+import pytest
+
+
+class ReleaseHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''
+    Serves InRelease files with an ETag, honouring If-None-Match
+    '''
+
+    protocol_version = 'HTTP/1.1'
+
+    etag = '"1"'
+    requests = []
+
+    def do_HEAD(self):
+        self.requests.append((self.command, self.path))
+
+        if self.headers.get('If-None-Match') == self.etag:
+            self.send_response(304)
+        else:
+            self.send_response(200)
+            self.send_header('ETag', self.etag)
+            self.send_header('Content-Length', '1024')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def sources_list(tmpdir):
+    ReleaseHandler.etag = '"1"'
+    ReleaseHandler.requests = []
+
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), ReleaseHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    path = tmpdir.join('kano-repos.list')
+    path.write(
+        '# Kano repositories\n'
+        'deb http://127.0.0.1:{0}/archive/ stretch main\n'
+        'deb [arch=armhf] http://127.0.0.1:{0}/archive stretch contrib\n'
+        'deb-src http://127.0.0.1:{0}/archive stretch main\n'
+        .format(server.server_address[1])
+    )
+
+    yield str(path)
+
+    server.shutdown()
+    server.server_close()
+
+
+def test_release_urls(sources_list):
+    from kano_updater.release_check import get_release_urls
+
+    urls = get_release_urls(sources_list)
+
+    assert len(urls) == 1
+    assert urls[0].endswith('/archive/dists/stretch/InRelease')
+
+
+def test_check_releases(sources_list):
+    from kano_updater.release_check import check_releases
+
+    changed, validators = check_releases(sources_list, {})
+    assert changed
+    assert validators.values() == [{'etag': '"1"'}]
+
+    changed, validators = check_releases(sources_list, validators)
+    assert changed is False
+    assert ReleaseHandler.requests[-1][0] == 'HEAD'
+
+    ReleaseHandler.etag = '"2"'
+    changed, validators = check_releases(sources_list, validators)
+    assert changed
+    assert validators.values() == [{'etag': '"2"'}]
+
+
+def test_check_releases_unreachable(tmpdir):
+    from kano_updater.release_check import check_releases
+
+    path = tmpdir.join('kano-repos.list')
+    path.write('deb http://127.0.0.1:1/archive stretch main\n')
+
+    assert check_releases(str(path), {}) == (None, {})
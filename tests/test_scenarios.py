@@ -46,3 +46,38 @@ def test_postupdate_scenario_beta_4_1_1_to_beta_4_2_0_ensures_netifnames(cmdline
     post_update.beta_4_1_1_to_beta_4_2_0(None)
 
     assert 'net.ifnames=0' in cmdline_txt.contents
+
+
+def test_scenarios_resume_skips_completed_steps(apt, monkeypatch):
+    import kano_updater.scenarios
+    from kano_updater.os_version import OSVersion
+    from kano_updater.scenarios import Scenarios
+
+    monkeypatch.setattr(
+        kano_updater.scenarios, 'get_target_version',
+        lambda: OSVersion.from_version_string('Kanux-Beta-4.3.0-Hopper')
+    )
+
+    ran = []
+
+    class TestScenarios(Scenarios):
+        _type = 'test'
+
+        def _mapping(self):
+            self.add_scenario('Kanux-Beta-4.1.1-Hopper',
+                              'Kanux-Beta-4.2.0-Hopper',
+                              lambda progress: ran.append('4.2.0'))
+            self.add_scenario('Kanux-Beta-4.2.0-Hopper',
+                              'Kanux-Beta-4.3.0-Hopper',
+                              lambda progress: ran.append('4.3.0'))
+
+    done = []
+    TestScenarios('Kanux-Beta-4.1.1-Hopper').run(None, on_step=done.append)
+
+    assert ran == ['4.2.0', '4.3.0']
+    assert len(done) == 2
+
+    del ran[:]
+    TestScenarios('Kanux-Beta-4.1.1-Hopper').run(None, completed=done[:1])
+
+    assert ran == ['4.3.0']
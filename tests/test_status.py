@@ -0,0 +1,96 @@
+#
+# test_status.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Tests for the `kano_updater.status.UpdaterStatus()` class
+#
+
+
+import json
+
+import pytest
+
+
+@pytest.fixture
+def status(state, mocker, monkeypatch):
+    import kano_updater.status
+    from kano_updater.status import UpdaterStatus
+
+    for hook in ('enable_system_recovery_flow', 'cancel_system_recovery_flow'):
+        monkeypatch.setattr(kano_updater.status, hook, mocker.MagicMock())
+
+    UpdaterStatus._singleton_instance = None
+    yield UpdaterStatus.get_instance()
+    UpdaterStatus._singleton_instance = None
+
+
+def read_status():
+    with open('/var/cache/kano-updater/status.json') as status_file:
+        return json.load(status_file)
+
+
+def test_save_is_atomic(status, mocker, monkeypatch):
+    import kano_updater.status
+
+    status.last_check = 123
+    status.save()
+
+    assert read_status()['last_check'] == 123
+
+    # A failed write leaves the previous status in place
+    monkeypatch.setattr(
+        kano_updater.status.json, 'dump', mocker.MagicMock(side_effect=IOError)
+    )
+    status.last_check = 456
+    with pytest.raises(IOError):
+        status.save()
+
+    assert read_status()['last_check'] == 123
+
+
+def test_transaction_coalesces_saves(status, mocker, monkeypatch):
+    write = mocker.MagicMock(side_effect=status._write)
+    monkeypatch.setattr(status, '_write', write)
+
+    with status.transaction():
+        status.last_check = 1
+        status.save()
+
+        with status.transaction():
+            status.last_update = 2
+            status.save()
+
+        assert write.call_count == 0
+
+    assert write.call_count == 1
+    assert read_status()['last_check'] == 1
+    assert read_status()['last_update'] == 2
+
+    with status.transaction():
+        pass
+
+    assert write.call_count == 1
+
+
+def test_recovery_hooks_only_when_flipped(status):
+    import kano_updater.status
+    from kano_updater.status import UpdaterStatus
+
+    enable = kano_updater.status.enable_system_recovery_flow
+    cancel = kano_updater.status.cancel_system_recovery_flow
+
+    status.save()
+    status.save()
+    assert cancel.call_count == 1
+
+    status.state = UpdaterStatus.INSTALLING_UPDATES
+    status.save()
+    status.save()
+    assert enable.call_count == 1
+
+    status.state = UpdaterStatus.UPDATES_INSTALLED
+    status.save()
+    assert cancel.call_count == 2
+    assert enable.call_count == 1
@@ -0,0 +1,170 @@
+#
+# test_status_channel.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Tests for the `kano_updater.status_channel` module
+#
+
+
+import os
+
+import pytest
+
+
+PROC_NET_UNIX_HEADER = \
+    'Num       RefCount Protocol Flags    Type St Inode Path\n'
+
+
+def make_proc_net_unix(tmpdir, paths):
+    lines = [PROC_NET_UNIX_HEADER]
+    for inode, path in enumerate(paths):
+        lines.append(
+            '0000000000000000: 00000002 00000000 00000000 0002 01 {} {}\n'
+            .format(1000 + inode, path)
+        )
+
+    # Unnamed sockets don't have a path
+    lines.append('0000000000000000: 00000002 00000000 00000000 0002 01 999\n')
+
+    proc_net_unix = tmpdir.join('unix')
+    proc_net_unix.write(''.join(lines))
+
+    return str(proc_net_unix)
+
+
+@pytest.fixture
+def status(mocker):
+    status = mocker.MagicMock()
+    status.state = 'updates-downloaded'
+    status.is_scheduled = True
+    status.is_urgent = False
+    status.notifications_muted = False
+    status.last_check = 100
+    status.last_check_urgent = 200
+    status.last_update = 300
+
+    return status
+
+
+def test_record_round_trip(status):
+    from kano_updater.status_channel import make_record, parse_record
+
+    record = make_record(status)
+
+    assert record == '1 updates-downloaded 1 0 0 100 200 300\n'
+    assert parse_record(record) == {
+        'state': 'updates-downloaded',
+        'is_scheduled': 1,
+        'is_urgent': 0,
+        'notifications_muted': 0,
+        'last_check': 100,
+        'last_check_urgent': 200,
+        'last_update': 300,
+    }
+
+    assert parse_record('2' + record[1:]) is None
+    assert parse_record('1 updates-downloaded 1 0\n') is None
+    assert parse_record('1 updates-downloaded 1 0 0 100 200 never\n') is None
+
+
+def test_every_state_fits_record(status):
+    '''
+    Tests that the lxpanel plugin can read every state from the record
+    '''
+
+    import re
+    from kano_updater.status import UpdaterStatus
+    from kano_updater.status_channel import make_record, parse_record
+
+    plugin_path = os.path.join(
+        os.path.dirname(__file__), '..', 'lxpanel-plugin', 'kano_updater.c'
+    )
+    with open(plugin_path, 'r') as plugin_file:
+        plugin_source = plugin_file.read()
+
+    max_length = int(re.search(
+        r'#define MAX_STATE_LENGTH (\d+)', plugin_source
+    ).group(1))
+    assert '%d %{}s'.format(max_length - 1) in plugin_source
+
+    for state in UpdaterStatus._valid_states:
+        assert len(state) < max_length
+        assert ' ' not in state
+
+        status.state = state
+        assert parse_record(make_record(status))['state'] == state
+
+
+def test_find_subscribers(tmpdir):
+    from kano_updater.status_channel import find_subscribers
+
+    proc_net_unix = make_proc_net_unix(tmpdir, [
+        '@kano-updater-status.123',
+        '/run/dbus/system_bus_socket',
+        '@kano-updater-status.456',
+        '@kano-updater-status.123',
+        '@other-socket',
+    ])
+
+    assert find_subscribers(proc_net_unix) == [
+        '\0kano-updater-status.123', '\0kano-updater-status.456'
+    ]
+    assert find_subscribers(str(tmpdir.join('missing'))) == []
+
+
+def test_publish(status, tmpdir):
+    from kano_updater.status_channel import Subscriber, make_record, \
+        publish, read_record
+
+    record_path = str(tmpdir.join('status.record'))
+    name = 'test-{}'.format(os.getpid())
+    subscriber = Subscriber(name=name)
+
+    try:
+        proc_net_unix = make_proc_net_unix(tmpdir, [
+            '@kano-updater-status.{}'.format(name),
+            # Left behind by a subscriber which is gone
+            '@kano-updater-status.gone-{}'.format(name),
+        ])
+
+        record = make_record(status)
+        assert publish(record, record_path, proc_net_unix) == 1
+
+        received = subscriber.receive(timeout=1)
+        assert received['state'] == 'updates-downloaded'
+        assert received == read_record(record_path)
+
+        assert subscriber.receive(timeout=0) is None
+    finally:
+        subscriber.close()
+
+
+def test_status_published_on_change(state, mocker, monkeypatch):
+    import kano_updater.status
+    from kano_updater.status import UpdaterStatus
+
+    for hook in ('enable_system_recovery_flow', 'cancel_system_recovery_flow'):
+        monkeypatch.setattr(kano_updater.status, hook, mocker.MagicMock())
+
+    publish = mocker.MagicMock()
+    monkeypatch.setattr(kano_updater.status, 'publish', publish)
+
+    UpdaterStatus._singleton_instance = None
+    status = UpdaterStatus.get_instance()
+
+    try:
+        status.save()
+        publish_count = publish.call_count
+
+        # Nothing the subscribers care about changed
+        status.save()
+        assert publish.call_count == publish_count
+
+        status.last_check = 123
+        status.save()
+        assert publish.call_count == publish_count + 1
+        assert ' 123 ' in publish.call_args[0][0]
+    finally:
+        UpdaterStatus._singleton_instance = None
@@ -0,0 +1,158 @@
+#
+# test_upgrade_plan.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Tests for the `kano_updater.upgrade_plan` module
+#
+
+
+import pytest
+
+
+@pytest.fixture
+def wrapper(apt, tmpdir, monkeypatch):
+    from kano_updater.apt_wrapper import AptWrapper
+
+    monkeypatch.setattr(
+        AptWrapper, '_plan_file', str(tmpdir.join('upgrade-plan.json'))
+    )
+
+    wrapper = AptWrapper.get_instance()
+    monkeypatch.setattr(wrapper, '_lists_fingerprint', 'lists-1')
+
+    return wrapper
+
+
+def test_saved_plan_round_trip(wrapper, mocker, monkeypatch):
+    '''
+    Tests that a saved plan is picked up again without running the resolver
+    '''
+
+    import kano_updater.priority as Priority
+
+    plan = wrapper.get_upgrade_plan()
+    wrapper.save_upgrade_plan(plan)
+
+    # A new cache generation, as with an install started later on
+    wrapper.clear_cache()
+    monkeypatch.setattr(wrapper, '_lists_fingerprint', 'lists-1')
+    upgrade = mocker.MagicMock()
+    monkeypatch.setattr(wrapper._cache, 'upgrade', upgrade)
+
+    loaded = wrapper.load_upgrade_plan()
+
+    assert loaded.changes == plan.changes
+    assert loaded.required_space == plan.required_space
+    assert loaded.generation == wrapper._cache_generation
+    assert wrapper.get_upgrade_plan() is loaded
+    assert upgrade.call_count == 0
+
+    # Only valid for the priority it was solved for
+    assert wrapper.load_upgrade_plan(priority=Priority.URGENT) is None
+
+    wrapper.remove_upgrade_plan()
+    assert wrapper.load_upgrade_plan() is None
+
+
+def test_saved_plan_invalidated(wrapper, monkeypatch):
+    '''
+    Tests that a saved plan is dropped when the package lists or the
+    installed packages changed since it was solved
+    '''
+
+    wrapper.save_upgrade_plan(wrapper.get_upgrade_plan())
+    assert wrapper.load_upgrade_plan()
+
+    monkeypatch.setattr(wrapper, '_lists_fingerprint', 'lists-2')
+    assert wrapper.load_upgrade_plan() is None
+
+    monkeypatch.setattr(wrapper, '_lists_fingerprint', 'lists-1')
+    pkg = wrapper._cache['test-pkg-1']
+
+    # Installed by an interrupted run of the same plan
+    pkg.installed.is_installed = False
+    pkg.candidate.is_installed = True
+    assert wrapper.load_upgrade_plan()
+
+    monkeypatch.setattr(pkg.candidate, 'version', '1.4-0')
+    assert wrapper.load_upgrade_plan() is None
+
+
+def test_split_batches():
+    '''
+    Tests that related packages always share a batch and unrelated ones are
+    packed up to the batch size
+    '''
+
+    from kano_updater.upgrade_plan import split_batches
+
+    names = ['a', 'b', 'c', 'd', 'e', 'f']
+    relations = {
+        'a': set(['c', 'not-changed']),
+        'd': set(['e']),
+        'e': set(['c']),
+    }
+
+    batches = split_batches(names, relations, max_size=2)
+
+    assert sorted(name for batch in batches for name in batch) == names
+    assert ['a', 'c', 'd', 'e'] in batches
+    assert all(len(batch) <= 2 for batch in batches if 'a' not in batch)
+    assert len(batches) == 2
+
+    assert split_batches(names, {}, max_size=4) == [
+        ['a', 'b', 'c', 'd'], ['e', 'f']
+    ]
+
+
+def test_staged_commit(wrapper, mocker, monkeypatch):
+    '''
+    Tests that the upgrade is committed batch by batch with a sync after each
+    and that the batches installed by an interrupted run are skipped
+    '''
+
+    import kano_updater.upgrade_plan
+    from apt.package import BaseDependency, Dependency
+    from kano_updater.progress import CLIProgress
+
+    split_batches = kano_updater.upgrade_plan.split_batches
+    monkeypatch.setattr(
+        'kano_updater.apt_wrapper.split_batches',
+        lambda names, relations: split_batches(names, relations, 1)
+    )
+
+    wrapper._cache['test-pkg-1'].candidate.dependencies.append(
+        Dependency([BaseDependency('test-pkg-2')])
+    )
+
+    sync = mocker.MagicMock()
+    monkeypatch.setattr(wrapper, '_sync', sync)
+    commit = mocker.MagicMock(side_effect=wrapper._cache.commit)
+    monkeypatch.setattr(wrapper._cache, 'commit', commit)
+
+    plan = wrapper.get_upgrade_plan()
+    batches = [set(batch) for batch in plan.batches]
+    assert set(['test-pkg-1', 'test-pkg-2']) in batches
+    assert len(batches) == len(plan) - 1
+
+    # An earlier run got through the first batch
+    for name in plan.batches[0]:
+        pkg = wrapper._cache[name]
+        pkg.mark_upgrade()
+        pkg.do_upgrade()
+        pkg.mark_keep()
+
+    recorded = []
+    wrapper.upgrade_all(
+        progress=CLIProgress(), plan=plan, skip_batches=1,
+        on_batch=lambda *args: recorded.append(args)
+    )
+
+    assert commit.call_count == len(batches) - 1
+    assert sync.call_count == commit.call_count
+    assert [args[0] for args in recorded if args[2]] == \
+        range(1, len(batches))
+    for pkg in wrapper._cache:
+        assert pkg.installed == pkg.candidate
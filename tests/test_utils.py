@@ -0,0 +1,98 @@
+#
+# test_utils.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Tests for the `kano_updater.utils` module
+#
+
+
+import time
+import threading
+import BaseHTTPServer
+
+import pytest
+
+
+class RepoHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    status = 200
+    requests = []
+
+    def do_HEAD(self):
+        self.requests.append(self.path)
+        self.send_response(self.status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def repo_server(apt, monkeypatch):
+    import kano_updater.utils
+    monkeypatch.setattr(kano_updater.utils, '_server_probes', {})
+
+    RepoHandler.status = 200
+    RepoHandler.requests = []
+
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), RepoHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    yield 'http://127.0.0.1:{}/archive/dists/stretch/InRelease'.format(
+        server.server_address[1]
+    )
+
+    server.shutdown()
+    server.server_close()
+
+
+def test_server_available(repo_server, monkeypatch):
+    import kano_updater.http_pool
+    import kano_updater.utils
+    from kano_updater.utils import is_server_available
+
+    assert is_server_available(repo_server)
+    assert RepoHandler.requests == ['/archive/dists/stretch/InRelease']
+
+    # Nothing is left open behind the probe
+    assert not any(kano_updater.http_pool._idle.values())
+
+    # The result is cached for a while
+    RepoHandler.status = 503
+    assert is_server_available(repo_server)
+    assert len(RepoHandler.requests) == 1
+
+    monkeypatch.setattr(kano_updater.utils, 'SERVER_PROBE_TTL', 0)
+    assert not is_server_available(repo_server)
+
+
+def test_server_unreachable(repo_server):
+    from kano_updater.utils import is_server_available
+
+    assert not is_server_available('http://127.0.0.1:1/')
+
+
+def test_connectivity_checked_concurrently(apt, monkeypatch):
+    import kano.network
+    import kano_updater.utils
+
+    def slow_check(result):
+        def check(*args):
+            time.sleep(0.5)
+            return result
+        return check
+
+    monkeypatch.setattr(kano.network, 'is_internet', slow_check(True))
+    monkeypatch.setattr(
+        kano_updater.utils, 'is_server_available', slow_check(False)
+    )
+
+    start = time.time()
+    assert kano_updater.utils.check_connectivity() == (True, False)
+    assert time.time() - start < 0.9